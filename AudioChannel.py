@@ -0,0 +1,169 @@
+import threading
+import time
+from collections import deque
+from Telemetry import Trace
+
+# what ``put`` does when the channel is full: "block" the recorder, "drop_oldest" queued audio,
+# or "merge" new audio into the newest queued chunk so the transcriber catches up with fewer, longer decodes
+OVERFLOW_POLICY = "merge"
+POLICIES = ("block", "drop_oldest", "merge")
+MAX_CHUNKS = 8
+MAX_SECONDS = 30
+# merged chunks stay shorter than the transcriber's streaming window so no audio is cut from them
+MAX_MERGE_SECONDS = 10
+# chunks further apart than this belong to different phrases and are never merged
+MAX_MERGE_GAP_SECONDS = 3
+# weight of the newest chunk in the running average of time spent queued
+TIME_IN_QUEUE_SMOOTHING = 0.1
+
+
+class AudioChunk:
+    __slots__ = ('source_name', 'data', 'time_spoken', 'duration', 'enqueued_at', 'trace')
+
+    def __init__(self, source_name, data, time_spoken, duration, enqueued_at, trace):
+        self.source_name = source_name
+        self.data = data
+        self.time_spoken = time_spoken
+        self.duration = duration
+        self.enqueued_at = enqueued_at
+        self.trace = trace
+
+
+class AudioChannel:
+    """Bounded queue of recorded audio between a recorder and a transcriber, holding at most ``max_chunks`` chunks and ``max_seconds`` of audio."""
+
+    def __init__(self, policy=OVERFLOW_POLICY, max_chunks=MAX_CHUNKS, max_seconds=MAX_SECONDS,
+                 max_merge_seconds=MAX_MERGE_SECONDS, max_merge_gap=MAX_MERGE_GAP_SECONDS, session_id=None):
+        assert policy in POLICIES, f'Unknown audio channel policy {policy!r}'
+        self.session_id = session_id
+        self.policy = policy
+        self.max_chunks = max_chunks
+        self.max_seconds = max_seconds
+        self.max_merge_seconds = max_merge_seconds
+        self.max_merge_gap = max_merge_gap
+
+        self.chunks = deque()
+        self.queued_seconds = 0.0
+        self.condition = threading.Condition()
+        self.overloaded = False
+        self.closed = False
+        self.metrics = {
+            "chunks_in": 0,
+            "chunks_out": 0,
+            "merged_chunks": 0,
+            "dropped_chunks": 0,
+            "dropped_seconds": 0.0,
+            "blocked_seconds": 0.0,
+            "last_time_in_queue": 0.0,
+            "average_time_in_queue": 0.0,
+            "max_time_in_queue": 0.0,
+        }
+
+    def full(self, duration=0.0):
+        return len(self.chunks) >= self.max_chunks or self.queued_seconds + duration > self.max_seconds
+
+    def put(self, source_name, data, time_spoken, duration, timeout=None, captured_at=None):
+        """Queues ``duration`` seconds of audio, applying the overflow policy when the channel is full. Returns ``False`` if a blocking put timed out.
+
+        ``captured_at`` is the ``time.monotonic()`` at which the audio finished recording, it starts the chunk's trace. Audio put into a closed channel is discarded."""
+        trace = Trace(self.session_id, source_name)
+        trace.mark('capture_end', captured_at)
+        with self.condition:
+            if self.closed:
+                return False
+            self.metrics["chunks_in"] += 1
+            if self.full(duration):
+                self.report_overload()
+                if self.policy == "block":
+                    start_time = time.monotonic()
+                    ready = self.condition.wait_for(
+                        lambda: not self.full(duration) or not self.chunks or self.closed, timeout)
+                    self.metrics["blocked_seconds"] += time.monotonic() - start_time
+                    if not ready or self.closed:
+                        return False
+                elif self.policy == "merge" and self.merge(source_name, data, time_spoken, duration):
+                    return True
+                else:
+                    while self.chunks and self.full(duration):
+                        self.drop_oldest()
+            else:
+                self.overloaded = False
+
+            trace.mark('enqueue')
+            self.chunks.append(AudioChunk(source_name, data, time_spoken, duration, time.monotonic(), trace))
+            self.queued_seconds += duration
+            self.condition.notify_all()
+            return True
+
+    def merge(self, source_name, data, time_spoken, duration):
+        newest = self.chunks[-1] if self.chunks else None
+        if newest is None or newest.source_name != source_name \
+                or newest.duration + duration > self.max_merge_seconds \
+                or (time_spoken - newest.time_spoken).total_seconds() > self.max_merge_gap:
+            return False
+
+        # the merged chunk keeps its place in the queue, and the trace of its oldest audio, but ends where the new audio does
+        newest.data += data
+        newest.time_spoken = time_spoken
+        newest.duration += duration
+        self.queued_seconds += duration
+        self.metrics["merged_chunks"] += 1
+        while self.queued_seconds > self.max_seconds and len(self.chunks) > 1:
+            self.drop_oldest()
+        self.condition.notify_all()
+        return True
+
+    def drop_oldest(self):
+        chunk = self.chunks.popleft()
+        self.queued_seconds -= chunk.duration
+        self.metrics["dropped_chunks"] += 1
+        self.metrics["dropped_seconds"] += chunk.duration
+
+    def report_overload(self):
+        if not self.overloaded:
+            self.overloaded = True
+            print(f"[INFO] Audio channel full ({len(self.chunks)} chunks, {self.queued_seconds:.1f}s), "
+                  f"transcription is falling behind, applying {self.policy} policy")
+
+    def get(self, timeout=None):
+        """Returns the oldest ``(source_name, data, time_spoken, trace)``, waiting for one if the channel is empty, or ``None`` once the channel is closed. Raises ``TimeoutError`` if none arrives within ``timeout``."""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.chunks or self.closed, timeout):
+                raise TimeoutError('no audio queued')
+            if self.closed:
+                return None
+            chunk = self.chunks.popleft()
+            self.queued_seconds -= chunk.duration
+            self.record_time_in_queue(time.monotonic() - chunk.enqueued_at)
+            self.condition.notify_all()
+        chunk.trace.mark('dequeue')
+        return chunk.source_name, chunk.data, chunk.time_spoken, chunk.trace
+
+    def record_time_in_queue(self, waited):
+        self.metrics["chunks_out"] += 1
+        self.metrics["last_time_in_queue"] = waited
+        self.metrics["average_time_in_queue"] += TIME_IN_QUEUE_SMOOTHING * \
+            (waited - self.metrics["average_time_in_queue"])
+        self.metrics["max_time_in_queue"] = max(self.metrics["max_time_in_queue"], waited)
+
+    def qsize(self):
+        return len(self.chunks)
+
+    def clear(self):
+        with self.condition:
+            self.chunks.clear()
+            self.queued_seconds = 0.0
+            self.condition.notify_all()
+
+    def close(self):
+        # wakes the lane waiting in ``get`` and any recorder blocked in ``put``, queued audio is dropped
+        with self.condition:
+            self.closed = True
+            self.chunks.clear()
+            self.queued_seconds = 0.0
+            self.condition.notify_all()
+
+    def snapshot(self):
+        with self.condition:
+            return dict(self.metrics, depth=len(self.chunks), queued_seconds=self.queued_seconds,
+                        policy=self.policy)
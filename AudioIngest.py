@@ -0,0 +1,186 @@
+from collections import deque
+from datetime import datetime, timedelta
+import numpy as np
+import custom_speech_recognition as sr
+from custom_speech_recognition import dsp
+from AudioRecorder import VAD_BACKEND
+
+# uploaded and streamed audio is checked for speech in blocks of this many milliseconds
+INGEST_FRAME_MS = 30
+# seconds of non-speech that end a segment
+PAUSE_SECONDS = 0.8
+# segments with less speech than this are clicks and pops, not phrases
+MIN_SPEECH_SECONDS = 0.3
+# Whisper decodes 30 second windows, longer segments are split so no audio is cut off
+MAX_SEGMENT_SECONDS = 25
+# seconds of non-speech kept before each segment
+PADDING_SECONDS = 0.3
+# range of sample rates accepted for uploaded and streamed audio
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 192000
+SAMPLE_WIDTHS = (1, 2, 3, 4)
+
+
+class SpeechSegmenter:
+    """Splits a stream of raw PCM into speech segments using a voice activity detector, keeping track of where each starts."""
+
+    def __init__(self, sample_rate, sample_width=2, channels=1, vad=None, frame_ms=INGEST_FRAME_MS,
+                 pause_seconds=PAUSE_SECONDS, min_speech_seconds=MIN_SPEECH_SECONDS,
+                 max_segment_seconds=MAX_SEGMENT_SECONDS, padding_seconds=PADDING_SECONDS):
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.channels = channels
+        self.vad = vad if vad is not None else sr.create_vad(VAD_BACKEND)
+
+        self.frame_seconds = frame_ms / 1000
+        self.frame_bytes = sample_rate * frame_ms // 1000 * sample_width * channels
+        self.pause_frames = int(pause_seconds / self.frame_seconds)
+        self.min_speech_frames = int(min_speech_seconds / self.frame_seconds)
+        self.max_segment_bytes = int(max_segment_seconds / self.frame_seconds) * self.frame_bytes
+
+        self._pending = bytearray()
+        self._pre_roll = deque(maxlen=int(padding_seconds / self.frame_seconds))
+        self._segment = None
+        self._segment_start = 0.0
+        self._speech_frames = 0
+        self._silent_frames = 0
+        self.position = 0.0
+
+    def feed(self, data):
+        """Returns the ``(start_seconds, pcm)`` segments completed by ``data``."""
+        segments = []
+        self._pending += data
+        processed = 0
+        while len(self._pending) - processed >= self.frame_bytes:
+            frame = bytes(self._pending[processed:processed + self.frame_bytes])
+            processed += self.frame_bytes
+            segment = self.process_frame(frame)
+            if segment is not None:
+                segments.append(segment)
+        del self._pending[:processed]
+        return segments
+
+    def process_frame(self, frame):
+        speech = self.vad.is_speech(frame, self.sample_rate, self.sample_width, self.channels)
+        segment = None
+
+        if self._segment is None:
+            if speech:
+                self._segment = bytearray(b''.join(self._pre_roll))
+                self._segment_start = self.position - len(self._pre_roll) * self.frame_seconds
+                self._segment += frame
+                self._speech_frames = 1
+                self._silent_frames = 0
+                self._pre_roll.clear()
+            else:
+                self._pre_roll.append(frame)
+        else:
+            self._segment += frame
+            if speech:
+                self._speech_frames += 1
+                self._silent_frames = 0
+            else:
+                self._silent_frames += 1
+            if self._silent_frames >= self.pause_frames or len(self._segment) >= self.max_segment_bytes:
+                segment = self.close_segment()
+
+        self.position += self.frame_seconds
+        return segment
+
+    def close_segment(self):
+        segment = None
+        if self._speech_frames >= self.min_speech_frames:
+            segment = (self._segment_start, bytes(self._segment))
+        self._segment = None
+        return segment
+
+    def flush(self):
+        """Returns the segment in progress at the end of the stream, if any."""
+        if self._segment is None:
+            self._pending.clear()
+            return None
+        self._segment += self._pending
+        self._pending.clear()
+        return self.close_segment()
+
+
+def read_audio_file(file):
+    """Returns ``(pcm, sample_rate)`` for a WAV file path or file-like object, as 16-bit mono PCM."""
+    with sr.AudioFile(file) as source:
+        data = source.stream.read()
+        if source.SAMPLE_WIDTH == 1:
+            # 8-bit WAV samples are unsigned, centred on 128
+            data = dsp.bias(data, 1, -128)
+        return dsp.lin2lin(data, source.SAMPLE_WIDTH, 2), source.SAMPLE_RATE
+
+
+def check_format(sample_rate, sample_width, channels):
+    """Raises ``ValueError`` unless the audio format is one that can be segmented and resampled for Whisper."""
+    if not MIN_SAMPLE_RATE <= sample_rate <= MAX_SAMPLE_RATE:
+        raise ValueError(f'Sample rate must be between {MIN_SAMPLE_RATE} and {MAX_SAMPLE_RATE}, got {sample_rate}')
+    if sample_width not in SAMPLE_WIDTHS:
+        raise ValueError(f'Sample width must be one of {SAMPLE_WIDTHS} bytes, got {sample_width}')
+    if channels < 1:
+        raise ValueError(f'Channel count must be at least 1, got {channels}')
+
+
+def transcribe_file(file, model, vad=None):
+    """
+    Splits an audio file into speech segments and decodes them all at once through ``model`` (an ``InferenceScheduler``), which batches them, so long files are transcribed much faster than real time.
+
+    Returns ``(start_seconds, end_seconds, text)`` for every segment that produced text, in order.
+    """
+    data, sample_rate = read_audio_file(file)
+    check_format(sample_rate, 2, 1)
+    segmenter = SpeechSegmenter(sample_rate, vad=vad)
+    segments = segmenter.feed(data)
+    last_segment = segmenter.flush()
+    if last_segment is not None:
+        segments.append(last_segment)
+
+    futures = [model.submit(np.frombuffer(pcm, dtype=np.int16), sample_rate) for _, pcm in segments]
+    phrases = []
+    for (start, pcm), future in zip(segments, futures):
+        text = future.result()
+        if text != '' and text.lower() != 'you':
+            phrases.append((start, start + len(pcm) / (2 * sample_rate), text))
+    return phrases
+
+
+class StreamIngest:
+    """Segments raw PCM pushed by a client, such as a browser, and queues the speech into an ``AudioChannel`` for a transcription lane, the same way a recorder does."""
+
+    def __init__(self, source_name, audio_channel, sample_rate, sample_width=2, channels=1, vad=None):
+        check_format(sample_rate, sample_width, channels)
+        self.source_name = source_name
+        self.audio_channel = audio_channel
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.channels = channels
+        self.segmenter = SpeechSegmenter(sample_rate, 2, channels, vad)
+        self.started = datetime.utcnow()
+
+    def feed(self, data):
+        """Raises ``TypeError`` or ``ValueError`` for a chunk that isn't whole samples of raw PCM."""
+        if not isinstance(data, (bytes, bytearray)):
+            raise TypeError(f'Audio chunks must be binary, got {type(data).__name__}')
+        if len(data) % self.sample_width:
+            raise ValueError(f'Audio chunk of {len(data)} bytes is not whole {self.sample_width} byte samples')
+        if self.sample_width == 1:
+            # 8-bit PCM is unsigned, centred on 128
+            data = dsp.bias(data, 1, -128)
+        if self.sample_width != 2:
+            data = dsp.lin2lin(data, self.sample_width, 2)
+        for segment in self.segmenter.feed(data):
+            self.queue_segment(*segment)
+
+    def queue_segment(self, start, pcm):
+        duration = len(pcm) / (2 * self.channels * self.sample_rate)
+        # stamped with when the segment ended in the stream, like recorded phrases are
+        time_spoken = self.started + timedelta(seconds=start + duration)
+        self.audio_channel.put(self.source_name, pcm, time_spoken, duration)
+
+    def close(self):
+        segment = self.segmenter.flush()
+        if segment is not None:
+            self.queue_segment(*segment)
@@ -1,22 +1,41 @@
 import custom_speech_recognition as sr
-import pyaudiowpatch as pyaudio
+import time
 from datetime import datetime
+try:
+    import pyaudiowpatch as pyaudio
+except ImportError:
+    # no live capture without it (it is Windows only), uploaded and streamed audio still work
+    pyaudio = None
 
 RECORD_TIMEOUT = 3
+# voice activity detector deciding where phrases start and end: "energy", "spectral" or "webrtc" (needs webrtcvad)
+VAD_BACKEND = "spectral"
 ENERGY_THRESHOLD = 1000
 DYNAMIC_ENERGY_THRESHOLD = False
+# audio is read and checked for speech in blocks of this many milliseconds
+CHUNK_DURATION_MS = 30
+# 16, 24 or 32-bit integer PCM, captured audio is converted to 16-bit before it is queued
+SAMPLE_FORMAT = pyaudio.paInt16 if pyaudio is not None else None
+# let PortAudio push audio into a ring buffer from its own thread instead of blocking reads
+CALLBACK_MODE = True
+CAPTURE_BUFFER_SECONDS = 2
 
 class BaseRecorder:
     def __init__(self, source, source_name):
         self.recorder = sr.Recognizer()
         self.recorder.energy_threshold = ENERGY_THRESHOLD
         self.recorder.dynamic_energy_threshold = DYNAMIC_ENERGY_THRESHOLD
+        if VAD_BACKEND == "energy":
+            self.recorder.vad = sr.EnergyVAD(ENERGY_THRESHOLD, DYNAMIC_ENERGY_THRESHOLD)
+        else:
+            self.recorder.vad = sr.create_vad(VAD_BACKEND)
 
         if source is None:
             raise ValueError("audio source can't be None")
 
         self.source = source
         self.source_name = source_name
+        self.stop_listening = None
 
     def adjust_for_noise(self, device_name, msg):
         print(f"[INFO] Adjusting for ambient noise from {device_name}. " + msg)
@@ -26,13 +45,27 @@ class BaseRecorder:
 
     def record_into_queue(self, audio_queue):
         def record_callback(_, audio:sr.AudioData) -> None:
-            data = audio.get_raw_data()
-            audio_queue.put((self.source_name, data, datetime.utcnow()))
+            captured_at = time.monotonic()
+            data = audio.get_raw_data(convert_width=2)
+            duration = len(data) / (2 * self.source.channels * audio.sample_rate)
+            audio_queue.put(self.source_name, data, datetime.utcnow(), duration, captured_at=captured_at)
+
+        self.stop_listening = self.recorder.listen_in_background(
+            self.source, record_callback, phrase_time_limit=RECORD_TIMEOUT)
+
+    def stop(self, wait=True):
+        # the listener finishes the phrase it is recording, then closes the source's stream
+        if self.stop_listening is not None:
+            self.stop_listening(wait)
+
+def check_pyaudio():
+    if pyaudio is None:
+        raise AttributeError("Could not find PyAudioWPatch; check installation")
 
-        self.recorder.listen_in_background(self.source, record_callback, phrase_time_limit=RECORD_TIMEOUT)
 
 class DefaultSpeakerRecorder(BaseRecorder):
     def __init__(self):
+        check_pyaudio()
         with pyaudio.PyAudio() as p:
             wasapi_info = p.get_host_api_info_by_type(pyaudio.paWASAPI)
             default_speakers = p.get_device_info_by_index(wasapi_info["defaultOutputDevice"])
@@ -45,10 +78,37 @@ class DefaultSpeakerRecorder(BaseRecorder):
                 else:
                     print("[ERROR] No loopback device found.")
         
+        sample_rate = int(default_speakers["defaultSampleRate"])
         source = sr.Microphone(speaker=True,
                                device_index= default_speakers["index"],
-                               sample_rate=int(default_speakers["defaultSampleRate"]),
-                               chunk_size=pyaudio.get_sample_size(pyaudio.paInt16),
-                               channels=default_speakers["maxInputChannels"])
+                               sample_rate=sample_rate,
+                               chunk_size=sample_rate * CHUNK_DURATION_MS // 1000,
+                               channels=default_speakers["maxInputChannels"],
+                               sample_format=SAMPLE_FORMAT,
+                               callback_mode=CALLBACK_MODE,
+                               buffer_seconds=CAPTURE_BUFFER_SECONDS)
         super().__init__(source=source, source_name="Speaker")
-        self.adjust_for_noise("Default Speaker", "Please make or play some noise from the Default Speaker...")
\ No newline at end of file
+        self.adjust_for_noise("Default Speaker", "Please make or play some noise from the Default Speaker...")
+
+class DefaultMicRecorder(BaseRecorder):
+    def __init__(self):
+        check_pyaudio()
+        with pyaudio.PyAudio() as p:
+            default_mic = p.get_default_input_device_info()
+
+        sample_rate = int(default_mic["defaultSampleRate"])
+        source = sr.Microphone(device_index=default_mic["index"],
+                               sample_rate=sample_rate,
+                               chunk_size=sample_rate * CHUNK_DURATION_MS // 1000,
+                               sample_format=SAMPLE_FORMAT,
+                               callback_mode=CALLBACK_MODE,
+                               buffer_seconds=CAPTURE_BUFFER_SECONDS)
+        super().__init__(source=source, source_name="You")
+        self.adjust_for_noise("Default Mic", "Please make some noise from the Default Mic...")
+
+
+# source name -> recorder class, sessions capture from the sources listed in assistant.AUDIO_SOURCES
+RECORDERS = {
+    "Speaker": DefaultSpeakerRecorder,
+    "You": DefaultMicRecorder,
+}
@@ -1,36 +1,224 @@
 from queue import Queue
-import wave
-import os
+import math
+import string
 import threading
-import tempfile
-from datetime import timedelta
-import pyaudiowpatch as pyaudio
+from datetime import timedelta, timezone
+import numpy as np
+import TranscriberModels
+from TranscriptStore import TranscriptStore
 
 PHRASE_TIMEOUT = 3.05
 MAX_PHRASES = 10
+# longest stretch of not yet committed audio that is re-decoded for every new chunk
+STREAMING_WINDOW_SECONDS = 15
+# committed words passed to Whisper as the prompt, about 200 tokens, the tail of whatever was said before
+PROMPT_WORDS = 150
+# during continuous speech a phrase never times out, once this many words are committed it is sealed and the next
+# words start a new phrase
+MAX_PHRASE_WORDS = 120
+
+
+def is_confident(segment):
+    # the same rule batched decoding drops silence with, so a misheard noise never reaches the transcript and starts
+    # an LLM call; backends that don't report both probabilities are trusted
+    if segment.no_speech_prob is None or segment.avg_logprob is None:
+        return True
+    return not TranscriberModels.is_silence(segment.no_speech_prob, segment.avg_logprob)
+
+
+def to_timestamp(time_spoken):
+    # times are naive UTC datetimes, clients get seconds since the epoch
+    return time_spoken.replace(tzinfo=timezone.utc).timestamp()
+
+
+def describe_segments(segments, window_start, final_words):
+    # the segments of one decode as JSON-ready dicts with absolute times, the first ``final_words`` words are committed
+    described = []
+    index = 0
+    for segment in segments:
+        words = []
+        for word, start, end in segment.words:
+            words.append({"word": word.strip(), "start": window_start + start, "end": window_start + end,
+                          "final": index < final_words})
+            index += 1
+        described.append({
+            "text": segment.text,
+            "start": window_start + segment.start,
+            "end": window_start + segment.end,
+            "no_speech_prob": segment.no_speech_prob,
+            "avg_logprob": segment.avg_logprob,
+            "words": words,
+        })
+    return described
+
+
+def segment_confidence(segments):
+    # mean per-token probability of the segments, None if the backend didn't report one
+    logprobs = [segment.avg_logprob for segment in segments if segment.avg_logprob is not None]
+    return math.exp(sum(logprobs) / len(logprobs)) if logprobs else None
+
+
+def transcript_message(source, text, time_spoken, new_phrase=True, confidence=None, segments=()):
+    """The transcription event sent to clients. ``text`` is the whole phrase so far, a client replaces its latest line from ``source`` with it unless ``new_phrase`` is set. ``segments`` describe only the audio decoded for this update, with word times in seconds since the epoch; words before them in ``text`` are already final."""
+    return {
+        "type": "transcript",
+        "source": source,
+        "text": text,
+        "time": to_timestamp(time_spoken),
+        "new_phrase": new_phrase,
+        "confidence": confidence,
+        "segments": list(segments),
+    }
+
+
+class AudioRingBuffer:
+    def __init__(self, sample_rate, channels, max_seconds):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.max_seconds = max_seconds
+        self.capacity = int(sample_rate * max_seconds) * channels
+        self._buffer = np.zeros(self.capacity, dtype=np.int16)
+        self._start = 0
+        self._size = 0
+
+    @property
+    def duration(self):
+        return self._size / self.channels / self.sample_rate
+
+    def seconds_of(self, data):
+        return len(data) // 2 / self.channels / self.sample_rate
+
+    def append(self, data):
+        samples = np.frombuffer(data, dtype=np.int16)
+        if len(samples) > self.capacity:
+            samples = samples[-self.capacity:]
+
+        overflow = self._size + len(samples) - self.capacity
+        if overflow > 0:
+            self._discard_samples(overflow)
+
+        end = (self._start + self._size) % self.capacity
+        first = min(len(samples), self.capacity - end)
+        self._buffer[end:end + first] = samples[:first]
+        self._buffer[:len(samples) - first] = samples[first:]
+        self._size += len(samples)
+
+    def discard(self, seconds):
+        frames = min(int(seconds * self.sample_rate), self._size // self.channels)
+        self._discard_samples(frames * self.channels)
+
+    def _discard_samples(self, count):
+        self._start = (self._start + count) % self.capacity
+        self._size -= count
+
+    def get(self):
+        end = self._start + self._size
+        if end <= self.capacity:
+            return self._buffer[self._start:end].copy()
+        return np.concatenate((self._buffer[self._start:], self._buffer[:end - self.capacity]))
+
+    def clear(self):
+        self._start = 0
+        self._size = 0
+
+
+class LocalAgreement:
+    # commits the words that two consecutive hypotheses of the same audio agree on
+    def __init__(self):
+        self.committed = []
+        self.hypothesis = []
+        # committed words of sealed phrases, only kept as context for the prompt
+        self.context = []
+
+    @staticmethod
+    def normalize(word):
+        return word.strip().lower().strip(string.punctuation)
+
+    def insert(self, words):
+        agreed = []
+        for previous, current in zip(self.hypothesis, words):
+            if self.normalize(previous[0]) != self.normalize(current[0]):
+                break
+            agreed.append(current)
+
+        self.committed.extend(agreed)
+        self.hypothesis = words[len(agreed):]
+        return agreed
+
+    def commit_until(self, seconds):
+        # commit hypothesis words whose audio is about to fall out of the window
+        count = 0
+        while count < len(self.hypothesis) and self.hypothesis[count][2] <= seconds:
+            count += 1
+        committed = self.hypothesis[:count]
+        self.committed.extend(committed)
+        self.hypothesis = self.hypothesis[count:]
+        return committed
+
+    def shift(self, seconds):
+        self.hypothesis = [(word, start - seconds, end - seconds)
+                           for word, start, end in self.hypothesis]
+
+    def committed_text(self):
+        return "".join(word for word, _, _ in self.committed).strip()
+
+    def prompt(self, max_words=PROMPT_WORDS):
+        # the newest committed words, reaching back into sealed phrases while this one is short
+        words = self.committed[-max_words:]
+        if len(words) < max_words:
+            words = self.context[len(words) - max_words:] + words
+        return "".join(word for word, _, _ in words).strip()
+
+    def seal(self):
+        # the committed words become context, the hypothesis carries over into the next phrase
+        self.context = (self.context + self.committed)[-PROMPT_WORDS:]
+        self.committed = []
+
+    def text(self):
+        return "".join(word for word, _, _ in self.committed + self.hypothesis).strip()
+
+    def reset(self):
+        self.committed = []
+        self.hypothesis = []
+        self.context = []
 
 
 class AudioTranscriber:
-    def __init__(self, speaker_source, model):
-        self.transcript_data = {"Speaker": []}
+    def __init__(self, sources, model, history_path=None):
+        # ``sources`` maps a source name, which labels its phrases in the transcript, to its audio source
+        self.transcript = TranscriptStore(MAX_PHRASES, history_path)
         self.transcript_changed_event = threading.Event()
+        self.transcript_listeners = []
         self.audio_model = model
+        self.dropped_segments = 0
 
-        self.audio_sources = {
-            "Speaker": {
-                "sample_rate": speaker_source.SAMPLE_RATE,
-                "sample_width": speaker_source.SAMPLE_WIDTH,
-                "channels": speaker_source.channels,
-                "last_sample": bytes(),
-                "last_spoken": None,
-                "new_phrase": True,
-                "process_data_func": self.process_speaker_data
-            }
+        self.audio_sources = {}
+        for name, source in sources.items():
+            self.add_source(name, source.SAMPLE_RATE, source.SAMPLE_WIDTH, source.channels)
+
+    def add_source(self, name, sample_rate, sample_width, channels):
+        # queued audio is always 16-bit, ``sample_width`` is the width it was captured in
+        self.audio_sources[name] = {
+            "sample_rate": sample_rate,
+            "sample_width": sample_width,
+            "channels": channels,
+            "last_sample": AudioRingBuffer(sample_rate, channels, STREAMING_WINDOW_SECONDS),
+            "agreement": LocalAgreement(),
+            "last_spoken": None,
+            "new_phrase": True,
+            # the phrase was sealed at its length limit, the next chunk starts a new one
+            "sealed": False,
+            # the latest decode of the phrase, sent along with its text
+            "segments": [],
+            "confidence": None,
         }
 
     def transcribe_audio_queue(self, audio_queue, transcript_queue):
         while True:
-            who_spoke, data, time_spoken = audio_queue.get()
+            chunk = audio_queue.get()
+            if chunk is None:
+                break
+            who_spoke, data, time_spoken, trace = chunk
             self.update_last_sample_and_phrase_status(
                 who_spoke, data, time_spoken)
             source_info = self.audio_sources[who_spoke]
@@ -38,61 +226,115 @@ class AudioTranscriber:
             text = ''
 
             try:
-                fd, path = tempfile.mkstemp(suffix=".wav")
-                os.close(fd)
-                source_info["process_data_func"](
-                    source_info["last_sample"], path)
-                text = self.audio_model.get_transcription(path)
+                text = self.transcribe_phrase_window(source_info, trace)
             except Exception as e:
                 print(e)
-            finally:
-                os.unlink(path)
 
             if text != '' and text.lower() != 'you':
                 self.update_transcript(
                     who_spoke, text, time_spoken, transcript_queue)
-                self.transcript_changed_event.set()
+                trace.mark('publish')
+                self.notify_transcript_changed(trace)
+
+    def notify_transcript_changed(self, trace=None):
+        self.transcript_changed_event.set()
+        for listener in self.transcript_listeners:
+            listener(trace)
+
+    def add_phrase(self, who_spoke, text, time_spoken, transcript_queue: Queue):
+        # a complete phrase from outside the streaming lanes, such as a segment of an uploaded file
+        self.transcript.append(who_spoke, text, time_spoken)
+        transcript_queue.put_nowait(transcript_message(who_spoke, text, time_spoken))
+        self.notify_transcript_changed()
 
     def update_last_sample_and_phrase_status(self, who_spoke, data, time_spoken):
         source_info = self.audio_sources[who_spoke]
+        last_sample = source_info["last_sample"]
+        agreement = source_info["agreement"]
         if source_info["last_spoken"] and time_spoken - source_info["last_spoken"] > timedelta(seconds=PHRASE_TIMEOUT):
-            source_info["last_sample"] = bytes()
+            last_sample.clear()
+            agreement.reset()
             source_info["new_phrase"] = True
         else:
-            source_info["new_phrase"] = False
+            source_info["new_phrase"] = source_info["sealed"]
+        source_info["sealed"] = False
 
-        source_info["last_sample"] += data
+        overflow = last_sample.duration + last_sample.seconds_of(data) - last_sample.max_seconds
+        if overflow > 0:
+            committed = agreement.commit_until(overflow)
+            trim = max(overflow, committed[-1][2] if committed else 0)
+            last_sample.discard(trim)
+            agreement.shift(trim)
+
+        last_sample.append(data)
         source_info["last_spoken"] = time_spoken
 
-    def process_speaker_data(self, data, temp_file_name):
-        with wave.open(temp_file_name, 'wb') as wf:
-            wf.setnchannels(self.audio_sources["Speaker"]["channels"])
-            p = pyaudio.PyAudio()
-            wf.setsampwidth(p.get_sample_size(pyaudio.paInt16))
-            wf.setframerate(self.audio_sources["Speaker"]["sample_rate"])
-            wf.writeframes(data)
+    def transcribe_phrase_window(self, source_info, trace=None):
+        last_sample = source_info["last_sample"]
+        agreement = source_info["agreement"]
+        # the window ends with the newest chunk, which was stamped when it finished recording
+        window_start = to_timestamp(source_info["last_spoken"]) - last_sample.duration
+        segments = self.audio_model.get_segments(
+            last_sample.get(), source_info["sample_rate"], source_info["channels"],
+            agreement.prompt() or None, trace)
 
-    def update_transcript(self, who_spoke, text, time_spoken, transcript_queue: Queue):
-        source_info = self.audio_sources[who_spoke]
-        transcript = self.transcript_data[who_spoke]
+        confident = [segment for segment in segments if is_confident(segment)]
+        self.dropped_segments += len(segments) - len(confident)
+        if not confident:
+            # nothing new was heard, the hypothesis waits for the next chunk
+            return ''
 
-        if source_info["new_phrase"] or len(transcript) == 0:
-            if len(transcript) > MAX_PHRASES:
-                transcript.pop(-1)
+        committed = agreement.insert([word for segment in confident for word in segment.words])
+        source_info["segments"] = describe_segments(confident, window_start, len(committed))
+        source_info["confidence"] = segment_confidence(confident)
+        if committed:
+            # committed words are final, so their audio never has to be decoded again
+            trim = committed[-1][2]
+            last_sample.discard(trim)
+            agreement.shift(trim)
 
-            transcript.insert(0, (f"{text}", time_spoken))
+        if len(agreement.committed) >= MAX_PHRASE_WORDS:
+            # the sealed phrase ends with its committed words, the rest is decoded again as part of the next phrase
+            text = agreement.committed_text()
+            agreement.seal()
+            source_info["sealed"] = True
+            return text
+        return agreement.text()
 
-        else:
-            transcript[0] = (f"{text}", time_spoken)
+    def add_transcript_listener(self, listener):
+        # ``listener`` is called from the transcription thread whenever the transcript changes,
+        # with the trace of the audio that changed it (``None`` for phrases added whole)
+        self.transcript_listeners.append(listener)
 
-        transcript_queue.put_nowait(text)
+    def remove_transcript_listener(self, listener):
+        if listener in self.transcript_listeners:
+            self.transcript_listeners.remove(listener)
+
+    def update_transcript(self, who_spoke, text, time_spoken, transcript_queue: Queue):
+        source_info = self.audio_sources[who_spoke]
+        confidence = source_info["confidence"]
+
+        new_phrase = source_info["new_phrase"] or not self.transcript.replace_latest(
+            who_spoke, text, time_spoken, confidence)
+        if new_phrase:
+            self.transcript.append(who_spoke, text, time_spoken, confidence)
+
+        transcript_queue.put_nowait(transcript_message(
+            who_spoke, text, time_spoken, new_phrase, confidence, source_info["segments"]))
 
     def get_transcript(self):
-        combined_transcript = list(self.transcript_data["Speaker"])
-        combined_transcript = combined_transcript[:MAX_PHRASES]
-        return "".join([t[0] for t in combined_transcript])
+        return self.transcript.text()
+
+    def get_phrases(self):
+        # oldest first, so new phrases only ever extend the end of a prompt built from them
+        return self.transcript.snapshot()
 
     def clear_transcript_data(self):
-        self.transcript_data["Speaker"].clear()
-        self.audio_sources["Speaker"]["last_sample"] = bytes()
-        self.audio_sources["Speaker"]["new_phrase"] = True
+        self.transcript.clear()
+        for source_info in self.audio_sources.values():
+            source_info["last_sample"].clear()
+            source_info["agreement"].reset()
+            source_info["new_phrase"] = True
+            source_info["sealed"] = False
+            source_info["segments"] = []
+            source_info["confidence"] = None
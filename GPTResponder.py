@@ -1,39 +1,76 @@
+import asyncio
 import datetime
-from queue import Queue
-import openai
 import time
+from queue import Queue
+import httpx
+import LLMClient
+from PromptBuilder import PromptBuilder
+import ResponseCache
+
+MODEL = "gpt-3.5-turbo-0301"
+TEMPERATURE = 0.0
+# quiet time the transcript must have before a request is sent, so bursts of updates become one request
+DEBOUNCE_SECONDS = 0.25
+# upper bound on how long a stream of updates can hold a request back
+MAX_DEBOUNCE_SECONDS = 1.0
+# weight of the newest generation in the running average used to estimate time saved by cancelling
+GENERATION_TIME_SMOOTHING = 0.2
+# seconds a generation is assumed to take until one has completed, for estimating the time saved by early cancellations
+GENERATION_TIME_PRIOR = 1.5
+
+
+def put_token(chunk_message, suggestion_queue: Queue, collected_messages, trace):
+    suggestion_queue.put_nowait(chunk_message)
+    collected_messages.append(chunk_message)
+    if trace is not None and len(collected_messages) == 1:
+        trace.mark('first_token')
+
+
+async def replay_cached_response(cached, suggestion_queue: Queue, collected_messages, at_stream_speed, trace=None):
+    delay = cached.duration / len(cached.tokens) if at_stream_speed else 0
+    for chunk_message in cached.tokens:
+        if delay:
+            await asyncio.sleep(delay)
+        put_token(chunk_message, suggestion_queue, collected_messages, trace)
+
+
+async def generate_response_from_transcript(transcript, suggestion_queue: Queue, collected_messages=None,
+                                            use_cache=True, trace=None):
+    # ``collected_messages`` receives the tokens as they stream, so a cancelled caller can still see how many went out
+    collected_messages = [] if collected_messages is None else collected_messages
+    # ``transcript`` is either a list of chat messages or a bare transcript string sent as the system message
+    messages = [{"role": "system", "content": transcript}] if isinstance(transcript, str) else transcript
+    cache_key = '\n'.join(f'{message["role"]}: {message["content"]}' for message in messages)
+    cache = ResponseCache.get_cache()
+
+    cached = cache.get(cache_key, MODEL, TEMPERATURE) if use_cache else None
+    if cached is not None:
+        await replay_cached_response(cached, suggestion_queue, collected_messages,
+                                     ResponseCache.REPLAY_AT_STREAM_SPEED, trace)
+        if trace is not None:
+            trace.mark('last_token')
+        return ''.join(collected_messages)
+
+    start_time = time.monotonic()
+    try:
+        stream = LLMClient.get_client().stream_chat_completion(
+            messages, MODEL, TEMPERATURE)
 
-openai.api_key = 'lm-studio'
-openai.api_base = 'http://localhost:1234/v1'
-
-
-def generate_response_from_transcript(transcript, suggestion_queue: Queue):
+        async for chunk_message in stream:
+            put_token(chunk_message, suggestion_queue, collected_messages, trace)
 
-    try:
-        stream = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo-0301",
-            messages=[
-                {"role": "system", "content": transcript}],
-            temperature=0.0,
-            stream=True
-        )
-
-        collected_chunks = []
-        collected_messages = []
-
-        for chunk in stream:
-            if chunk.choices[0].finish_reason != 'stop' and (chunk.choices[0].delta.content is not None and chunk.choices[0].delta.content != ''):
-                collected_chunks.append(chunk)
-                chunk_message = chunk.choices[0].delta.content
-                suggestion_queue.put_nowait(chunk_message)
-                collected_messages.append(chunk_message)
-
-    except KeyError as e:
+    except (KeyError, ValueError, httpx.HTTPError, LLMClient.RetryableStatusError) as e:
         print(e)
         return ''
 
-    collected_messages = [m for m in collected_messages if m is not None]
-    full_reply_content = ''.join([m for m in collected_messages])
+    if trace is not None:
+        trace.mark('last_token')
+
+    # only complete answers get here, failed and cancelled generations are never cached
+    if use_cache:
+        cache.put(cache_key, MODEL, TEMPERATURE, collected_messages, time.monotonic() - start_time)
+
+    full_reply_content = ''.join(collected_messages)
 
     return full_reply_content
 
@@ -41,36 +78,146 @@ def generate_response_from_transcript(transcript, suggestion_queue: Queue):
 class GPTResponder:
     def __init__(self):
         self.response = ''
-        self.response_interval = 2
-
-    def respond_to_transcriber(self, transcriber, transcript_queue: Queue, suggestion_queue: Queue):
-        while True:
+        self.debounce_interval = DEBOUNCE_SECONDS
+        self.max_debounce_delay = MAX_DEBOUNCE_SECONDS
+        self.average_generation_time = None
+        self.prompt_builder = PromptBuilder()
+        self.pending_trace = None
+        self.emit_trace = None
+        self.metrics = {
+            "generations": 0,
+            "cancelled_generations": 0,
+            "wasted_tokens": 0,
+            "time_saved_seconds": 0.0,
+            # cancellations whose time saved was estimated from GENERATION_TIME_PRIOR
+            "prior_estimated_cancellations": 0,
+            "prompt_tokens": 0,
+            "last_prompt_tokens": 0,
+        }
+
+    def start(self, transcriber, transcript_queue: Queue, suggestion_queue: Queue):
+        # runs on the shared LLM client loop rather than on a thread of its own
+        return LLMClient.get_client().run(
+            self.respond_to_transcriber(transcriber, transcript_queue, suggestion_queue))
+
+    async def respond_to_transcriber(self, transcriber, transcript_queue: Queue, suggestion_queue: Queue):
+        loop = asyncio.get_running_loop()
+        transcript_changed = asyncio.Event()
+        def on_transcript_changed(trace):
+            self.pending_trace = trace
+            loop.call_soon_threadsafe(transcript_changed.set)
+
+        transcriber.add_transcript_listener(on_transcript_changed)
+        try:
             if transcriber.transcript_changed_event.is_set():
-                start_time = time.time()
-                transcriber.transcript_changed_event.clear()
-                transcript_string = transcriber.get_transcript()
-
-                transcript_queue.put_nowait(
-                    '\n' + f'[{datetime.datetime.utcnow()}] - END OF MESSAGE' + '\n')
-
-                response = generate_response_from_transcript(
-                    transcript_string, suggestion_queue)
-                
-                suggestion_queue.put('\n' +
-                                     f'[{datetime.datetime.utcnow()}] - END OF MESSAGE' + '\n')
-
-                end_time = time.time()
-                execution_time = end_time - start_time
+                transcript_changed.set()
+
+            while True:
+                await transcript_changed.wait()
+                # one failed turn is logged and the next transcript answered, rather than ending the responder
+                try:
+                    await self.wait_for_quiet_transcript(transcript_changed)
+
+                    start_time = loop.time()
+                    transcript_changed.clear()
+                    transcriber.transcript_changed_event.clear()
+                    prompt = self.prompt_builder.build(transcriber.get_phrases())
+                    self.record_prompt(prompt)
+                    # the trace of the newest audio in the prompt follows it through the LLM to the socket
+                    trace, self.pending_trace = self.pending_trace, None
+                    self.emit_trace = trace
+
+                    # transcript events are structured, so the marker is one too
+                    transcript_queue.put_nowait({"type": "end-of-message", "time": time.time()})
+
+                    collected_messages = []
+                    generation = asyncio.ensure_future(generate_response_from_transcript(
+                        prompt.messages, suggestion_queue, collected_messages, trace=trace))
+                    preempted = asyncio.ensure_future(transcript_changed.wait())
+                    try:
+                        await asyncio.wait({generation, preempted}, return_when=asyncio.FIRST_COMPLETED)
+                    except asyncio.CancelledError:
+                        # asyncio.wait leaves its tasks running, an open stream would outlive the session
+                        generation.cancel()
+                        preempted.cancel()
+                        raise
+
+                    execution_time = loop.time() - start_time
+
+                    if not generation.done():
+                        # a newer transcript arrived, cancelling closes the HTTP stream and the loop answers the new one straight away
+                        generation.cancel()
+                        await asyncio.gather(generation, return_exceptions=True)
+                        self.record_cancellation(len(collected_messages), execution_time)
+                        suggestion_queue.put('\n' +
+                                             f'[{datetime.datetime.utcnow()}] - CANCELLED' + '\n')
+                        continue
+
+                    preempted.cancel()
+                    response = generation.result()
+                    suggestion_queue.put('\n' +
+                                         f'[{datetime.datetime.utcnow()}] - END OF MESSAGE' + '\n')
+                    self.record_generation(execution_time)
+
+                    if response != '':
+                        self.response = response
+                except Exception as e:
+                    print(f"[ERROR] Suggestion failed: {e!r}")
+                    # wait for the transcript to change again, a failure before the event was cleared would repeat
+                    transcript_changed.clear()
+
+        finally:
+            # the session cancels this task when it stops
+            transcriber.remove_transcript_listener(on_transcript_changed)
+
+    async def wait_for_quiet_transcript(self, transcript_changed):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_debounce_delay
 
-                if response != '':
-                    self.response = response
-
-                remaining_time = self.response_interval - execution_time
-
-                if remaining_time > 0:
-                    time.sleep(remaining_time)
-            else:
-                time.sleep(0.3)
-
-    def update_response_interval(self, interval):
-        self.response_interval = interval
+        while True:
+            transcript_changed.clear()
+            remaining_time = min(self.debounce_interval, deadline - loop.time())
+            if remaining_time <= 0:
+                break
+            try:
+                await asyncio.wait_for(transcript_changed.wait(), remaining_time)
+            except asyncio.TimeoutError:
+                break
+
+        # leave the event set, it marks the transcript as not yet answered
+        transcript_changed.set()
+
+    def mark_emitted(self):
+        # called by the emitter after each frame it sends, the first one after the first token ends the trace
+        trace = self.emit_trace
+        if trace is not None and trace.has('first_token'):
+            self.emit_trace = None
+            trace.mark('emit')
+
+    def record_prompt(self, prompt):
+        self.metrics["prompt_tokens"] += prompt.prompt_tokens
+        self.metrics["last_prompt_tokens"] = prompt.prompt_tokens
+        print(f"[INFO] Prompt: {prompt.prompt_tokens} tokens, {prompt.phrase_count} phrases"
+              + (f", dropped {prompt.dropped_phrases} oldest" if prompt.dropped_phrases else ""))
+
+    def record_generation(self, execution_time):
+        self.metrics["generations"] += 1
+        if self.average_generation_time is None:
+            self.average_generation_time = execution_time
+        else:
+            self.average_generation_time += GENERATION_TIME_SMOOTHING * \
+                (execution_time - self.average_generation_time)
+
+    def record_cancellation(self, token_count, execution_time):
+        self.metrics["cancelled_generations"] += 1
+        self.metrics["wasted_tokens"] += token_count
+        # time the outdated generation would still have needed, judged by how long complete ones take
+        expected_time = self.average_generation_time
+        if expected_time is None:
+            expected_time = GENERATION_TIME_PRIOR
+            self.metrics["prior_estimated_cancellations"] += 1
+        self.metrics["time_saved_seconds"] += max(expected_time - execution_time, 0)
+
+    def update_debounce(self, debounce_interval, max_debounce_delay):
+        self.debounce_interval = debounce_interval
+        self.max_debounce_delay = max_debounce_delay
@@ -0,0 +1,118 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import InferenceWorkers
+import TranscriberModels
+
+# most requests decoded in one batched encoder/decoder pass
+BATCH_SIZE = 8
+# how long the first request of a batch waits for others to join it
+BATCH_MAX_WAIT_MS = 30
+# run Whisper in a pool of worker processes, one model each, instead of on threads of this process;
+# None sizes the pool from the machine's physical cores, see InferenceWorkers.worker_count
+USE_PROCESS_POOL = False
+PROCESS_POOL_SIZE = None
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            if USE_PROCESS_POOL:
+                model = InferenceWorkers.ProcessModelPool(processes=PROCESS_POOL_SIZE, max_batch_size=BATCH_SIZE)
+            else:
+                model = TranscriberModels.get_model()
+            _scheduler = InferenceScheduler(model)
+    return _scheduler
+
+
+def preload_models():
+    get_scheduler().model.preload()
+
+
+class InferenceRequest:
+    __slots__ = ("audio", "initial_prompt", "word_timestamps", "future", "trace")
+
+    def __init__(self, audio, initial_prompt, word_timestamps, trace=None):
+        self.audio = audio
+        self.initial_prompt = initial_prompt
+        self.word_timestamps = word_timestamps
+        self.future = Future()
+        self.trace = trace
+
+
+class InferenceScheduler:
+    def __init__(self, model, batch_size=BATCH_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+        self.model = model
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._requests = queue.Queue()
+
+        # one batching thread per model instance the pool is allowed to run at once
+        self._threads = []
+        for _ in range(getattr(model, "max_concurrency", 1)):
+            thread = threading.Thread(target=self.run_batches)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, audio, sample_rate=TranscriberModels.WHISPER_SAMPLE_RATE, channels=1,
+               initial_prompt=None, word_timestamps=False, trace=None):
+        # resampling happens on the caller's thread so the batching threads only run inference
+        request = InferenceRequest(
+            TranscriberModels.to_whisper_audio(audio, sample_rate, channels), initial_prompt, word_timestamps, trace)
+        if trace is not None:
+            trace.mark('prepared')
+        self._requests.put(request)
+        return request.future
+
+    def get_transcription(self, audio, sample_rate=TranscriberModels.WHISPER_SAMPLE_RATE, channels=1):
+        return self.submit(audio, sample_rate, channels).result()
+
+    def get_segments(self, audio, sample_rate=TranscriberModels.WHISPER_SAMPLE_RATE, channels=1,
+                     initial_prompt=None, trace=None):
+        return self.submit(audio, sample_rate, channels, initial_prompt, word_timestamps=True, trace=trace).result()
+
+    def get_timed_words(self, audio, sample_rate=TranscriberModels.WHISPER_SAMPLE_RATE, channels=1,
+                        initial_prompt=None, trace=None):
+        return TranscriberModels.words_of(self.get_segments(audio, sample_rate, channels, initial_prompt, trace))
+
+    def next_batch(self):
+        batch = [self._requests.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def run_batches(self):
+        while True:
+            batch = self.next_batch()
+            self.mark_batch(batch, 'batch_start')
+            try:
+                results = self.model.transcribe_batch(batch)
+            except Exception as e:
+                print(e)
+                for request in batch:
+                    request.future.set_exception(e)
+            else:
+                self.mark_batch(batch, 'inference_end')
+                for request, result in zip(batch, results):
+                    request.future.set_result(result)
+
+    @staticmethod
+    def mark_batch(batch, name):
+        for request in batch:
+            if request.trace is not None:
+                request.trace.mark(name)
@@ -0,0 +1,223 @@
+import atexit
+import multiprocessing
+import os
+import queue
+import threading
+from multiprocessing import shared_memory
+import numpy as np
+import TranscriberModels
+
+# inference threads each worker process runs its model with
+THREADS_PER_PROCESS = 2
+# physical cores left to the Socket.IO process for capture, VAD and emitting
+RESERVED_CORES = 1
+# longest audio one request passes to a worker, whisper only ever looks at the first 30 seconds
+MAX_REQUEST_SAMPLES = 30 * TranscriberModels.WHISPER_SAMPLE_RATE
+# seconds a worker gets to exit after being asked to before it is terminated
+SHUTDOWN_TIMEOUT = 5
+
+
+def physical_cores():
+    try:
+        import psutil
+        return psutil.cpu_count(logical=False) or os.cpu_count() or 1
+    except ImportError:
+        pass
+
+    # each distinct (physical id, core id) pair in /proc/cpuinfo is one core, hyperthreads repeat the pair
+    cores = set()
+    try:
+        with open('/proc/cpuinfo') as cpuinfo:
+            physical_id = None
+            for line in cpuinfo:
+                key, _, value = line.partition(':')
+                key = key.strip()
+                if key == 'physical id':
+                    physical_id = value.strip()
+                elif key == 'core id':
+                    cores.add((physical_id, value.strip()))
+    except OSError:
+        pass
+    return len(cores) or os.cpu_count() or 1
+
+
+def worker_count(threads_per_process=THREADS_PER_PROCESS):
+    return max(1, (physical_cores() - RESERVED_CORES) // threads_per_process)
+
+
+class BatchItem:
+    """The parts of an ``InferenceRequest`` a worker process needs, with ``audio`` viewing the shared memory block."""
+
+    __slots__ = ("audio", "initial_prompt", "word_timestamps")
+
+    def __init__(self, audio, initial_prompt, word_timestamps):
+        self.audio = audio
+        self.initial_prompt = initial_prompt
+        self.word_timestamps = word_timestamps
+
+
+def worker_main(backend, model_name, memory_name, capacity, threads, connection):
+    # runs in the worker process: load one model, then decode batches until told to stop with None
+    memory = shared_memory.SharedMemory(name=memory_name)
+    samples = np.ndarray((capacity,), dtype=np.float32, buffer=memory.buf)
+    try:
+        try:
+            model = TranscriberModels.create_transcriber(backend, model_name, threads)
+        except Exception as e:
+            connection.send(e)
+            return
+        connection.send("ready")
+
+        while True:
+            batch = connection.recv()
+            if batch is None:
+                break
+            items = [BatchItem(samples[offset:offset + length], initial_prompt, word_timestamps)
+                     for offset, length, initial_prompt, word_timestamps in batch]
+            try:
+                connection.send(model.transcribe_batch(items))
+            except Exception as e:
+                connection.send(e)
+    finally:
+        del samples
+        memory.close()
+
+
+class WorkerProcess:
+    """One inference process with its own model and a shared memory block that batches of audio are written into."""
+
+    def __init__(self, context, backend, model, max_batch_size, threads):
+        self.capacity = max_batch_size * MAX_REQUEST_SAMPLES
+        self.memory = shared_memory.SharedMemory(create=True, size=self.capacity * np.dtype(np.float32).itemsize)
+        self.samples = np.ndarray((self.capacity,), dtype=np.float32, buffer=self.memory.buf)
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=worker_main, args=(backend, model, self.memory.name, self.capacity, threads, child_connection))
+        self.process.daemon = True
+        self.process.start()
+        child_connection.close()
+        self.ready = False
+        # set when the model failed to load, the worker is dead for good and raises it every time
+        self.load_error = None
+
+    def wait_ready(self):
+        if self.load_error is not None:
+            raise self.load_error
+        if not self.ready:
+            try:
+                message = self.connection.recv()
+            except (EOFError, OSError) as e:
+                message = RuntimeError(f'inference worker exited while loading its model ({e!r})')
+            if isinstance(message, Exception):
+                self.load_error = message
+                raise message
+            self.ready = True
+
+    def transcribe_batch(self, requests):
+        self.wait_ready()
+        # only offsets, lengths and prompts are pickled, the samples are copied straight into shared memory
+        batch = []
+        offset = 0
+        for request in requests:
+            length = min(len(request.audio), MAX_REQUEST_SAMPLES)
+            self.samples[offset:offset + length] = request.audio[:length]
+            batch.append((offset, length, request.initial_prompt, request.word_timestamps))
+            offset += length
+
+        self.connection.send(batch)
+        results = self.connection.recv()
+        if isinstance(results, Exception):
+            raise results
+        return results
+
+    def close(self):
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(SHUTDOWN_TIMEOUT)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.connection.close()
+        del self.samples
+        self.memory.close()
+        self.memory.unlink()
+
+
+class ProcessModelPool:
+    """Runs a transcriber from ``TranscriberModels.create_transcriber`` in each of ``processes`` worker processes, so inference doesn't hold this process's GIL. Takes the place of ``TranscriberModels.ModelPool`` in the inference scheduler, which runs one batching thread per process."""
+
+    def __init__(self, model=None, processes=None, max_batch_size=8, threads_per_process=THREADS_PER_PROCESS,
+                 backend=None):
+        self.backend = backend or TranscriberModels.BACKEND
+        self.model = model or TranscriberModels.DEFAULT_MODELS[self.backend]
+        self.max_concurrency = processes or worker_count(threads_per_process)
+        self.max_batch_size = max_batch_size
+        self.threads_per_process = threads_per_process
+        # inference libraries and the capture threads don't survive fork, workers start from a fresh interpreter
+        self._context = multiprocessing.get_context("spawn")
+        self._idle_workers = queue.LifoQueue()
+        self._workers = []
+        self._lock = threading.Lock()
+        # a model that fails to load would fail in every replacement too, so the pool stops at the first failure
+        self.load_error = None
+
+        for _ in range(self.max_concurrency):
+            self._idle_workers.put(self.start_worker())
+        atexit.register(self.close)
+        print(f"[INFO] {self.backend} running in {self.max_concurrency} worker processes "
+              f"with {threads_per_process} threads each")
+
+    def start_worker(self):
+        worker = WorkerProcess(
+            self._context, self.backend, self.model, self.max_batch_size, self.threads_per_process)
+        with self._lock:
+            self._workers.append(worker)
+        return worker
+
+    def replace_worker(self, worker):
+        with self._lock:
+            self._workers.remove(worker)
+        try:
+            worker.close()
+        except OSError:
+            pass
+        return self.start_worker()
+
+    def preload(self):
+        with self._lock:
+            workers = list(self._workers)
+        for worker in workers:
+            self.wait_ready(worker)
+
+    def wait_ready(self, worker):
+        try:
+            worker.wait_ready()
+        except Exception as e:
+            if self.load_error is None:
+                self.load_error = e
+                print(f"[ERROR] Inference worker could not load {self.model}: {e!r}")
+            raise RuntimeError(f'inference workers could not load {self.model}') from e
+
+    def transcribe_batch(self, requests):
+        assert len(requests) <= self.max_batch_size, f'Batch of {len(requests)} is larger than {self.max_batch_size}'
+        if self.load_error is not None:
+            raise RuntimeError(f'inference workers could not load {self.model}') from self.load_error
+        worker = self._idle_workers.get()
+        try:
+            self.wait_ready(worker)
+            return worker.transcribe_batch(requests)
+        except (EOFError, OSError) as e:
+            # the worker died mid-batch, this batch fails but the next one gets a fresh process
+            print(f"[INFO] Inference worker exited ({e!r}), starting a new one")
+            worker = self.replace_worker(worker)
+            raise RuntimeError('inference worker exited') from e
+        finally:
+            self._idle_workers.put(worker)
+
+    def close(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.close()
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import random
+import threading
+import httpx
+
+API_BASE = 'http://localhost:1234/v1'
+API_KEY = 'lm-studio'
+# connections kept open to the LLM server and shared by every session
+MAX_CONNECTIONS = 32
+MAX_KEEPALIVE_CONNECTIONS = 16
+# requests allowed in flight per endpoint, later ones wait for a slot
+MAX_CONCURRENT_REQUESTS = 8
+CONNECT_TIMEOUT = 5.0
+# longest gap allowed between two streamed chunks
+READ_TIMEOUT = 30.0
+MAX_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 0.25
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LLMClient()
+    return _client
+
+
+class RetryableStatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f'LLM server responded with status {status_code}')
+        self.status_code = status_code
+
+
+class LLMClient:
+    def __init__(self, api_base=API_BASE, api_key=API_KEY, max_connections=MAX_CONNECTIONS,
+                 max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS, max_concurrent_requests=MAX_CONCURRENT_REQUESTS,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, max_retries=MAX_RETRIES):
+        self.api_base = api_base
+        self.api_key = api_key
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive_connections)
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_retries = max_retries
+
+        # every session's responder runs as a task on this one loop
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+        self._http_client = None
+        self._endpoint_slots = {}
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def http_client(self):
+        # created lazily so it is bound to the client's own loop
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        return self._http_client
+
+    def endpoint_slots(self, url):
+        if url not in self._endpoint_slots:
+            self._endpoint_slots[url] = asyncio.Semaphore(self.max_concurrent_requests)
+        return self._endpoint_slots[url]
+
+    async def stream_chat_completion(self, messages, model, temperature=0.0, api_base=None):
+        url = f'{api_base or self.api_base}/chat/completions'
+        payload = {"model": model, "messages": messages, "temperature": temperature, "stream": True}
+        headers = {"Authorization": f'Bearer {self.api_key}'}
+
+        async with self.endpoint_slots(url):
+            attempt = 0
+            while True:
+                streamed = False
+                try:
+                    async with self.http_client().stream('POST', url, json=payload, headers=headers) as response:
+                        if response.status_code in RETRY_STATUS_CODES:
+                            raise RetryableStatusError(response.status_code)
+                        response.raise_for_status()
+
+                        finished = False
+                        async for line in response.aiter_lines():
+                            # read on past [DONE] to the end of the body, otherwise the connection can't be reused
+                            if finished or not line.startswith('data:'):
+                                continue
+                            data = line[len('data:'):].strip()
+                            if data == '[DONE]':
+                                finished = True
+                                continue
+
+                            chunk = json.loads(data)
+                            choices = chunk.get("choices") if isinstance(chunk, dict) else None
+                            if not choices:
+                                # usage and keep-alive chunks carry no choices
+                                continue
+                            choice = choices[0]
+                            content = (choice.get("delta") or {}).get("content")
+                            if choice.get("finish_reason") != 'stop' and content:
+                                streamed = True
+                                yield content
+                    return
+                except (httpx.TransportError, RetryableStatusError) as e:
+                    # once tokens went out a retry would repeat them, so only failures before the first token are retried
+                    if streamed or attempt >= self.max_retries:
+                        raise
+                    delay = RETRY_BACKOFF_SECONDS * (2 ** attempt) * (1 + random.random())
+                    print(f"[INFO] Retrying LLM request in {delay:.2f}s: {e}")
+                    await asyncio.sleep(delay)
+                    attempt += 1
@@ -0,0 +1,118 @@
+import functools
+
+SYSTEM_PROMPT = ("You are a meeting assistant. The user message is a live transcript of what the speaker said, "
+                 "oldest line first. Suggest a short, helpful response to the latest thing that was said.")
+# tokens the prompt may use, the rest of the model's context is left for the reply
+PROMPT_TOKEN_BUDGET = 2048
+# once over budget, old phrases are dropped until the prompt is back under this fraction of the budget,
+# so the start of the window (and the prefix a server can reuse) stays put for the next several requests
+WINDOW_LOW_WATER = 0.75
+TOKENIZER_ENCODING = "cl100k_base"
+# chat formatting overhead, following OpenAI's token counting guide
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+
+@functools.lru_cache(maxsize=1)
+def get_encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:
+        # tiktoken is optional and fetches its vocabulary on first use, fall back to an estimate without it
+        print(f"[INFO] Estimating prompt tokens, tokenizer unavailable: {e}")
+        return None
+
+
+@functools.lru_cache(maxsize=4096)
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding is None:
+        # about four characters per token for English text
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+
+def tail_tokens(text, max_tokens):
+    """The end of ``text``, cut to at most ``max_tokens`` tokens."""
+    if max_tokens <= 0:
+        return ''
+    encoding = get_encoding()
+    if encoding is None:
+        return text[max(len(text) - 4 * max_tokens, 0):]
+    return encoding.decode(encoding.encode(text)[-max_tokens:])
+
+
+class Prompt:
+    __slots__ = ('messages', 'prompt_tokens', 'phrase_count', 'dropped_phrases')
+
+    def __init__(self, messages, prompt_tokens, phrase_count, dropped_phrases):
+        self.messages = messages
+        self.prompt_tokens = prompt_tokens
+        self.phrase_count = phrase_count
+        self.dropped_phrases = dropped_phrases
+
+
+class PromptBuilder:
+    def __init__(self, system_prompt=SYSTEM_PROMPT, token_budget=PROMPT_TOKEN_BUDGET, low_water=WINDOW_LOW_WATER):
+        self.system_prompt = system_prompt
+        self.token_budget = token_budget
+        self.low_water = low_water
+        # time the oldest phrase in the window was spoken, earlier phrases are left out of the prompt
+        self.window_start = None
+        # (source, start) -> text of every phrase in the window. The transcript only keeps its last few phrases,
+        # the window is built from this instead so that the budget alone decides when old phrases leave it
+        self.history = {}
+
+    @staticmethod
+    def format_phrase(who_spoke, text):
+        return f'{who_spoke}: {text.strip()}'
+
+    def build(self, phrases):
+        """``phrases`` are the latest ``TranscriptStore.Phrase`` records, oldest first, new and revised ones are added to the window."""
+        for phrase in phrases:
+            if self.window_start is None or phrase.start >= self.window_start:
+                self.history[(phrase.source, phrase.start)] = phrase.text
+        # already in order unless sources interleave, which sorting keeps stable
+        keys = sorted(self.history, key=lambda key: key[1])
+        lines = [self.format_phrase(source, self.history[(source, start)]) for source, start in keys]
+
+        fixed_tokens = count_tokens(self.system_prompt) + 2 * TOKENS_PER_MESSAGE + TOKENS_PER_REPLY
+        line_tokens = [count_tokens(line) + 1 for line in lines]
+        prompt_tokens = fixed_tokens + sum(line_tokens)
+
+        dropped = 0
+        if prompt_tokens > self.token_budget:
+            while dropped < len(lines) - 1 and prompt_tokens > self.token_budget * self.low_water:
+                prompt_tokens -= line_tokens[dropped]
+                del self.history[keys[dropped]]
+                dropped += 1
+            lines = lines[dropped:]
+            self.window_start = keys[dropped][1]
+
+        if prompt_tokens > self.token_budget and lines:
+            # the newest phrase alone is over budget, only its end is sent
+            source, start = keys[-1]
+            lines[-1], newest_tokens = self.truncate_phrase(
+                source, self.history[(source, start)], self.token_budget - fixed_tokens)
+            prompt_tokens = fixed_tokens + newest_tokens
+
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": '\n'.join(lines)},
+        ]
+        return Prompt(messages, prompt_tokens, len(lines), dropped)
+
+    def truncate_phrase(self, who_spoke, text, max_tokens):
+        # returns the phrase's line cut to fit ``max_tokens`` and the tokens it takes
+        text_tokens = max_tokens - count_tokens(self.format_phrase(who_spoke, '...')) - 1
+        while True:
+            line = self.format_phrase(who_spoke, '...' + tail_tokens(text, text_tokens).lstrip())
+            line_tokens = count_tokens(line) + 1
+            if line_tokens <= max_tokens or text_tokens <= 0:
+                return line, line_tokens
+            text_tokens -= line_tokens - max_tokens
+
+    def reset(self):
+        self.window_start = None
+        self.history = {}
@@ -0,0 +1,106 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+MAX_ENTRIES = 256
+# rough cap on the memory held by cached responses
+MAX_BYTES = 4 * 1024 * 1024
+TTL_SECONDS = 15 * 60
+# replay cached tokens with the timing they were first streamed with, rather than all at once
+REPLAY_AT_STREAM_SPEED = False
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+    return _cache
+
+
+def normalize_transcript(transcript):
+    # whitespace and casing differences from the transcriber don't change the answer
+    return re.sub(r'\s+', ' ', transcript).strip().lower()
+
+
+class CachedResponse:
+    __slots__ = ('tokens', 'duration', 'size', 'created')
+
+    def __init__(self, tokens, duration, size, created):
+        self.tokens = tokens
+        self.duration = duration
+        self.size = size
+        self.created = created
+
+
+class ResponseCache:
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, ttl_seconds=TTL_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.metrics = {
+            "hits": 0,
+            "misses": 0,
+            "expirations": 0,
+            "evictions": 0,
+        }
+
+    @staticmethod
+    def make_key(transcript, model, temperature):
+        normalized = normalize_transcript(transcript)
+        return hashlib.sha256(f'{model}\0{temperature}\0{normalized}'.encode('utf-8')).hexdigest()
+
+    def get(self, transcript, model, temperature):
+        key = self.make_key(transcript, model, temperature)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry.created > self.ttl_seconds:
+                self.remove(key)
+                self.metrics["expirations"] += 1
+                entry = None
+            if entry is None:
+                self.metrics["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.metrics["hits"] += 1
+            return entry
+
+    def put(self, transcript, model, temperature, tokens, duration=0.0):
+        key = self.make_key(transcript, model, temperature)
+        tokens = tuple(tokens)
+        size = len(key) + sum(len(token.encode('utf-8')) for token in tokens)
+        if not tokens or size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = CachedResponse(tokens, duration, size, time.monotonic())
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.metrics["evictions"] += 1
+
+    def remove(self, key):
+        self.size -= self.entries.pop(key).size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def hit_rate(self):
+        lookups = self.metrics["hits"] + self.metrics["misses"]
+        return self.metrics["hits"] / lookups if lookups else 0.0
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.metrics, entries=len(self.entries), bytes=self.size, hit_rate=self.hit_rate())
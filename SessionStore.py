@@ -0,0 +1,182 @@
+import base64
+import json
+import threading
+import time
+
+KEY_PREFIX = "assistant"
+# workers that haven't sent a heartbeat for this long are left out of placement
+WORKER_TIMEOUT_SECONDS = 15
+# weight of a worker's CPU use against its share of occupied session slots when placing a new session
+CPU_LOAD_WEIGHT = 0.5
+# seconds the subscriber thread waits before polling again after losing its connection
+PUBSUB_RETRY_SECONDS = 1
+COMMAND_KEYS = {"command", "session_id", "args"}
+
+
+def create_store(url=None):
+    """
+    Returns a ``LocalSessionStore`` when ``url`` is ``None``, otherwise a ``RedisSessionStore`` for the Redis (or Redis-compatible) server at ``url``. ``fakeredis://`` gives an in-memory stand-in from the ``fakeredis`` package.
+    """
+    if url is None:
+        return LocalSessionStore()
+    if url.startswith("fakeredis://"):
+        try:
+            import fakeredis
+        except ImportError:
+            raise AttributeError("Could not find fakeredis; check installation")
+        return RedisSessionStore(fakeredis.FakeStrictRedis())
+    try:
+        import redis
+    except ImportError:
+        raise AttributeError("Could not find redis; check installation")
+    return RedisSessionStore(redis.Redis.from_url(url))
+
+
+def encode_command(command):
+    # commands go over the wire as JSON, with audio and any other bytes base64 encoded
+    args = [{"base64": base64.b64encode(arg).decode('ascii')} if isinstance(arg, (bytes, bytearray)) else arg
+            for arg in command["args"]]
+    return json.dumps({"command": command["command"], "session_id": command["session_id"], "args": args})
+
+
+def decode_command(data):
+    """Returns the command encoded by ``encode_command``. Raises ``ValueError`` for anything that isn't one."""
+    command = json.loads(data)
+    if not isinstance(command, dict) or set(command) != COMMAND_KEYS or not isinstance(command["command"], str) \
+            or not isinstance(command["session_id"], str) or not isinstance(command["args"], list):
+        raise ValueError(f'Not a session command: {data[:200]!r}')
+
+    args = []
+    for arg in command["args"]:
+        if isinstance(arg, dict) and set(arg) == {"base64"}:
+            if not isinstance(arg["base64"], str):
+                raise ValueError('Bytes argument is not base64 text')
+            arg = base64.b64decode(arg["base64"], validate=True)
+        args.append(arg)
+    command["args"] = args
+    return command
+
+
+def load_score(info):
+    return info["sessions"] / max(info["capacity"], 1) + CPU_LOAD_WEIGHT * info["load"]
+
+
+def pick_worker(workers):
+    """Returns the id of the least loaded of ``workers`` (worker id -> heartbeat info), preferring ones with free session slots."""
+    if not workers:
+        return None
+    with_room = {worker_id: info for worker_id, info in workers.items() if info["sessions"] < info["capacity"]}
+    candidates = with_room or workers
+    return min(candidates, key=lambda worker_id: load_score(candidates[worker_id]))
+
+
+class LocalSessionStore:
+    """Session routing state for a single worker process."""
+
+    def __init__(self):
+        self.users = {}
+        self._workers = {}
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    def get_user(self, user_id):
+        """``{"session_id": ..., "worker_id": ...}`` for a user in a session, otherwise ``None``."""
+        return self.users.get(user_id)
+
+    def add_user(self, user_id, session_id, worker_id):
+        """Records which session and worker ``user_id`` is pinned to. Returns ``False`` if the user already is in a session."""
+        with self.lock:
+            if user_id in self.users:
+                return False
+            self.users[user_id] = {"session_id": session_id, "worker_id": worker_id}
+            return True
+
+    def remove_user(self, user_id):
+        with self.lock:
+            return self.users.pop(user_id, None)
+
+    def heartbeat(self, worker_id, info):
+        self._workers[worker_id] = dict(info, updated=time.time())
+
+    def remove_worker(self, worker_id):
+        self._workers.pop(worker_id, None)
+
+    def workers(self):
+        """Heartbeat info of every live worker."""
+        now = time.time()
+        return {worker_id: info for worker_id, info in list(self._workers.items())
+                if now - info["updated"] < WORKER_TIMEOUT_SECONDS}
+
+    def publish(self, worker_id, command):
+        handler = self.subscribers.get(worker_id)
+        if handler is not None:
+            handler(command)
+
+    def subscribe(self, worker_id, handler):
+        self.subscribers[worker_id] = handler
+
+
+class RedisSessionStore:
+    """Session routing state shared by every worker through Redis. Commands for a worker are delivered over pub/sub to the handler it subscribed with."""
+
+    def __init__(self, client, prefix=KEY_PREFIX):
+        self.client = client
+        self.users_key = f'{prefix}:users'
+        self.workers_key = f'{prefix}:workers'
+        self.channel_prefix = f'{prefix}:worker:'
+        self.pubsub_threads = []
+
+    def get_user(self, user_id):
+        record = self.client.hget(self.users_key, user_id)
+        return json.loads(record) if record is not None else None
+
+    def add_user(self, user_id, session_id, worker_id):
+        # HSETNX makes the check and the insert one atomic step across workers
+        record = json.dumps({"session_id": session_id, "worker_id": worker_id})
+        return bool(self.client.hsetnx(self.users_key, user_id, record))
+
+    def remove_user(self, user_id):
+        record = self.get_user(user_id)
+        self.client.hdel(self.users_key, user_id)
+        return record
+
+    def heartbeat(self, worker_id, info):
+        self.client.hset(self.workers_key, worker_id, json.dumps(dict(info, updated=time.time())))
+
+    def remove_worker(self, worker_id):
+        self.client.hdel(self.workers_key, worker_id)
+
+    def workers(self):
+        now = time.time()
+        workers = {}
+        for worker_id, info in self.client.hgetall(self.workers_key).items():
+            info = json.loads(info)
+            if now - info["updated"] < WORKER_TIMEOUT_SECONDS:
+                workers[worker_id.decode() if isinstance(worker_id, bytes) else worker_id] = info
+        return workers
+
+    def publish(self, worker_id, command):
+        self.client.publish(self.channel_prefix + worker_id, encode_command(command))
+
+    def subscribe(self, worker_id, handler):
+        """Calls ``handler`` with every command published to ``worker_id``, on the subscriber thread. Malformed messages and errors raised by ``handler`` are logged and skipped, so one bad command can't stop the thread."""
+        def on_message(message):
+            try:
+                command = decode_command(message["data"])
+            except (ValueError, UnicodeDecodeError) as e:
+                print(f"[ERROR] Dropped a message on {message['channel']!r}: {e}")
+                return
+            try:
+                handler(command)
+            except Exception as e:
+                print(f"[ERROR] Command {command['command']} for session {command['session_id']} failed: {e!r}")
+
+        def on_error(error, pubsub, thread):
+            # a lost connection is retried rather than ending the thread
+            print(f"[ERROR] Session command subscription failed: {error!r}")
+            time.sleep(PUBSUB_RETRY_SECONDS)
+
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self.channel_prefix + worker_id: on_message})
+        self.pubsub_threads.append(
+            pubsub.run_in_thread(sleep_time=0.01, daemon=True, exception_handler=on_error))
@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# samples kept per histogram, quantiles describe the most recent ones
+HISTOGRAM_WINDOW = 1024
+QUANTILES = (0.5, 0.95, 0.99)
+METRIC_PREFIX = "assistant"
+
+# stage -> (mark it starts at, mark it ends at), marks are made in roughly this order as a chunk moves through the pipeline
+STAGES = {
+    "capture_to_enqueue": ("capture_end", "enqueue"),
+    "queue_wait": ("enqueue", "dequeue"),
+    "prepare": ("dequeue", "prepared"),
+    "batch_wait": ("prepared", "batch_start"),
+    "inference": ("batch_start", "inference_end"),
+    "publish": ("inference_end", "publish"),
+    "transcription": ("capture_end", "publish"),
+    "llm_first_token": ("publish", "first_token"),
+    "llm_stream": ("first_token", "last_token"),
+    "emit": ("first_token", "emit"),
+    "end_to_end": ("capture_end", "emit"),
+}
+STAGES_BY_END = {}
+for _stage, (_start, _end) in STAGES.items():
+    STAGES_BY_END.setdefault(_end, []).append((_stage, _start))
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+    return _registry
+
+
+class Histogram:
+    __slots__ = ('samples', 'count', 'total')
+
+    def __init__(self, window=HISTOGRAM_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def quantiles(self, quantiles=QUANTILES):
+        if not self.samples:
+            return [float('nan')] * len(quantiles)
+        return [float(q) for q in np.quantile(np.fromiter(self.samples, dtype=np.float64), quantiles)]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        # (session_id, stage) -> Histogram
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def observe(self, session_id, stage, seconds):
+        key = (session_id, stage)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def remove_session(self, session_id):
+        with self.lock:
+            for key in [key for key in self.histograms if key[0] == session_id]:
+                del self.histograms[key]
+
+    def summary(self, session_id):
+        """``{stage: {"p50": ..., "p95": ..., "p99": ..., "count": ...}}`` for one session."""
+        with self.lock:
+            histograms = {stage: h for (session, stage), h in self.histograms.items() if session == session_id}
+            return {stage: dict(zip((f'p{int(q * 100)}' for q in QUANTILES), h.quantiles()), count=h.count)
+                    for stage, h in histograms.items()}
+
+    def render(self):
+        """The stage histograms as a Prometheus summary, in the text exposition format."""
+        name = f'{METRIC_PREFIX}_stage_seconds'
+        lines = [f'# HELP {name} Time chunks of audio spend in each pipeline stage.',
+                 f'# TYPE {name} summary']
+        with self.lock:
+            for (session_id, stage), histogram in sorted(self.histograms.items(), key=lambda item: str(item[0])):
+                labels = {"session": session_id, "stage": stage}
+                for quantile, value in zip(QUANTILES, histogram.quantiles()):
+                    lines.append(format_sample(name, dict(labels, quantile=quantile), value))
+                lines.append(format_sample(f'{name}_sum', labels, histogram.total))
+                lines.append(format_sample(f'{name}_count', labels, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+def format_sample(name, labels, value):
+    label_text = ','.join('{}="{}"'.format(key, str(label).replace('\\', '\\\\').replace('"', '\\"'))
+                          for key, label in labels.items())
+    return f'{name}{{{label_text}}} {float(value)}' if label_text else f'{name} {float(value)}'
+
+
+class Trace:
+    """Monotonic timestamps of one chunk of audio as it moves through the pipeline. Every mark that ends a stage in ``STAGES`` records that stage's duration for the session."""
+
+    __slots__ = ('session_id', 'source_name', 'marks', 'registry')
+
+    def __init__(self, session_id, source_name, registry=None):
+        self.session_id = session_id
+        self.source_name = source_name
+        self.marks = {}
+        self.registry = registry if registry is not None else get_registry()
+
+    def mark(self, name, timestamp=None):
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        if name in self.marks:
+            return
+        self.marks[name] = timestamp
+        for stage, start in STAGES_BY_END.get(name, ()):
+            if start in self.marks:
+                self.registry.observe(self.session_id, stage, timestamp - self.marks[start])
+
+    def has(self, name):
+        return name in self.marks
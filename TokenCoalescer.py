@@ -0,0 +1,55 @@
+import re
+import time
+
+# longest a token waits in the buffer before it is sent
+FLUSH_INTERVAL_MS = 50
+MAX_BUFFERED_CHARS = 80
+FLUSH_ON_SENTENCE_END = True
+
+SENTENCE_END_PATTERN = re.compile(r'[.!?:;]["\')\]]*\s*$|\n')
+# the "[time] - END OF MESSAGE" style markers GPTResponder puts between answers
+MARKER_PATTERN = re.compile(r'\n\[[^\]]+\] - [A-Z ]+\n')
+
+
+def is_marker(message):
+    return MARKER_PATTERN.fullmatch(message) is not None
+
+
+class TokenCoalescer:
+    def __init__(self, flush_interval_ms=FLUSH_INTERVAL_MS, max_chars=MAX_BUFFERED_CHARS,
+                 flush_on_sentence_end=FLUSH_ON_SENTENCE_END, clock=time.monotonic):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_chars = max_chars
+        self.flush_on_sentence_end = flush_on_sentence_end
+        self.clock = clock
+        self.buffer = []
+        self.buffered_chars = 0
+        self.first_token_time = None
+
+    def add(self, token):
+        """Buffers ``token`` and returns the coalesced text if it is time to send it, otherwise ``None``."""
+        if not self.buffer:
+            self.first_token_time = self.clock()
+        self.buffer.append(token)
+        self.buffered_chars += len(token)
+
+        if self.buffered_chars >= self.max_chars \
+                or (self.flush_on_sentence_end and SENTENCE_END_PATTERN.search(token)) \
+                or self.time_until_flush() == 0:
+            return self.flush()
+        return None
+
+    def flush(self):
+        if not self.buffer:
+            return None
+        text = ''.join(self.buffer)
+        self.buffer = []
+        self.buffered_chars = 0
+        self.first_token_time = None
+        return text
+
+    def time_until_flush(self):
+        """Seconds until the buffered tokens are due, or ``None`` when nothing is buffered."""
+        if not self.buffer:
+            return None
+        return max(self.first_token_time + self.flush_interval - self.clock(), 0)
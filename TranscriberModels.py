@@ -1,6 +1,17 @@
-import torch
+import numpy as np
 import os
-import whisper
+import queue
+import threading
+from custom_speech_recognition import dsp
+try:
+    import torch
+    import whisper
+    import whisper.timing
+    import whisper.tokenizer
+except ImportError:
+    # only the "whisper" backend needs them
+    torch = None
+    whisper = None
 
 # # Create an instance of the Whisper model with the appropriate dimensions
 # model = whisper.model.Whisper(whisper.model.ModelDimensions(
@@ -22,21 +33,416 @@ import whisper
 # # Set the alignment heads for the model
 # model.set_alignment_heads(b"ABzY8usPae0{>%R7<zz_OvQ{)4kMa0BMw6u5rT}kRKX;$NfYBv00*Hl@qhsU00")
 
-def get_model():
-    return WhisperTranscriber()
+WHISPER_SAMPLE_RATE = 16000
+# batched decoding skips whisper.transcribe's fallbacks, so drop clips it considers silence the same way it does
+NO_SPEECH_THRESHOLD = 0.6
+LOGPROB_THRESHOLD = -1.0
+# whisper's decoder takes one prompt for a whole batch, and every live lane prompts with its own recent text. "drop"
+# decodes a batch whose requests have different prompts in one pass without prompts; "group" keeps the prompts by
+# decoding each distinct prompt separately, which leaves concurrent lanes unbatched
+MIXED_PROMPTS = "drop"
+MODEL_PATH = os.path.join(os.getcwd(), 'tiny.en.pt')
+# inference engine: "whisper" (openai-whisper on PyTorch), "faster-whisper" (CTranslate2) or "onnx" (ONNX Runtime)
+BACKEND = "whisper"
+BACKENDS = ("whisper", "faster-whisper", "onnx")
+# model each backend loads when none is given: a checkpoint path for whisper, a size such as "base.en" or a converted
+# model directory for faster-whisper, a Hugging Face model id or exported ONNX directory for onnx
+DEFAULT_MODELS = {
+    "whisper": MODEL_PATH,
+    "faster-whisper": "tiny.en",
+    "onnx": "openai/whisper-tiny.en",
+}
+# weight format for faster-whisper: "int8" is the fastest on CPU, "float16" or "int8_float16" on GPU
+COMPUTE_TYPE = "int8"
+# threads one model instance runs inference with, 0 leaves it to the backend
+CPU_THREADS = 0
+# number of model instances that may run inference at the same time, each one holds a full copy of the weights
+MAX_CONCURRENCY = 1
+
+_model_pools = {}
+_model_pools_lock = threading.Lock()
+
+
+def to_whisper_audio(audio, sample_rate=WHISPER_SAMPLE_RATE, channels=1):
+    # raw bytes are interleaved int16 PCM, arrays are either int16 PCM or float32 samples in [-1, 1]
+    if isinstance(audio, (bytes, bytearray, memoryview)):
+        audio = np.frombuffer(audio, dtype=np.int16)
+    audio = np.asarray(audio)
+    if audio.dtype == np.int16:
+        audio = audio.astype(np.float32) / 32768.0
+    else:
+        audio = audio.astype(np.float32, copy=False)
+
+    audio = dsp.downmix(audio, channels)
+    return dsp.resample_array(audio, sample_rate, WHISPER_SAMPLE_RATE)
+
+
+def get_model(model=None, max_concurrency=None, backend=None):
+    backend = backend or BACKEND
+    model = model or DEFAULT_MODELS[backend]
+    with _model_pools_lock:
+        pool = _model_pools.get((backend, model))
+        if pool is None:
+            pool = ModelPool(model, max_concurrency or MAX_CONCURRENCY, backend)
+            _model_pools[(backend, model)] = pool
+    return pool
+
+
+def preload_models(model=None, backend=None):
+    get_model(model, backend=backend).preload()
+
+
+def create_transcriber(backend=None, model=None, threads=None):
+    """Loads ``model`` with ``backend``. Every transcriber has ``get_transcription``, ``get_segments``, ``get_timed_words`` and ``transcribe_batch``."""
+    backend = backend or BACKEND
+    assert backend in BACKENDS, f'Unknown transcription backend {backend!r}'
+    model = model or DEFAULT_MODELS[backend]
+    threads = CPU_THREADS if threads is None else threads
+    if backend == "faster-whisper":
+        return FasterWhisperTranscriber(model, COMPUTE_TYPE, threads)
+    if backend == "onnx":
+        return OnnxWhisperTranscriber(model, threads)
+    return WhisperTranscriber(model, threads)
+
+
+class ModelPool:
+    def __init__(self, model_path, max_concurrency, backend=None):
+        self.model_path = model_path
+        self.max_concurrency = max_concurrency
+        self.backend = backend or BACKEND
+        self._idle_models = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def preload(self):
+        self.release(self.acquire())
+
+    def acquire(self):
+        try:
+            return self._idle_models.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.max_concurrency
+            if can_create:
+                self._created += 1
+
+        if not can_create:
+            return self._idle_models.get()
+
+        try:
+            return create_transcriber(self.backend, self.model_path)
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def release(self, model):
+        self._idle_models.put(model)
+
+    def get_transcription(self, audio, sample_rate=WHISPER_SAMPLE_RATE, channels=1):
+        model = self.acquire()
+        try:
+            return model.get_transcription(audio, sample_rate, channels)
+        finally:
+            self.release(model)
+
+    def get_segments(self, audio, sample_rate=WHISPER_SAMPLE_RATE, channels=1, initial_prompt=None, trace=None):
+        model = self.acquire()
+        if trace is not None:
+            trace.mark('batch_start')
+        try:
+            return model.get_segments(audio, sample_rate, channels, initial_prompt)
+        finally:
+            self.release(model)
+            if trace is not None:
+                trace.mark('inference_end')
+
+    def get_timed_words(self, audio, sample_rate=WHISPER_SAMPLE_RATE, channels=1, initial_prompt=None, trace=None):
+        return words_of(self.get_segments(audio, sample_rate, channels, initial_prompt, trace))
+
+    def transcribe_batch(self, requests):
+        model = self.acquire()
+        try:
+            return model.transcribe_batch(requests)
+        finally:
+            self.release(model)
+
+
+def is_silence(no_speech_prob, avg_logprob):
+    return no_speech_prob > NO_SPEECH_THRESHOLD and avg_logprob < LOGPROB_THRESHOLD
+
+
+class Segment:
+    """A stretch of decoded speech: its text, start and end in seconds from the start of the audio, whisper's ``no_speech_prob`` and ``avg_logprob`` (``None`` where a backend doesn't report them), and its (word, start, end) tuples."""
+
+    __slots__ = ("text", "start", "end", "no_speech_prob", "avg_logprob", "words")
+
+    def __init__(self, text, start, end, no_speech_prob=None, avg_logprob=None, words=()):
+        self.text = text
+        self.start = start
+        self.end = end
+        self.no_speech_prob = no_speech_prob
+        self.avg_logprob = avg_logprob
+        self.words = list(words)
+
+
+def words_of(segments):
+    return [word for segment in segments for word in segment.words]
+
+
+def group_by_prompt(requests, mixed_prompts=MIXED_PROMPTS):
+    """Returns ``{prompt: [index, ...]}``, the requests decoded together and the prompt they are decoded with."""
+    assert mixed_prompts in ("drop", "group"), f'Unknown mixed prompt policy {mixed_prompts!r}'
+    prompts = {request.initial_prompt for request in requests}
+    if len(prompts) > 1 and mixed_prompts == "drop":
+        return {None: list(range(len(requests)))}
+
+    groups = {}
+    for index, request in enumerate(requests):
+        groups.setdefault(request.initial_prompt, []).append(index)
+    return groups
+
+
+class EncodedAudioModel:
+    """Stands in for a whisper model in ``whisper.timing.find_alignment``, running only the decoder against audio features the batch has already encoded, rather than encoding the clip a second time."""
+
+    def __init__(self, model, audio_features):
+        self.model = model
+        self.audio_features = audio_features
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def __call__(self, mel, tokens):
+        return self.model.decoder(tokens, self.audio_features)
+
 
 class WhisperTranscriber:
-    def __init__(self):
-        self.audio_model = whisper.load_model(
-            os.path.join(os.getcwd(), 'tiny.en.pt'))      
+    def __init__(self, model_path=MODEL_PATH, threads=0):
+        if whisper is None:
+            raise AttributeError("Could not find openai-whisper; check installation")
+        if threads:
+            # PyTorch's thread pool is shared by the whole process
+            torch.set_num_threads(threads)
+        self.audio_model = whisper.load_model(model_path)
+        self.tokenizer = whisper.tokenizer.get_tokenizer(
+            self.audio_model.is_multilingual, language="en", task="transcribe")
 
         print(f"[INFO] Whisper using GPU: " + str(torch.cuda.is_available()))
 
-    def get_transcription(self, wav_file_path):
+    def get_transcription(self, audio, sample_rate=WHISPER_SAMPLE_RATE, channels=1):
         try:
             result = self.audio_model.transcribe(
-                wav_file_path, fp16=torch.cuda.is_available())
+                to_whisper_audio(audio, sample_rate, channels), fp16=torch.cuda.is_available())
         except Exception as e:
             print(e)
             return ''
         return result['text'].strip()
+
+    def get_segments(self, audio, sample_rate=WHISPER_SAMPLE_RATE, channels=1, initial_prompt=None):
+        # times are in seconds from the start of ``audio``
+        try:
+            result = self.audio_model.transcribe(
+                to_whisper_audio(audio, sample_rate, channels), fp16=torch.cuda.is_available(),
+                word_timestamps=True, initial_prompt=initial_prompt, condition_on_previous_text=False)
+        except Exception as e:
+            print(e)
+            return []
+        return [Segment(segment["text"].strip(), segment["start"], segment["end"], segment["no_speech_prob"],
+                        segment["avg_logprob"],
+                        [(word["word"], word["start"], word["end"]) for word in segment.get("words", [])])
+                for segment in result["segments"]]
+
+    def get_timed_words(self, audio, sample_rate=WHISPER_SAMPLE_RATE, channels=1, initial_prompt=None):
+        return words_of(self.get_segments(audio, sample_rate, channels, initial_prompt))
+
+    def transcribe_batch(self, requests):
+        # ``requests`` carry 16 kHz float32 ``audio``, an ``initial_prompt`` and a ``word_timestamps`` flag,
+        # the result for each one is its text, or a list of ``Segment`` with word times when word timestamps
+        # were asked for
+        fp16 = torch.cuda.is_available()
+        mel = torch.stack([whisper.log_mel_spectrogram(whisper.pad_or_trim(torch.from_numpy(request.audio)))
+                           for request in requests]).to(self.audio_model.device)
+        if fp16:
+            mel = mel.half()
+
+        with torch.no_grad():
+            audio_features = self.audio_model.embed_audio(mel)
+
+        results = [None] * len(requests)
+        for prompt, indices in group_by_prompt(requests).items():
+            options = whisper.DecodingOptions(
+                language="en", prompt=prompt, without_timestamps=True, fp16=fp16)
+            decoded = whisper.decode(self.audio_model, audio_features[indices], options)
+
+            for index, result in zip(indices, decoded):
+                request = requests[index]
+                silence = is_silence(result.no_speech_prob, result.avg_logprob)
+                if not request.word_timestamps:
+                    results[index] = '' if silence else result.text.strip()
+                elif silence:
+                    results[index] = []
+                else:
+                    # decoded without timestamps, the whole window is one segment
+                    words = self.align_words(mel[index], audio_features[index:index + 1], result.tokens,
+                                             len(request.audio) // whisper.audio.HOP_LENGTH)
+                    results[index] = [Segment(
+                        result.text.strip(), words[0][1] if words else 0.0,
+                        words[-1][2] if words else len(request.audio) / WHISPER_SAMPLE_RATE,
+                        result.no_speech_prob, result.avg_logprob, words)]
+        return results
+
+    def align_words(self, mel, audio_features, tokens, num_frames):
+        # the cross-attention weights come from a decoder pass over the batch's audio features, the encoder isn't rerun
+        text_tokens = [token for token in tokens if token < self.tokenizer.eot]
+        if len(text_tokens) == 0:
+            return []
+        alignment = whisper.timing.find_alignment(
+            EncodedAudioModel(self.audio_model, audio_features), self.tokenizer, text_tokens, mel, num_frames)
+        return [(timing.word, float(timing.start), float(timing.end))
+                for timing in alignment if timing.word.strip()]
+
+
+def spread_words(text, start, end):
+    # (word, start, end) tuples splitting ``start``..``end`` between the words of ``text`` by their length
+    words = text.split()
+    seconds_per_character = (end - start) / max(sum(len(word) for word in words), 1)
+    timed_words = []
+    for word in words:
+        duration = seconds_per_character * len(word)
+        timed_words.append((' ' + word, start, start + duration))
+        start += duration
+    return timed_words
+
+
+class FasterWhisperTranscriber:
+    """Whisper on CTranslate2 through faster-whisper. With int8 weights it is several times faster than PyTorch on CPU and needs a fraction of the memory."""
+
+    def __init__(self, model="tiny.en", compute_type=COMPUTE_TYPE, threads=0):
+        try:
+            import faster_whisper
+        except ImportError:
+            raise AttributeError("Could not find faster-whisper; check installation")
+        self.audio_model = faster_whisper.WhisperModel(
+            model, device="auto", compute_type=compute_type, cpu_threads=threads)
+
+        print(f"[INFO] faster-whisper using {compute_type} weights")
+
+    def transcribe(self, audio, initial_prompt=None, word_timestamps=False):
+        # greedy and without fallbacks, like the batched PyTorch decode, and silence is dropped the same way
+        segments, _ = self.audio_model.transcribe(
+            audio, language="en", beam_size=1, temperature=0.0, initial_prompt=initial_prompt,
+            condition_on_previous_text=False, word_timestamps=word_timestamps,
+            without_timestamps=not word_timestamps,
+            no_speech_threshold=NO_SPEECH_THRESHOLD, log_prob_threshold=LOGPROB_THRESHOLD)
+        return list(segments)
+
+    def get_transcription(self, audio, sample_rate=WHISPER_SAMPLE_RATE, channels=1):
+        try:
+            segments = self.transcribe(to_whisper_audio(audio, sample_rate, channels))
+        except Exception as e:
+            print(e)
+            return ''
+        return ''.join(segment.text for segment in segments).strip()
+
+    @staticmethod
+    def to_segments(segments):
+        return [Segment(segment.text.strip(), segment.start, segment.end, segment.no_speech_prob, segment.avg_logprob,
+                        [(word.word, word.start, word.end) for word in segment.words or []])
+                for segment in segments]
+
+    def get_segments(self, audio, sample_rate=WHISPER_SAMPLE_RATE, channels=1, initial_prompt=None):
+        try:
+            return self.to_segments(self.transcribe(
+                to_whisper_audio(audio, sample_rate, channels), initial_prompt, word_timestamps=True))
+        except Exception as e:
+            print(e)
+            return []
+
+    def get_timed_words(self, audio, sample_rate=WHISPER_SAMPLE_RATE, channels=1, initial_prompt=None):
+        return words_of(self.get_segments(audio, sample_rate, channels, initial_prompt))
+
+    def transcribe_batch(self, requests):
+        # CTranslate2 already spreads one decode over its threads, so requests are decoded one after another
+        results = []
+        for request in requests:
+            segments = self.transcribe(request.audio, request.initial_prompt, request.word_timestamps)
+            if request.word_timestamps:
+                results.append(self.to_segments(segments))
+            else:
+                results.append(''.join(segment.text for segment in segments).strip())
+        return results
+
+
+class OnnxWhisperTranscriber:
+    """Whisper exported to ONNX and run with ONNX Runtime through optimum.
+
+    The exported decoder doesn't return the cross-attention whisper aligns words with, so word times are spread over each decoded segment by word length and are only approximate. Prompts aren't passed to the decoder."""
+
+    def __init__(self, model="openai/whisper-tiny.en", threads=0):
+        try:
+            import onnxruntime
+            from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
+            from transformers import WhisperProcessor
+        except ImportError:
+            raise AttributeError("Could not find optimum[onnxruntime]; check installation")
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        # a model id, or a directory without .onnx files, is exported when it is loaded
+        exported = os.path.isdir(model) and any(name.endswith('.onnx') for name in os.listdir(model))
+        self.processor = WhisperProcessor.from_pretrained(model)
+        self.audio_model = ORTModelForSpeechSeq2Seq.from_pretrained(
+            model, export=not exported, session_options=options, provider="CPUExecutionProvider")
+
+        print(f"[INFO] Whisper running on ONNX Runtime from {model}")
+
+    def transcribe(self, audios, word_timestamps=False):
+        features = self.processor.feature_extractor(
+            audios, sampling_rate=WHISPER_SAMPLE_RATE, return_tensors="pt").input_features
+        generated = self.audio_model.generate(features, return_timestamps=word_timestamps)
+
+        results = []
+        for audio, tokens in zip(audios, generated):
+            if not word_timestamps:
+                results.append(self.processor.decode(tokens, skip_special_tokens=True).strip())
+                continue
+            segments = []
+            for offset in self.processor.decode(tokens, output_offsets=True)["offsets"]:
+                # a segment cut off by the end of the audio has no end time
+                start, end = offset["timestamp"]
+                end = end if end is not None else len(audio) / WHISPER_SAMPLE_RATE
+                segments.append(Segment(offset["text"].strip(), start, end,
+                                        words=spread_words(offset["text"], start, end)))
+            results.append(segments)
+        return results
+
+    def get_transcription(self, audio, sample_rate=WHISPER_SAMPLE_RATE, channels=1):
+        try:
+            return self.transcribe([to_whisper_audio(audio, sample_rate, channels)])[0]
+        except Exception as e:
+            print(e)
+            return ''
+
+    def get_segments(self, audio, sample_rate=WHISPER_SAMPLE_RATE, channels=1, initial_prompt=None):
+        try:
+            return self.transcribe([to_whisper_audio(audio, sample_rate, channels)], word_timestamps=True)[0]
+        except Exception as e:
+            print(e)
+            return []
+
+    def get_timed_words(self, audio, sample_rate=WHISPER_SAMPLE_RATE, channels=1, initial_prompt=None):
+        return words_of(self.get_segments(audio, sample_rate, channels, initial_prompt))
+
+    def transcribe_batch(self, requests):
+        # one batched generate for the requests that want word times and one for those that don't
+        results = [None] * len(requests)
+        for word_timestamps in (False, True):
+            indices = [index for index, request in enumerate(requests) if request.word_timestamps == word_timestamps]
+            if indices:
+                batch = self.transcribe([requests[index].audio for index in indices], word_timestamps)
+                for index, result in zip(indices, batch):
+                    results[index] = result
+        return results
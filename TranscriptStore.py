@@ -0,0 +1,148 @@
+import json
+import threading
+from collections import deque
+
+
+class Phrase:
+    __slots__ = ('source', 'text', 'start', 'end', 'confidence')
+
+    def __init__(self, source, text, start, end, confidence=None):
+        self.source = source
+        self.text = text
+        self.start = start
+        self.end = end
+        self.confidence = confidence
+
+    def to_dict(self):
+        return {
+            "source": self.source,
+            "text": self.text,
+            "start": self.start.isoformat(),
+            "end": self.end.isoformat(),
+            "confidence": self.confidence,
+        }
+
+
+class TranscriptStore:
+    """
+    The last ``max_phrases`` phrases of a transcript from one or more sources, ordered by start time. Adding a phrase or revising the newest one is O(1), and the newest-first joined text is kept up to date as phrases change rather than rebuilt on every read.
+
+    Each source has one open phrase, its latest, which ``replace_latest`` revises while the speaker is still talking.
+
+    With ``history_path`` set, phrases that fall out of the window are appended to that file as JSON lines, so the full transcript of a long session is kept without holding it in memory.
+    """
+
+    def __init__(self, max_phrases, history_path=None):
+        self.max_phrases = max_phrases
+        self.phrases = deque(maxlen=max_phrases)
+        self.history_path = history_path
+        self._history_file = None
+        # source -> its latest phrase
+        self.open_phrases = {}
+        # newest-first text of every phrase but the latest, which is the only one that still changes
+        self._earlier_text = ''
+        self._text = ''
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.phrases)
+
+    @staticmethod
+    def format_phrase(phrase):
+        return f'{phrase.source}: {phrase.text.strip()}\n'
+
+    def append(self, source, text, time_spoken, confidence=None):
+        with self.lock:
+            phrase = Phrase(source, text, time_spoken, time_spoken, confidence)
+            if len(self.phrases) == self.max_phrases:
+                self.evict_oldest()
+
+            if not self.phrases or self.phrases[-1].start <= phrase.start:
+                if self.phrases:
+                    self._earlier_text = self.format_phrase(self.phrases[-1]) + self._earlier_text
+                self.phrases.append(phrase)
+                self._text = self.format_phrase(phrase) + self._earlier_text
+            else:
+                # a lane that fell behind can report a phrase that started before the newest one
+                index = len(self.phrases)
+                while index > 0 and self.phrases[index - 1].start > phrase.start:
+                    index -= 1
+                self.phrases.insert(index, phrase)
+                self.rebuild_text()
+            self.open_phrases[source] = phrase
+
+    def replace_latest(self, source, text, time_spoken, confidence=None):
+        with self.lock:
+            phrase = self.open_phrases.get(source)
+            if phrase is None:
+                return False
+            phrase.text = text
+            phrase.end = time_spoken
+            phrase.confidence = confidence
+            if phrase is self.phrases[-1]:
+                self._text = self.format_phrase(phrase) + self._earlier_text
+            else:
+                self.rebuild_text()
+            return True
+
+    def evict_oldest(self):
+        oldest = self.phrases.popleft()
+        if self.open_phrases.get(oldest.source) is oldest:
+            del self.open_phrases[oldest.source]
+        self._earlier_text = self._earlier_text[:len(self._earlier_text) - len(self.format_phrase(oldest))]
+        self.spill(oldest)
+
+    def rebuild_text(self):
+        newest_first = [self.format_phrase(phrase) for phrase in reversed(self.phrases)]
+        self._earlier_text = ''.join(newest_first[1:])
+        self._text = ''.join(newest_first)
+
+    def latest(self):
+        return self.phrases[-1] if self.phrases else None
+
+    def text(self):
+        """The phrases joined newest first."""
+        return self._text
+
+    def snapshot(self):
+        """A copy of the phrases, oldest first."""
+        with self.lock:
+            return [Phrase(p.source, p.text, p.start, p.end, p.confidence) for p in self.phrases]
+
+    def spill(self, phrase):
+        if self.history_path is None:
+            return
+        if self._history_file is None:
+            self._history_file = open(self.history_path, 'a', encoding='utf-8')
+        self._history_file.write(json.dumps(phrase.to_dict()) + '\n')
+        self._history_file.flush()
+
+    def history(self):
+        """Every phrase of the session, oldest first: spilled ones as dicts read back from ``history_path``, followed by those still in memory."""
+        if self.history_path is not None and self._history_file is not None:
+            with open(self.history_path, encoding='utf-8') as history_file:
+                for line in history_file:
+                    yield json.loads(line)
+        for phrase in self.snapshot():
+            yield phrase.to_dict()
+
+    def clear(self):
+        with self.lock:
+            self.phrases.clear()
+            self.open_phrases.clear()
+            self._earlier_text = ''
+            self._text = ''
+
+    def close(self):
+        with self.lock:
+            # phrases still in memory are written too, so the history file ends up complete
+            if self.history_path is not None:
+                for phrase in self.phrases:
+                    self.spill(phrase)
+                self.phrases.clear()
+                self.open_phrases.clear()
+                self._earlier_text = ''
+                self._text = ''
+            if self._history_file is not None:
+                self._history_file.close()
+                self._history_file = None
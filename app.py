@@ -1,23 +1,187 @@
+import argparse
+import io
+import os
 import queue
-import subprocess
+import socket
+import threading
 import time
-from flask import Flask
-from flask_socketio import SocketIO, emit
 import uuid
-from assistant import start_transcribing
+import wave
+from flask import Flask, Response, jsonify, redirect, request
+from flask_socketio import SocketIO, emit, join_room, leave_room
+from assistant import Session
+import InferenceScheduler
+import ResponseCache
+import SessionStore
+import Telemetry
+from TokenCoalescer import TokenCoalescer, is_marker
+
+# multi-worker mode: every worker points at the same Redis (or Redis-compatible) server, which fans Socket.IO emits
+# out to whichever worker holds the client's connection and keeps track of which worker holds each session's pipeline.
+# Clients must stick to one worker for the life of their connection (e.g. ip_hash in the load balancer), see run_workers.py
+MESSAGE_QUEUE = os.environ.get('MESSAGE_QUEUE')
+SESSION_STORE = os.environ.get('SESSION_STORE', MESSAGE_QUEUE)
+WORKER_ID = os.environ.get('WORKER_ID', f'{socket.gethostname()}-{os.getpid()}')
+# address other workers redirect uploads to, for sessions whose pipeline runs here
+WORKER_URL = os.environ.get('WORKER_URL', 'http://127.0.0.1:5000')
+MAX_SESSIONS_PER_WORKER = int(os.environ.get('MAX_SESSIONS_PER_WORKER', 16))
+HEARTBEAT_SECONDS = 5
+# sessions with no client commands and no new transcript for this long are closed, checked every heartbeat
+SESSION_IDLE_TIMEOUT = int(os.environ.get('SESSION_IDLE_TIMEOUT', 30 * 60))
+# seconds a session's command queue waits for another command from other workers before its task exits
+COMMAND_QUEUE_IDLE_SECONDS = 5
 
 app = Flask(__name__)
-socketio = SocketIO(app)
+socketio = SocketIO(app, message_queue=MESSAGE_QUEUE)
+# user_id -> {"session_id": ..., "worker_id": ...}, shared by all workers
+store = SessionStore.create_store(SESSION_STORE)
+
+# session_id -> Session, the pipelines running in this worker, each owning its own queues, recorder, transcriber
+# and responder
+sessions = {}
+# sid -> (user_id, session_id) of the clients connected to this worker that joined a session, so a disconnect can
+# end it
+connected_users = {}
+# session_id -> queue of commands from other workers, each run in order by a background task of its own
+command_queues = {}
+command_queues_lock = threading.Lock()
+worker_started = False
+# share of the machine's cores this process used over the last heartbeat interval
+worker_cpu_load = 0.0
+
+
+def reply(sid, event, message):
+    # emitting to the client's own room reaches it through the message queue from whichever worker runs the command
+    socketio.emit(event, message, room=sid)
+    app.logger.info(message)
+
+
+def dispatch(record, command, *args):
+    """Runs ``command`` against the session in ``record`` on the worker holding its pipeline."""
+    if record["worker_id"] == WORKER_ID:
+        run_command(command, record["session_id"], *args)
+    else:
+        store.publish(record["worker_id"], {"command": command, "session_id": record["session_id"], "args": args})
+
+
+def handle_command(message):
+    # commands from other workers, already checked against the command schema by the store
+    if message["command"] != 'create' and message["command"] not in COMMANDS:
+        print(f"[ERROR] Unknown command {message['command']!r} for session {message['session_id']}")
+        return
+    # runs on the store's subscriber thread, which only queues the command so a slow one (create starts the whole
+    # pipeline) doesn't hold up the commands of every other session
+    session_id = message["session_id"]
+    with command_queues_lock:
+        commands = command_queues.get(session_id)
+        if commands is None:
+            commands = command_queues[session_id] = queue.Queue()
+            socketio.start_background_task(run_queued_commands, session_id, commands)
+        commands.put((message["command"], message["args"]))
+
+
+def run_queued_commands(session_id, commands):
+    while True:
+        try:
+            command, args = commands.get(timeout=COMMAND_QUEUE_IDLE_SECONDS)
+        except queue.Empty:
+            with command_queues_lock:
+                if commands.empty():
+                    del command_queues[session_id]
+                    return
+            continue
+        try:
+            run_command(command, session_id, *args)
+        except Exception as e:
+            print(f"[ERROR] Command {command} for session {session_id} failed: {e!r}")
+
+
+def run_command(command, session_id, *args):
+    if command == 'create':
+        create_session(session_id, *args)
+        return
+    session = sessions.get(session_id)
+    if session is None:
+        # the worker that took leave-session has already answered it
+        if command != 'leave-session':
+            sid, user_id = args[:2]
+            reply(sid, f'{command}-response', f'User ID {user_id} not found')
+        return
+    session.touch()
+    COMMANDS[command](session, *args)
+
+
+def create_session(session_id, user_id):
+    session = Session(session_id, user_id)
+    try:
+        session.start_transcribing()
+    except Exception as e:
+        # a half-built session would stay registered with its recorders running
+        print(f"[ERROR] Could not start session {session_id} of {user_id}: {e!r}")
+        discard_session(session, f'Session {session_id} of {user_id} could not be started')
+        return
+    sessions[session_id] = session
+    send_heartbeat()
+
+
+def discard_session(session, message):
+    # ends a session this worker gave up on, rather than one its user left, and tells the user
+    record = store.get_user(session.user_id)
+    if record is not None and record["session_id"] == session.session_id:
+        store.remove_user(session.user_id)
+    for sid, (_, session_id) in list(connected_users.items()):
+        if session_id == session.session_id:
+            connected_users.pop(sid, None)
+    sessions.pop(session.session_id, None)
+    socketio.emit('leave-session-response', message, room=session.session_id)
+    app.logger.info(message)
+    socketio.start_background_task(session.close)
+
+
+def send_heartbeat():
+    store.heartbeat(WORKER_ID, {"url": WORKER_URL, "sessions": len(sessions), "capacity": MAX_SESSIONS_PER_WORKER,
+                                "load": worker_cpu_load})
+
 
-try:
-    subprocess.run(["ffmpeg", "-version"],
-                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-except FileNotFoundError:
-    print("ERROR: The ffmpeg library is not installed. Please install ffmpeg and try again.")
+def heartbeat_loop():
+    global worker_cpu_load
+    last_wall, last_cpu = time.monotonic(), time.process_time()
+    while True:
+        reap_idle_sessions()
+        send_heartbeat()
+        socketio.sleep(HEARTBEAT_SECONDS)
+        wall, cpu = time.monotonic(), time.process_time()
+        worker_cpu_load = (cpu - last_cpu) / max(wall - last_wall, 1e-3) / (os.cpu_count() or 1)
+        last_wall, last_cpu = wall, cpu
 
-user_sessions = {}
-transcript_queue = queue.Queue()
-suggestion_queue = queue.Queue()
+
+def reap_idle_sessions():
+    for session in list(sessions.values()):
+        if session.idle_seconds() >= SESSION_IDLE_TIMEOUT and sessions.get(session.session_id) is session:
+            discard_session(session, f'Session {session.session_id} of {session.user_id} closed after being idle')
+
+
+def end_session(user_id, sid, session_id=None):
+    # frees the user's pipeline, wherever it runs, returns the user's session record or None if they had none;
+    # with ``session_id`` only that session is ended, not a newer one the user has joined since
+    record = store.get_user(user_id)
+    if record is not None and session_id is not None and record["session_id"] != session_id:
+        return None
+    if record is not None:
+        store.remove_user(user_id)
+        dispatch(record, 'leave-session', sid, user_id)
+    return record
+
+
+def start_worker():
+    """Registers this worker for session placement and starts taking commands from the other workers."""
+    global worker_started
+    if worker_started:
+        return
+    worker_started = True
+    store.subscribe(WORKER_ID, handle_command)
+    send_heartbeat()
+    socketio.start_background_task(heartbeat_loop)
 
 
 @socketio.on('ping')
@@ -27,81 +191,297 @@ def handle_ping():
 
 @socketio.on('join-session')
 def handle_join_session(user_id):
-    if user_id in user_sessions:
+    session_id = str(uuid.uuid4())
+    # the pipeline goes to the least loaded worker, this one if no other has checked in
+    worker_id = SessionStore.pick_worker(store.workers()) or WORKER_ID
+    if not store.add_user(user_id, session_id, worker_id):
         message = f'User ID {user_id} already in a session'
         emit('join-session-response', message)
         app.logger.info(message)
 
     else:
-        session_id = str(uuid.uuid4())
-        user_sessions[user_id] = False
+        join_room(session_id)
+        connected_users[request.sid] = (user_id, session_id)
         message = f'User ID {user_id} joined session {session_id} successfully'
         emit('join-session-response', message)
-        app.logger.info(message)
-        start_transcribing(transcript_queue, suggestion_queue)
+        app.logger.info(f'{message} on worker {worker_id}')
+        dispatch({"session_id": session_id, "worker_id": worker_id}, 'create', user_id)
 
 
-@socketio.on('start-assistant')
-def handle_start_assistant(user_id):
-    if user_id not in user_sessions:
+def emit_queue(session, message_queue, event):
+    last_message = None
+
+    while True:
+        message = message_queue.get()
+        if message is None:
+            break
+
+        if last_message != message:
+            socketio.emit(event, message, room=session.session_id)
+            app.logger.info(message)
+            last_message = message
+
+
+def emit_coalesced_queue(session, message_queue, event, coalescer):
+    # streamed tokens are sent in batches, each flush of the coalescer is one Socket.IO frame
+    def emit_frame(text):
+        if text is not None:
+            socketio.emit(event, text, room=session.session_id)
+            app.logger.debug(text)
+            if session.responder is not None:
+                session.responder.mark_emitted()
+
+    while True:
+        try:
+            message = message_queue.get(timeout=coalescer.time_until_flush())
+        except queue.Empty:
+            emit_frame(coalescer.flush())
+            continue
+
+        if message is None:
+            emit_frame(coalescer.flush())
+            break
+
+        if is_marker(message):
+            emit_frame(coalescer.flush())
+            socketio.emit(event, message, room=session.session_id)
+            app.logger.info(message)
+        else:
+            emit_frame(coalescer.add(message))
+
+
+def forward(event, user_id, *args):
+    # runs the command named after ``event`` wherever the user's pipeline is, answering not found if there is none
+    record = store.get_user(user_id)
+    if record is None:
         message = f'User ID {user_id} not found'
-        emit('start-assistant-response', message)
+        emit(f'{event}-response', message)
         app.logger.info(message)
     else:
-        user_sessions[user_id] = True
-        lastTranscriptionMessage = None
-        lastSuggestionMessage = None
+        dispatch(record, event, request.sid, user_id, *args)
+    return record
+
+
+def start_assistant(session, sid, user_id):
+    if not session.active:
+        session.active = True
+        socketio.start_background_task(
+            emit_queue, session, session.transcript_queue, 'start-assistant-transcription-response')
+        socketio.start_background_task(
+            emit_coalesced_queue, session, session.suggestion_queue, 'start-assistant-suggestion-response',
+            TokenCoalescer())
+
 
-        while True:
-            if transcript_queue.qsize() > 0:
-                transcription_message = transcript_queue.get_nowait()
+def stop_assistant(session, sid, user_id):
+    reply(sid, 'stop-assistant-response', f'Stop assistant for {user_id} of session successfully')
+    session.stop_assistant()
 
-                if lastTranscriptionMessage != transcription_message:
-                    emit('start-assistant-transcription-response',
-                         transcription_message)
-                    app.logger.info(transcription_message)
-                    lastTranscriptionMessage = transcription_message
 
-            if suggestion_queue.qsize() > 0:
-                suggestion_message = suggestion_queue.get_nowait()
+def session_metrics(session, sid, user_id):
+    socketio.emit('session-metrics-response', session.get_metrics(), room=sid)
 
-                if lastSuggestionMessage != suggestion_message:
-                    emit('start-assistant-suggestion-response', suggestion_message)
-                    app.logger.info(suggestion_message)
-                    lastSuggestionMessage = suggestion_message
 
-            time.sleep(0.05)
+@socketio.on('start-assistant')
+def handle_start_assistant(user_id):
+    forward('start-assistant', user_id)
 
 
 @socketio.on('stop-assistant')
 def handle_stop_assistant(user_id):
-    if user_id not in user_sessions:
-        message = f'User ID {user_id} not found'
-        emit('stop-assistant-response', message)
-        app.logger.info(message)
-    else:
-        message = f'Stop assistant for {user_id} of session successfully'
-        user_sessions[user_id] = False
-        emit('stop-assistant-response', message)
-        app.logger.info(message)
-        suggestion_queue.queue.clear()
-        transcript_queue.queue.clear()
+    forward('stop-assistant', user_id)
+
+
+@socketio.on('session-metrics')
+def handle_session_metrics(user_id):
+    forward('session-metrics', user_id)
+
+
+# per-session metrics exported at /metrics: (name, type, help, section of Session.get_metrics, key); counters only
+# ever grow over a session's life, gauges go up and down
+SESSION_METRICS = (
+    ("audio_queue_depth", "gauge", "Chunks of audio waiting to be transcribed.", "audio_queues", "depth"),
+    ("audio_queue_seconds", "gauge", "Seconds of audio waiting to be transcribed.", "audio_queues", "queued_seconds"),
+    ("audio_dropped_seconds_total", "counter", "Seconds of audio dropped because transcription fell behind.",
+     "audio_queues", "dropped_seconds"),
+    ("audio_time_in_queue_seconds", "gauge", "Running average of the time audio waits to be transcribed.",
+     "audio_queues", "average_time_in_queue"),
+    ("llm_generations_total", "counter", "Suggestions generated to completion.", "responder", "generations"),
+    ("llm_cancelled_generations_total", "counter", "Suggestions cancelled by a newer transcript.", "responder",
+     "cancelled_generations"),
+    ("llm_wasted_tokens_total", "counter", "Tokens streamed by suggestions that were then cancelled.", "responder",
+     "wasted_tokens"),
+    ("llm_time_saved_seconds_total", "counter",
+     "Estimated generation time saved by cancelling outdated suggestions.", "responder", "time_saved_seconds"),
+    ("llm_prior_estimated_cancellations_total", "counter",
+     "Cancellations before any suggestion completed, whose time saved is estimated from a fixed prior.", "responder",
+     "prior_estimated_cancellations"),
+    ("llm_prompt_tokens_total", "counter", "Prompt tokens sent to the LLM.", "responder", "prompt_tokens"),
+    ("transcription_dropped_segments_total", "counter", "Decoded segments dropped for low confidence.",
+     "transcriber", "dropped_segments"),
+)
+
+# response cache metrics exported at /metrics without a session label, the cache is shared by every session: (name,
+# type, help, key of ResponseCache.snapshot)
+CACHE_METRICS = (
+    ("response_cache_hits_total", "counter", "Suggestions answered from the response cache.", "hits"),
+    ("response_cache_misses_total", "counter", "Response cache lookups that found nothing.", "misses"),
+    ("response_cache_expirations_total", "counter", "Cached responses dropped for being too old.", "expirations"),
+    ("response_cache_evictions_total", "counter", "Cached responses dropped to stay within the size limits.",
+     "evictions"),
+    ("response_cache_entries", "gauge", "Responses held in the cache.", "entries"),
+    ("response_cache_bytes", "gauge", "Approximate memory held by cached responses.", "bytes"),
+)
+
+
+@app.route('/metrics')
+def metrics():
+    lines = []
+    cache_metrics = ResponseCache.get_cache().snapshot()
+    for name, metric_type, description, key in CACHE_METRICS:
+        name = f'{Telemetry.METRIC_PREFIX}_{name}'
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} {metric_type}',
+                  Telemetry.format_sample(name, {}, cache_metrics[key])]
+    metrics_by_session = {session_id: session.get_metrics() for session_id, session in list(sessions.items())}
+    for name, metric_type, description, section, key in SESSION_METRICS:
+        name = f'{Telemetry.METRIC_PREFIX}_{name}'
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} {metric_type}']
+        for session_id, values in metrics_by_session.items():
+            if section == "audio_queues":
+                for source_name, queue_metrics in values[section].items():
+                    lines.append(Telemetry.format_sample(
+                        name, {"session": session_id, "source": source_name}, queue_metrics[key]))
+            elif key in values[section]:
+                lines.append(Telemetry.format_sample(name, {"session": session_id}, values[section][key]))
+
+    text = Telemetry.get_registry().render() + '\n'.join(lines) + '\n'
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/sessions/<user_id>/upload', methods=['POST'])
+def upload_audio(user_id):
+    # a WAV file, either as the "file" field of a multipart form or as the raw request body
+    record = store.get_user(user_id)
+    if record is None:
+        return jsonify({"error": f'User ID {user_id} not found'}), 404
+    if record["worker_id"] != WORKER_ID:
+        # 307 keeps the method and body, so the client re-sends the upload to the worker holding the pipeline
+        worker = store.workers().get(record["worker_id"])
+        if worker is None:
+            return jsonify({"error": f'Worker for user ID {user_id} is unavailable'}), 503
+        return redirect(f'{worker["url"]}/sessions/{user_id}/upload', code=307)
+
+    session = sessions.get(record["session_id"])
+    if session is None:
+        return jsonify({"error": f'User ID {user_id} not found'}), 404
+
+    upload = request.files.get('file')
+    data = upload.read() if upload is not None else request.get_data()
+    try:
+        phrases = session.ingest_file(io.BytesIO(data))
+    except (EOFError, ValueError, AssertionError, wave.Error) as e:
+        return jsonify({"error": f'Could not read audio: {e}'}), 400
+
+    app.logger.info(f'Transcribed {len(phrases)} phrases uploaded by {user_id}')
+    return jsonify({
+        "session_id": session.session_id,
+        "phrases": [{"start": start, "end": end, "text": text} for start, end, text in phrases],
+    })
+
+
+def start_stream(session, sid, user_id, options):
+    # ``options`` describes the raw PCM the client will send: sample_rate, sample_width (bytes) and channels
+    options = options or {}
+    try:
+        if not isinstance(options, dict):
+            raise ValueError('Stream options must be an object')
+        session.start_stream(int(options.get('sample_rate', 16000)), int(options.get('sample_width', 2)),
+                             int(options.get('channels', 1)))
+    except (TypeError, ValueError) as e:
+        reply(sid, 'start-stream-response', f'Could not start streaming audio for {user_id}: {e}')
+        return
+    reply(sid, 'start-stream-response', f'Streaming audio for {user_id} started successfully')
+
+
+def audio_chunk(session, sid, user_id, data):
+    try:
+        if not session.feed_stream(data):
+            socketio.emit('audio-chunk-response', f'No audio stream started for {user_id}', room=sid)
+    except (TypeError, ValueError) as e:
+        socketio.emit('audio-chunk-response', f'Could not read audio chunk from {user_id}: {e}', room=sid)
+
+
+def stop_stream(session, sid, user_id):
+    session.stop_stream()
+    reply(sid, 'stop-stream-response', f'Streaming audio for {user_id} stopped successfully')
+
+
+def leave_session(session, sid, user_id):
+    if sessions.pop(session.session_id, None) is not None:
+        # stopping the recorders waits for them to finish their phrase, so it doesn't hold up the next event
+        socketio.start_background_task(session.close)
+        send_heartbeat()
+
+
+@socketio.on('start-stream')
+def handle_start_stream(user_id, options=None):
+    forward('start-stream', user_id, options)
+
+
+@socketio.on('audio-chunk')
+def handle_audio_chunk(user_id, data):
+    forward('audio-chunk', user_id, data)
+
+
+@socketio.on('stop-stream')
+def handle_stop_stream(user_id):
+    forward('stop-stream', user_id)
 
 
 @socketio.on('leave-session')
 def handle_leave_session(user_id):
-    if user_id not in user_sessions:
+    connected_users.pop(request.sid, None)
+    record = end_session(user_id, request.sid)
+    if record is None:
         message = f'User ID {user_id} not found'
-        emit('leave-session-response', message)
-        app.logger.info(message)
     else:
+        leave_room(record["session_id"])
         message = f'Remove {user_id} of session successfully'
-        del user_sessions[user_id]
-        emit('leave-session-response', message)
-        app.logger.info(message)
-        suggestion_queue.queue.clear()
-        transcript_queue.queue.clear()
+    emit('leave-session-response', message)
+    app.logger.info(message)
+
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    # a client that goes away without leaving would otherwise keep its pipeline running until it is reaped
+    connection = connected_users.pop(request.sid, None)
+    if connection is not None:
+        user_id, session_id = connection
+        # a session the worker has since closed, e.g. for being idle, may have been replaced by a new one
+        if end_session(user_id, request.sid, session_id) is not None:
+            app.logger.info(f'User ID {user_id} disconnected, session closed')
+
+
+# event -> command run on the worker holding the session's pipeline
+COMMANDS = {
+    'start-assistant': start_assistant,
+    'stop-assistant': stop_assistant,
+    'session-metrics': session_metrics,
+    'start-stream': start_stream,
+    'audio-chunk': audio_chunk,
+    'stop-stream': stop_stream,
+    'leave-session': leave_session,
+}
 
 
 if __name__ == '__main__':
-    socketio.run(app, debug=True)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+    if 'WORKER_URL' not in os.environ:
+        WORKER_URL = f'http://{args.host}:{args.port}'
+
+    InferenceScheduler.preload_models()
+    start_worker()
+    # the reloader would load the models and start the worker a second time, in its child process
+    socketio.run(app, host=args.host, port=args.port, debug=MESSAGE_QUEUE is None, use_reloader=False)
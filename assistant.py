@@ -1,24 +1,186 @@
+import os
 import queue
 import threading
+import time
+from datetime import datetime, timedelta
+import AudioIngest
 import AudioRecorder
+import ResponseCache
+import Telemetry
+from AudioChannel import AudioChannel
 from AudioTranscriber import AudioTranscriber
 from GPTResponder import GPTResponder
-import TranscriberModels
-
-
-def start_transcribing(transcript_queue, suggestion_queue):
-    audio_queue = queue.Queue()
-    speaker_audio_recorder = AudioRecorder.DefaultSpeakerRecorder()
-    speaker_audio_recorder.record_into_queue(audio_queue)
-    model = TranscriberModels.get_model()
-    transcriber = AudioTranscriber(speaker_audio_recorder.source, model)
-    transcribe = threading.Thread(
-        target=transcriber.transcribe_audio_queue, args=(audio_queue, transcript_queue))
-    transcribe.daemon = True
-    transcribe.start()
-
-    responder = GPTResponder()
-    respond = threading.Thread(
-        target=responder.respond_to_transcriber, args=(transcriber, transcript_queue, suggestion_queue))
-    respond.daemon = True
-    respond.start()
+from InferenceScheduler import get_scheduler
+
+# when set, each session's full transcript is written to <dir>/<session_id>.jsonl as phrases age out of memory
+TRANSCRIPT_HISTORY_DIR = None
+# audio sources every session captures, keys of AudioRecorder.RECORDERS; each gets its own capture and transcription lane
+AUDIO_SOURCES = ("You", "Speaker")
+UPLOAD_SOURCE = "Upload"
+STREAM_SOURCE = "Browser"
+# seconds a transcription lane gets to finish the chunk it is decoding when the session stops
+LANE_STOP_TIMEOUT = 5
+
+
+class Session:
+    def __init__(self, session_id, user_id):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.active = False
+
+        # source name -> bounded channel, so a lane that falls behind sheds audio instead of growing memory and latency
+        self.audio_queues = {}
+        self.transcript_queue = queue.Queue()
+        self.suggestion_queue = queue.Queue()
+
+        self.recorders = {}
+        self.transcriber = None
+        self.responder = None
+        self.respond_task = None
+        self.threads = []
+        # source name -> StreamIngest for audio pushed by the client
+        self.streams = {}
+        self.closed = False
+        self.last_activity = time.monotonic()
+
+    def start_transcribing(self):
+        for source_name in AUDIO_SOURCES:
+            try:
+                recorder = AudioRecorder.RECORDERS[source_name]()
+            except AttributeError as e:
+                # without live capture the session still transcribes uploaded and streamed audio
+                print(f"[INFO] Not capturing {source_name}: {e}")
+                continue
+            self.audio_queues[source_name] = AudioChannel(session_id=self.session_id)
+            recorder.record_into_queue(self.audio_queues[source_name])
+            self.recorders[source_name] = recorder
+
+        history_path = None
+        if TRANSCRIPT_HISTORY_DIR is not None:
+            os.makedirs(TRANSCRIPT_HISTORY_DIR, exist_ok=True)
+            history_path = os.path.join(TRANSCRIPT_HISTORY_DIR, f'{self.session_id}.jsonl')
+        sources = {source_name: recorder.source for source_name, recorder in self.recorders.items()}
+        # every lane submits to the shared scheduler, so sources are batched together rather than each adding a decode
+        self.transcriber = AudioTranscriber(sources, get_scheduler(), history_path)
+        self.transcriber.add_transcript_listener(self.touch)
+
+        self.threads = []
+        for audio_queue in self.audio_queues.values():
+            self.start_lane(audio_queue)
+
+        self.responder = GPTResponder()
+        self.respond_task = self.responder.start(
+            self.transcriber, self.transcript_queue, self.suggestion_queue)
+        self.respond_task.add_done_callback(self.on_responder_done)
+
+    def on_responder_done(self, task):
+        # the responder only stops by being cancelled, anything else means the session has lost its suggestions
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[ERROR] Responder for session {self.session_id} stopped: {task.exception()!r}")
+
+    def start_lane(self, audio_queue):
+        transcribe = threading.Thread(
+            target=self.transcriber.transcribe_audio_queue, args=(audio_queue, self.transcript_queue))
+        transcribe.daemon = True
+        transcribe.start()
+        self.threads.append(transcribe)
+
+    def ingest_file(self, file, source_name=UPLOAD_SOURCE):
+        # phrases are stamped as if the recording had just ended, and added in order so the responder sees them as they land
+        phrases = AudioIngest.transcribe_file(file, get_scheduler())
+        ended = datetime.utcnow()
+        duration = phrases[-1][1] if phrases else 0
+        for start, end, text in phrases:
+            self.transcriber.add_phrase(
+                source_name, text, ended - timedelta(seconds=duration - end), self.transcript_queue)
+        return phrases
+
+    def start_stream(self, sample_rate, sample_width=2, channels=1, source_name=STREAM_SOURCE):
+        # checked before anything is torn down or registered, so a bad format leaves the session as it was
+        AudioIngest.check_format(sample_rate, sample_width, channels)
+        if source_name in self.streams:
+            self.stop_stream(source_name)
+        self.transcriber.add_source(source_name, sample_rate, sample_width, channels)
+        if source_name not in self.audio_queues:
+            self.audio_queues[source_name] = AudioChannel(session_id=self.session_id)
+            self.start_lane(self.audio_queues[source_name])
+        self.streams[source_name] = AudioIngest.StreamIngest(
+            source_name, self.audio_queues[source_name], sample_rate, sample_width, channels)
+
+    def feed_stream(self, data, source_name=STREAM_SOURCE):
+        stream = self.streams.get(source_name)
+        if stream is None:
+            return False
+        stream.feed(data)
+        return True
+
+    def stop_stream(self, source_name=STREAM_SOURCE):
+        stream = self.streams.pop(source_name, None)
+        if stream is not None:
+            stream.close()
+
+    def touch(self, trace=None):
+        # also a transcript listener, so a session that is still hearing speech is never idle
+        self.last_activity = time.monotonic()
+
+    def idle_seconds(self):
+        return time.monotonic() - self.last_activity
+
+    def get_metrics(self):
+        return {
+            "audio_queues": {name: audio_queue.snapshot() for name, audio_queue in self.audio_queues.items()},
+            "responder": dict(self.responder.metrics) if self.responder else {},
+            # the cache is shared by every session in the process, so these count all of their lookups
+            "response_cache": ResponseCache.get_cache().snapshot(),
+            "transcriber": {"dropped_segments": self.transcriber.dropped_segments} if self.transcriber else {},
+            "latency": Telemetry.get_registry().summary(self.session_id),
+        }
+
+    def clear_queues(self):
+        self.suggestion_queue.queue.clear()
+        self.transcript_queue.queue.clear()
+
+    def close_streams(self):
+        # a None message tells the emitters of both queues to stop
+        self.clear_queues()
+        self.transcript_queue.put(None)
+        self.suggestion_queue.put(None)
+
+    def stop_assistant(self):
+        if self.active:
+            self.active = False
+            self.close_streams()
+
+    def stop_transcribing(self):
+        # every recorder is told to stop before waiting on any, each one can take a second or two to finish its phrase
+        for recorder in self.recorders.values():
+            recorder.stop(wait=False)
+        for recorder in self.recorders.values():
+            recorder.stop()
+        self.recorders = {}
+
+        for source_name in list(self.streams):
+            self.stop_stream(source_name)
+        for audio_queue in self.audio_queues.values():
+            audio_queue.close()
+        for thread in self.threads:
+            thread.join(LANE_STOP_TIMEOUT)
+        self.threads = []
+
+        if self.respond_task is not None:
+            self.respond_task.cancel()
+            self.respond_task = None
+
+    def close_transcript(self):
+        if self.transcriber is not None:
+            self.transcriber.transcript.close()
+
+    def close(self):
+        """Stops capture, transcription and responding, and frees everything the session holds. Safe to call more than once."""
+        if self.closed:
+            return
+        self.closed = True
+        self.stop_assistant()
+        self.stop_transcribing()
+        self.close_transcript()
+        Telemetry.get_registry().remove_session(self.session_id)
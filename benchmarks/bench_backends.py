@@ -0,0 +1,114 @@
+"""Compares the transcription backends in TranscriberModels by real-time factor and memory, across model sizes and thread counts.
+
+Every backend, size and thread count is measured in a fresh subprocess so model memory doesn't carry over. ``--audio`` (a WAV file of speech) is cut into ``--window`` second windows, which are decoded with word timestamps in batches of ``--batch``, the way the streaming transcription lanes use the model. The real-time factor is decode time over audio time, below 1 is faster than real time. Backends whose packages aren't installed are skipped.
+
+Run from the repository root: ``python benchmarks/bench_backends.py --audio speech.wav --backends whisper faster-whisper onnx --sizes tiny base small``
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import AudioIngest  # noqa: E402
+import InferenceScheduler  # noqa: E402
+import TranscriberModels  # noqa: E402
+
+
+def model_for(backend, size, english_only):
+    name = f'{size}.en' if english_only and size not in ("large", "large-v2", "large-v3") else size
+    return f'openai/whisper-{name}' if backend == "onnx" else name
+
+
+def rss_mb():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def run_one(args):
+    audio, sample_rate = AudioIngest.read_audio_file(args.audio)
+    audio = TranscriberModels.to_whisper_audio(audio, sample_rate)
+    window = int(args.window * TranscriberModels.WHISPER_SAMPLE_RATE)
+    windows = [audio[start:start + window] for start in range(0, len(audio) - window // 2, window)]
+
+    rss_before = rss_mb()
+    started = time.monotonic()
+    model = TranscriberModels.create_transcriber(
+        args.backend, model_for(args.backend, args.size, not args.multilingual), args.threads)
+    load_seconds = time.monotonic() - started
+    rss_loaded = rss_mb()
+
+    def decode(batch):
+        return model.transcribe_batch([InferenceScheduler.InferenceRequest(samples, None, True) for samples in batch])
+
+    decode(windows[:1])
+    words = 0
+    started = time.monotonic()
+    for start in range(0, len(windows), args.batch):
+        words += sum(len(result) for result in decode(windows[start:start + args.batch]))
+    decode_seconds = time.monotonic() - started
+
+    audio_seconds = sum(len(samples) for samples in windows) / TranscriberModels.WHISPER_SAMPLE_RATE
+    print(json.dumps({
+        "backend": args.backend,
+        "size": args.size,
+        "threads": args.threads,
+        "load_seconds": load_seconds,
+        "rtf": decode_seconds / audio_seconds,
+        "seconds_per_window": decode_seconds / len(windows),
+        "words": words,
+        "model_mb": rss_loaded - rss_before,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--audio", required=True, help="WAV file of speech to transcribe")
+    parser.add_argument("--backends", nargs="+", default=list(TranscriberModels.BACKENDS),
+                        choices=TranscriberModels.BACKENDS)
+    parser.add_argument("--sizes", nargs="+", default=["tiny", "base", "small"])
+    parser.add_argument("--threads", nargs="+", type=int, default=[os.cpu_count() or 1])
+    parser.add_argument("--multilingual", action="store_true", help="use the multilingual models instead of .en")
+    parser.add_argument("--window", type=float, default=10.0, help="seconds of audio per decode")
+    parser.add_argument("--batch", type=int, default=1, help="windows decoded together")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--backend", help=argparse.SUPPRESS)
+    parser.add_argument("--size", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend is not None:
+        args.threads = args.threads[0]
+        run_one(args)
+        return
+
+    results = []
+    header = f"{'backend':<16}{'size':<8}{'threads':>8}{'load s':>9}{'RTF':>8}{'s/window':>10}{'model MB':>10}{'peak MB':>9}"
+    print(header)
+    for backend in args.backends:
+        for size in args.sizes:
+            for threads in args.threads:
+                command = [sys.executable, os.path.abspath(__file__), "--audio", args.audio, "--backend", backend,
+                           "--size", size, "--threads", str(threads), "--window", str(args.window),
+                           "--batch", str(args.batch)] + (["--multilingual"] if args.multilingual else [])
+                completed = subprocess.run(command, capture_output=True, text=True)
+                lines = [line for line in completed.stdout.splitlines() if line.startswith("{")]
+                if completed.returncode != 0 or not lines:
+                    reason = (completed.stderr.strip().splitlines() or ["no output"])[-1]
+                    print(f"{backend:<16}{size:<8}{threads:>8}  skipped: {reason}")
+                    continue
+                result = json.loads(lines[-1])
+                results.append(result)
+                print(f"{backend:<16}{size:<8}{threads:>8}{result['load_seconds']:>9.1f}{result['rtf']:>8.3f}"
+                      f"{result['seconds_per_window']:>10.3f}{result['model_mb']:>10.0f}{result['peak_rss_mb']:>9.0f}")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Measures Socket.IO events/s, bytes/s and encoding CPU for streamed suggestions, sent token by token versus through TokenCoalescer.
+
+Token streams are simulated on a virtual clock, so the run takes seconds whatever ``--seconds`` is. Every frame is encoded the way python-socketio frames an event (``42["event", data]``) to count bytes and CPU.
+
+Run from the repository root: ``python benchmarks/bench_coalescing.py --sessions 1 10 50 100``
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from TokenCoalescer import TokenCoalescer  # noqa: E402
+
+EVENT = 'start-assistant-suggestion-response'
+WORDS = ("the quick brown fox jumps over the lazy dog and then we should talk about the next slide "
+         "because the numbers look good this quarter").split()
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def token_stream(rng, seconds, tokens_per_second):
+    # (time, token) pairs, with an end of sentence every 8 to 20 tokens
+    t, until_sentence_end = 0.0, rng.randint(8, 20)
+    while t < seconds:
+        t += rng.expovariate(tokens_per_second)
+        until_sentence_end -= 1
+        token = ' ' + rng.choice(WORDS)
+        if until_sentence_end == 0:
+            token += '.'
+            until_sentence_end = rng.randint(8, 20)
+        yield t, token
+
+
+def encode(data):
+    return ('42' + json.dumps([EVENT, data], separators=(',', ':'))).encode()
+
+
+def run(sessions, seconds, tokens_per_second, coalesce, flush_interval_ms, max_chars, seed=0):
+    rng = random.Random(seed)
+    events = 0
+    sent_bytes = 0
+    cpu_start = time.process_time()
+
+    for _ in range(sessions):
+        clock = VirtualClock()
+        coalescer = TokenCoalescer(flush_interval_ms, max_chars, clock=clock)
+        for t, token in token_stream(rng, seconds, tokens_per_second):
+            frames = []
+            if coalesce:
+                # the emitter's queue timeout fires before the next token arrives when the batch is due
+                wait = coalescer.time_until_flush()
+                if wait is not None and clock.now + wait < t:
+                    clock.now += wait
+                    frames.append(coalescer.flush())
+                clock.now = t
+                frames.append(coalescer.add(token))
+            else:
+                frames.append(token)
+
+            for frame in frames:
+                if frame is not None:
+                    events += 1
+                    sent_bytes += len(encode(frame))
+
+        last_frame = coalescer.flush()
+        if last_frame is not None:
+            events += 1
+            sent_bytes += len(encode(last_frame))
+
+    cpu = time.process_time() - cpu_start
+    return events / seconds, sent_bytes / seconds, cpu / seconds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 50, 100])
+    parser.add_argument("--seconds", type=float, default=30.0, help="simulated streaming time")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="per session")
+    parser.add_argument("--flush-interval-ms", type=float, default=50.0)
+    parser.add_argument("--max-chars", type=int, default=80)
+    args = parser.parse_args()
+
+    print(f"{'sessions':>8} {'mode':>10} {'events/s':>10} {'bytes/s':>12} {'cpu ms/s':>10}")
+    for sessions in args.sessions:
+        for coalesce in (False, True):
+            events, sent_bytes, cpu = run(sessions, args.seconds, args.tokens_per_second, coalesce,
+                                          args.flush_interval_ms, args.max_chars)
+            mode = "coalesced" if coalesce else "per-token"
+            print(f"{sessions:>8} {mode:>10} {events:>10.0f} {sent_bytes:>12.0f} {cpu:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Compares custom_speech_recognition.dsp against audioop (when the running Python still ships it).
+
+Run from the repository root: ``python benchmarks/bench_dsp.py``
+"""
+import os
+import sys
+import timeit
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from custom_speech_recognition import dsp  # noqa: E402
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    try:
+        import audioop
+    except ImportError:
+        audioop = None
+
+SAMPLE_RATE = 48000
+rng = np.random.default_rng(0)
+chunk_30ms = rng.integers(-32768, 32767, size=SAMPLE_RATE * 30 // 1000, dtype=np.int16).tobytes()
+stereo_3s = rng.integers(-32768, 32767, size=SAMPLE_RATE * 3 * 2, dtype=np.int16).tobytes()
+mono_3s = rng.integers(-32768, 32767, size=SAMPLE_RATE * 3, dtype=np.int16).tobytes()
+pcm24_3s = rng.integers(0, 256, size=SAMPLE_RATE * 3 * 3, dtype=np.uint8).tobytes()
+
+
+def expand_24_to_32_join(buffer):
+    # the per-sample fallback AudioFileStream.read used before dsp
+    return b"".join(b"\x00" + buffer[i:i + 3] for i in range(0, len(buffer), 3))
+
+
+CASES = [
+    ("rms 30 ms int16",
+     lambda: audioop.rms(chunk_30ms, 2),
+     lambda: dsp.rms(chunk_30ms, 2)),
+    ("bias 3 s int16",
+     lambda: audioop.bias(mono_3s, 2, -128),
+     lambda: dsp.bias(mono_3s, 2, -128)),
+    ("lin2lin 3 s 16->32 bit",
+     lambda: audioop.lin2lin(mono_3s, 2, 4),
+     lambda: dsp.lin2lin(mono_3s, 2, 4)),
+    ("byteswap 3 s int16",
+     lambda: audioop.byteswap(mono_3s, 2),
+     lambda: dsp.byteswap(mono_3s, 2)),
+    ("tomono 3 s stereo",
+     lambda: audioop.tomono(stereo_3s, 2, 1, 1),
+     lambda: dsp.tomono(stereo_3s, 2, 1, 1)),
+    ("resample 3 s 48k->16k",
+     lambda: audioop.ratecv(mono_3s, 2, 1, SAMPLE_RATE, 16000, None),
+     lambda: dsp.resample(mono_3s, 2, 1, SAMPLE_RATE, 16000)),
+    ("resample 3 s 44.1k->16k",
+     lambda: audioop.ratecv(mono_3s, 2, 1, 44100, 16000, None),
+     lambda: dsp.resample(mono_3s, 2, 1, 44100, 16000)),
+]
+
+
+def best_of(function, number):
+    return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+
+def main():
+    print(f"{'operation':<28}{'audioop (us)':>14}{'dsp (us)':>12}{'speedup':>10}")
+    for name, audioop_function, dsp_function in CASES:
+        number = 2000 if "30 ms" in name else 20
+        dsp_time = best_of(dsp_function, number) * 1e6
+        if audioop is None:
+            print(f"{name:<28}{'n/a':>14}{dsp_time:>12.1f}{'':>10}")
+            continue
+        audioop_time = best_of(audioop_function, number) * 1e6
+        print(f"{name:<28}{audioop_time:>14.1f}{dsp_time:>12.1f}{audioop_time / dsp_time:>9.2f}x")
+
+    join_time = best_of(lambda: expand_24_to_32_join(pcm24_3s), 3) * 1e6
+    dsp_time = best_of(lambda: dsp.expand_24_to_32(pcm24_3s), 20) * 1e6
+    print(f"{'24->32 bit 3 s (join)':<28}{join_time:>14.1f}{dsp_time:>12.1f}{join_time / dsp_time:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Leak check for session teardown: thread count and RSS of the server must stay flat over many join/leave cycles.
+
+Starts ``stub_llm_server.py`` and ``harness_server.py`` like ``load_harness.py``, then runs ``--cycles`` join-session /
+start-assistant / leave-session cycles, half of them ending with a plain disconnect instead of leave-session.
+Thread count and RSS are sampled once the warm-up cycles are done and again after the last cycle, once the
+background teardowns have settled. Exits with status 1 if either grew by more than its allowance.
+
+Run from the repository root: ``python benchmarks/bench_session_leaks.py --cycles 1000``
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+import socketio
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_harness import RESPONSE_TIMEOUT, ResourceSampler, free_port, start_process, wait_for_port  # noqa: E402
+
+# seconds to wait for closing sessions to release their threads before the final sample
+SETTLE_TIMEOUT = 30
+
+
+def cycle(url, hold, disconnect):
+    client = socketio.Client(reconnection=False)
+    responses = {}
+    for event in ('join-session', 'leave-session'):
+        client.on(f'{event}-response', lambda message, event=event: responses.setdefault(event, message))
+
+    user_id = str(uuid.uuid4())
+    client.connect(url)
+    try:
+        client.emit('join-session', user_id)
+        wait_for(lambda: 'join-session' in responses, 'join-session-response')
+        client.emit('start-assistant', user_id)
+        time.sleep(hold)
+        if not disconnect:
+            client.emit('leave-session', user_id)
+            wait_for(lambda: 'leave-session' in responses, 'leave-session-response')
+    finally:
+        client.disconnect()
+
+
+def wait_for(condition, what):
+    deadline = time.monotonic() + RESPONSE_TIMEOUT
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'No {what} within {RESPONSE_TIMEOUT}s')
+        time.sleep(0.005)
+
+
+def settle(sampler, floor=0):
+    # teardown runs in the background, wait until the thread count stops falling or gets down to ``floor``
+    deadline = time.monotonic() + SETTLE_TIMEOUT
+    threads = sampler.thread_count()
+    unchanged = 0
+    while threads > floor and unchanged < 4 and time.monotonic() < deadline:
+        time.sleep(0.5)
+        previous, threads = threads, sampler.thread_count()
+        unchanged = unchanged + 1 if threads >= previous else 0
+    return threads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cycles", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=50, help="cycles run before the first sample")
+    parser.add_argument("--hold", type=float, default=0.0, help="seconds each session keeps the assistant on")
+    parser.add_argument("--max-thread-growth", type=int, default=2)
+    parser.add_argument("--max-rss-growth-mb", type=float, default=32.0)
+    args = parser.parse_args()
+
+    llm_port, server_port = free_port(), free_port()
+    processes = []
+    failed = False
+    try:
+        processes.append(start_process("stub_llm_server.py", "--port", llm_port))
+        wait_for_port(llm_port, processes[-1])
+        processes.append(start_process("harness_server.py", "--port", server_port,
+                                       "--llm-api-base", f'http://127.0.0.1:{llm_port}/v1'))
+        wait_for_port(server_port, processes[-1])
+        url = f'http://127.0.0.1:{server_port}'
+        sampler = ResourceSampler(processes[-1].pid)
+
+        for i in range(args.warmup):
+            cycle(url, args.hold, disconnect=i % 2 == 1)
+        start_threads = settle(sampler)
+        start_rss = sampler.rss_bytes()
+        print(f"[INFO] After {args.warmup} warm-up cycles: {start_threads} threads, {start_rss / 2 ** 20:.1f} MB")
+
+        started = time.monotonic()
+        for i in range(args.cycles):
+            cycle(url, args.hold, disconnect=i % 2 == 1)
+            if (i + 1) % 100 == 0:
+                print(f"[INFO] {i + 1} cycles, {sampler.thread_count()} threads, "
+                      f"{sampler.rss_bytes() / 2 ** 20:.1f} MB")
+        elapsed = time.monotonic() - started
+
+        end_threads = settle(sampler, start_threads)
+        end_rss = sampler.rss_bytes()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    thread_growth = end_threads - start_threads
+    rss_growth = (end_rss - start_rss) / 2 ** 20
+    print(f"{'cycles per second':<30} {args.cycles / elapsed:>10.2f}")
+    print(f"{'thread growth':<30} {thread_growth:>10d}")
+    print(f"{'RSS growth (MB)':<30} {rss_growth:>10.2f}")
+    if thread_growth > args.max_thread_growth:
+        print(f"[ERROR] Thread count grew by {thread_growth} over {args.cycles} cycles")
+        failed = True
+    if rss_growth > args.max_rss_growth_mb:
+        print(f"[ERROR] RSS grew by {rss_growth:.1f} MB over {args.cycles} cycles")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("[INFO] No leaks detected")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Runs the Socket.IO service from app.py with fake audio and a stub Whisper model, for ``load_harness.py``.
+
+Every session "records" a WAV file from ``--corpus`` (or generated speech-like audio), paced to real time and looped, through the regular recorder, VAD and transcription lanes. Whisper is replaced by a stub that sleeps for a configurable time per batch, and the LLM client is pointed at ``--llm-api-base`` (see ``stub_llm_server.py``).
+
+Run from the repository root: ``python benchmarks/harness_server.py --port 5000 --llm-api-base http://127.0.0.1:1234/v1``
+"""
+import argparse
+import glob
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import custom_speech_recognition as sr  # noqa: E402
+import AudioIngest  # noqa: E402
+import AudioRecorder  # noqa: E402
+import InferenceScheduler  # noqa: E402
+import LLMClient  # noqa: E402
+import TranscriberModels  # noqa: E402
+import assistant  # noqa: E402
+import app as service  # noqa: E402
+
+WORDS = ("so", "the", "next", "slide", "shows", "our", "numbers", "for", "this", "quarter", "and", "they",
+         "look", "good", "can", "you", "hear", "me", "now", "okay")
+
+
+class StubWhisperModel:
+    """Stands in for ``TranscriberModels.ModelPool`` in the inference scheduler. Each batch takes ``latency_ms`` plus ``per_item_ms`` per request, and audio is "transcribed" into one word per ``seconds_per_word``."""
+
+    def __init__(self, latency_ms=200.0, per_item_ms=20.0, max_concurrency=1, seconds_per_word=0.4):
+        self.latency = latency_ms / 1000
+        self.per_item = per_item_ms / 1000
+        self.max_concurrency = max_concurrency
+        self.seconds_per_word = seconds_per_word
+
+    def words_for(self, duration):
+        return [(' ' + WORDS[i % len(WORDS)], i * self.seconds_per_word, (i + 0.8) * self.seconds_per_word)
+                for i in range(int(duration / self.seconds_per_word))]
+
+    def transcribe_batch(self, requests):
+        time.sleep(self.latency + self.per_item * len(requests))
+        results = []
+        for request in requests:
+            words = self.words_for(len(request.audio) / TranscriberModels.WHISPER_SAMPLE_RATE)
+            text = ''.join(word for word, _, _ in words).strip()
+            if not request.word_timestamps:
+                results.append(text)
+            elif words:
+                results.append([TranscriberModels.Segment(text, words[0][1], words[-1][2], 0.01, -0.3, words)])
+            else:
+                results.append([])
+        return results
+
+
+class CorpusSource(sr.AudioSource):
+    """An audio source that plays 16-bit mono PCM in a loop, delivering it no faster than real time like a microphone would."""
+
+    def __init__(self, pcm, sample_rate, chunk_ms=AudioRecorder.CHUNK_DURATION_MS, offset=0):
+        self.pcm = pcm
+        self.SAMPLE_RATE = sample_rate
+        self.SAMPLE_WIDTH = 2
+        self.CHUNK = sample_rate * chunk_ms // 1000
+        self.channels = 1
+        self.offset = offset - offset % 2
+        self.stream = None
+
+    def __enter__(self):
+        self.stream = CorpusSource.PacedStream(self.pcm, self.SAMPLE_RATE, self.offset)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stream = None
+
+    class PacedStream(object):
+        def __init__(self, pcm, sample_rate, offset):
+            self.pcm = pcm
+            self.bytes_per_second = 2 * sample_rate
+            self.position = offset
+            self.started = time.monotonic()
+            self.delivered = 0
+
+        def read(self, size):
+            size *= 2
+            chunk = bytearray()
+            while len(chunk) < size:
+                piece = self.pcm[self.position:self.position + size - len(chunk)]
+                chunk += piece
+                self.position = (self.position + len(piece)) % len(self.pcm)
+
+            self.delivered += len(chunk)
+            wait = self.started + self.delivered / self.bytes_per_second - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            return bytes(chunk)
+
+
+class CorpusRecorder(AudioRecorder.BaseRecorder):
+    corpus = []
+    _next_file = itertools.count()
+
+    def __init__(self):
+        pcm, sample_rate = self.corpus[next(self._next_file) % len(self.corpus)]
+        # sessions start at different points of the file so they don't all speak in lockstep
+        offset = np.random.randint(0, len(pcm))
+        super().__init__(source=CorpusSource(pcm, sample_rate, offset=offset), source_name="Speaker")
+
+
+def synthesize_speech(seconds=60, sample_rate=16000, seed=0):
+    """Returns 16-bit PCM with bursts of harmonic, amplitude-modulated tones separated by pauses, which the VADs take for speech."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    signal = rng.normal(0, 50, len(t))
+    start = 0.5
+    while start < seconds:
+        length = rng.uniform(0.8, 4.0)
+        burst = (t >= start) & (t < start + length)
+        pitch = rng.uniform(110, 240)
+        envelope = 1 + 0.6 * np.sin(2 * np.pi * 4 * t[burst])
+        for harmonic, amplitude in ((1, 6000), (2, 3000), (3, 1500), (5, 700)):
+            signal[burst] += amplitude * envelope * np.sin(2 * np.pi * pitch * harmonic * t[burst])
+        start += length + rng.uniform(0.4, 2.0)
+    return np.clip(signal, -32768, 32767).astype(np.int16).tobytes()
+
+
+def load_corpus(directory):
+    if directory is None:
+        return [(synthesize_speech(seed=seed), 16000) for seed in range(4)]
+    paths = sorted(glob.glob(os.path.join(directory, '*.wav')))
+    assert paths, f'No .wav files in {directory}'
+    return [AudioIngest.read_audio_file(path) for path in paths]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--llm-api-base", default=LLMClient.API_BASE)
+    parser.add_argument("--corpus", help="directory of WAV files, speech-like audio is generated if omitted")
+    parser.add_argument("--whisper-latency-ms", type=float, default=200.0, help="stub Whisper time per batch")
+    parser.add_argument("--whisper-per-item-ms", type=float, default=20.0, help="extra stub Whisper time per request")
+    parser.add_argument("--whisper-concurrency", type=int, default=1)
+    args = parser.parse_args()
+
+    CorpusRecorder.corpus = load_corpus(args.corpus)
+    AudioRecorder.RECORDERS = {"Speaker": CorpusRecorder}
+    assistant.AUDIO_SOURCES = ("Speaker",)
+    InferenceScheduler._scheduler = InferenceScheduler.InferenceScheduler(StubWhisperModel(
+        args.whisper_latency_ms, args.whisper_per_item_ms, args.whisper_concurrency))
+    LLMClient.get_client().api_base = args.llm_api_base
+
+    service.start_worker()
+    print(f"[INFO] Harness server listening on http://{args.host}:{args.port}", flush=True)
+    service.socketio.run(service.app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""Load and latency benchmark for the Socket.IO service, with a regression check against a stored baseline.
+
+Starts ``stub_llm_server.py`` and ``harness_server.py`` (app.py with fake audio sources and a stub Whisper model) as subprocesses, then drives ``--sessions`` concurrent Socket.IO clients through join-session, start-assistant, session-metrics, stop-assistant and leave-session. Reports throughput, per-event latency percentiles, the server's own pipeline latency, and server CPU and RSS per session.
+
+With ``--baseline``, every metric is compared against the stored run and the process exits with status 1 if any got worse by more than ``--tolerance``. ``--update-baseline`` stores the current run instead.
+
+Run from the repository root: ``python benchmarks/load_harness.py --sessions 20 --duration 30 --baseline benchmarks/baseline.json``
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import numpy as np
+import socketio
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+RESPONSE_TIMEOUT = 30
+# metrics where a larger value is better, every other metric is better when smaller
+HIGHER_IS_BETTER = ("throughput",)
+
+
+def wait_for_port(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{process.args[1]} exited with status {process.returncode}')
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'Nothing listening on port {port} after {timeout}s')
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_process(script, *args):
+    return subprocess.Popen([sys.executable, os.path.join(BENCHMARKS_DIR, script), *map(str, args)],
+                            cwd=os.path.dirname(BENCHMARKS_DIR))
+
+
+class ResourceSampler:
+    """Samples a process's CPU time and resident memory from ``/proc`` (or psutil where there is no ``/proc``)."""
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.running = False
+        self.thread = None
+        try:
+            import psutil
+            self.process = psutil.Process(pid)
+        except ImportError:
+            self.process = None
+
+    def cpu_seconds(self):
+        if self.process is not None:
+            times = self.process.cpu_times()
+            return times.user + times.system
+        with open(f'/proc/{self.pid}/stat') as stat:
+            fields = stat.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+    def rss_bytes(self):
+        if self.process is not None:
+            return self.process.memory_info().rss
+        with open(f'/proc/{self.pid}/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+    def thread_count(self):
+        if self.process is not None:
+            return self.process.num_threads()
+        with open(f'/proc/{self.pid}/status') as status:
+            for line in status:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+        return 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            self.peak_rss = max(self.peak_rss, self.rss_bytes())
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+
+class SessionClient:
+    """One simulated user, timing every request/response pair and counting the streamed events."""
+
+    def __init__(self, url, duration):
+        self.url = url
+        self.duration = duration
+        self.user_id = str(uuid.uuid4())
+        self.client = socketio.Client(reconnection=False)
+        self.responses = {}
+        self.latencies = {}
+        self.counts = {"transcription": 0, "suggestion": 0}
+        self.bytes = 0
+        self.first = {}
+        self.pipeline_latency = {}
+        self.error = None
+
+        for event in ('join-session', 'start-assistant', 'stop-assistant', 'leave-session', 'session-metrics'):
+            self.responses[event] = (threading.Event(), [])
+            self.client.on(f'{event}-response', self.response_handler(event))
+        self.client.on('start-assistant-transcription-response', self.stream_handler("transcription"))
+        self.client.on('start-assistant-suggestion-response', self.stream_handler("suggestion"))
+
+    def response_handler(self, event):
+        def handler(message):
+            received, messages = self.responses[event]
+            messages.append(message)
+            received.set()
+        return handler
+
+    def stream_handler(self, kind):
+        def handler(message):
+            self.counts[kind] += 1
+            self.bytes += len(message) if isinstance(message, (str, bytes)) else len(json.dumps(message))
+            self.first.setdefault(kind, time.monotonic())
+        return handler
+
+    def request(self, event, wait=True):
+        received, messages = self.responses[event]
+        received.clear()
+        start = time.monotonic()
+        self.client.emit(event, self.user_id)
+        if not wait:
+            return None
+        if not received.wait(RESPONSE_TIMEOUT):
+            raise TimeoutError(f'No {event}-response within {RESPONSE_TIMEOUT}s')
+        self.latencies[event] = time.monotonic() - start
+        return messages[-1]
+
+    def run(self):
+        try:
+            self.client.connect(self.url)
+            self.request('join-session')
+            # start-assistant only answers on failure, the streams starting is the response
+            started = time.monotonic()
+            self.request('start-assistant', wait=False)
+            time.sleep(self.duration)
+            for kind, first in self.first.items():
+                self.latencies[f'first-{kind}'] = first - started
+
+            metrics = self.request('session-metrics')
+            if isinstance(metrics, dict):
+                self.pipeline_latency = metrics.get("latency", {})
+            self.request('stop-assistant')
+            self.request('leave-session')
+        except Exception as e:
+            self.error = e
+        finally:
+            self.client.disconnect()
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    p50, p95, p99 = np.percentile(values, (50, 95, 99))
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def run_load(url, sessions, duration, ramp, sampler):
+    clients = [SessionClient(url, duration) for _ in range(sessions)]
+    threads = [threading.Thread(target=client.run) for client in clients]
+
+    cpu_start = sampler.cpu_seconds()
+    rss_start = sampler.rss_bytes()
+    sampler.peak_rss = rss_start
+    sampler.start()
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+        time.sleep(ramp / max(sessions, 1))
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    sampler.stop()
+
+    completed = [client for client in clients if client.error is None]
+    for client in clients:
+        if client.error is not None:
+            print(f"[ERROR] Session {client.user_id} failed: {client.error!r}")
+
+    metrics = {
+        "sessions_completed": len(completed),
+        "throughput.sessions_per_second": len(completed) / elapsed,
+        "throughput.transcription_events_per_second": sum(c.counts["transcription"] for c in clients) / elapsed,
+        "throughput.suggestion_events_per_second": sum(c.counts["suggestion"] for c in clients) / elapsed,
+        "throughput.bytes_per_second": sum(c.bytes for c in clients) / elapsed,
+        "cpu_seconds_per_session": (sampler.cpu_seconds() - cpu_start) / sessions,
+        "rss_mb_per_session": (sampler.peak_rss - rss_start) / sessions / 2 ** 20,
+    }
+
+    events = sorted({event for client in completed for event in client.latencies})
+    for event in events:
+        for name, value in percentiles([c.latencies[event] for c in completed if event in c.latencies]).items():
+            metrics[f'latency.{event}.{name}'] = value
+
+    # the server's own stage percentiles, averaged over sessions
+    stages = sorted({stage for client in completed for stage in client.pipeline_latency})
+    for stage in stages:
+        for name in ("p50", "p95", "p99"):
+            values = [c.pipeline_latency[stage][name] for c in completed
+                      if stage in c.pipeline_latency and not np.isnan(c.pipeline_latency[stage][name])]
+            if values:
+                metrics[f'pipeline.{stage}.{name}'] = float(np.mean(values))
+    return metrics
+
+
+def compare(metrics, baseline, tolerance):
+    """Returns a description of every metric that is worse than ``baseline`` by more than ``tolerance``."""
+    regressions = []
+    for name, expected in baseline.items():
+        if name not in metrics or not isinstance(expected, (int, float)) or expected == 0:
+            continue
+        actual = metrics[name]
+        if name.startswith(HIGHER_IS_BETTER) or name == "sessions_completed":
+            worse = actual < expected * (1 - tolerance)
+        else:
+            worse = actual > expected * (1 + tolerance)
+        if worse:
+            regressions.append(f'{name}: {actual:.4g} against a baseline of {expected:.4g}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds each session keeps the assistant on")
+    parser.add_argument("--ramp", type=float, default=2.0, help="seconds over which sessions are started")
+    parser.add_argument("--corpus", help="directory of WAV files, speech-like audio is generated if omitted")
+    parser.add_argument("--whisper-latency-ms", type=float, default=200.0)
+    parser.add_argument("--whisper-per-item-ms", type=float, default=20.0)
+    parser.add_argument("--tokens", type=int, default=40, help="tokens per stub LLM response")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="stub LLM tokens per second")
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--baseline", help="JSON file of metrics to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--update-baseline", action="store_true", help="write this run's metrics to --baseline")
+    parser.add_argument("--output", help="also write this run's metrics to this JSON file")
+    args = parser.parse_args()
+
+    llm_port, server_port = free_port(), free_port()
+    processes = []
+    try:
+        processes.append(start_process("stub_llm_server.py", "--port", llm_port, "--tokens", args.tokens,
+                                       "--rate", args.token_rate, "--first-token-delay", args.first_token_delay))
+        wait_for_port(llm_port, processes[-1])
+
+        server_args = ["--port", server_port, "--llm-api-base", f'http://127.0.0.1:{llm_port}/v1',
+                       "--whisper-latency-ms", args.whisper_latency_ms,
+                       "--whisper-per-item-ms", args.whisper_per_item_ms]
+        if args.corpus:
+            server_args += ["--corpus", args.corpus]
+        processes.append(start_process("harness_server.py", *server_args))
+        wait_for_port(server_port, processes[-1])
+
+        metrics = run_load(f'http://127.0.0.1:{server_port}', args.sessions, args.duration, args.ramp,
+                           ResourceSampler(processes[-1].pid))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    metrics["config"] = {key: value for key, value in vars(args).items()
+                         if key not in ("baseline", "update_baseline", "output", "tolerance")}
+    for name, value in metrics.items():
+        if name != "config":
+            print(f"{name:<55} {value:>12.4f}")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(metrics, output, indent=2, sort_keys=True)
+
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(metrics, baseline_file, indent=2, sort_keys=True)
+        print(f"[INFO] Baseline written to {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("config") != metrics["config"]:
+            print("[INFO] Baseline was recorded with different settings, comparison may not be meaningful")
+        regressions = compare(metrics, {k: v for k, v in baseline.items() if k != "config"}, args.tolerance)
+        if regressions:
+            print("[ERROR] Regressions against the baseline:")
+            for regression in regressions:
+                print("  " + regression)
+            sys.exit(1)
+        print("[INFO] No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Local stand-in for an OpenAI-compatible ``/v1/chat/completions`` endpoint that streams SSE.
+
+Every request is answered with ``--tokens`` tokens at ``--rate`` tokens per second, after ``--first-token-delay`` seconds, using chunked keep-alive responses so client connection pooling behaves as it would against a real server. The tests under ``tests/`` also use it to fail requests, send usage chunks without choices and drop connections mid-stream.
+
+Run from the repository root: ``python benchmarks/stub_llm_server.py --port 1234``
+"""
+import argparse
+import asyncio
+import json
+import time
+
+RESPONSE_HEADERS = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: text/event-stream\r\n"
+    b"Cache-Control: no-cache\r\n"
+    b"Transfer-Encoding: chunked\r\n"
+    b"Connection: keep-alive\r\n\r\n"
+)
+
+
+class StubLLMServer:
+    """``fail_requests`` first requests are answered with ``fail_status``; ``usage_chunk`` adds a final chunk with an empty ``choices`` list, as OpenAI sends with ``include_usage``; ``drop_after`` closes the connection after that many tokens; ``events_after_done`` tokens are sent after ``[DONE]``, which clients must ignore."""
+
+    def __init__(self, tokens=40, rate=50.0, first_token_delay=0.1, token_text=" token", fail_requests=0,
+                 fail_status=503, usage_chunk=False, drop_after=None, events_after_done=0):
+        self.tokens = tokens
+        self.rate = rate
+        self.first_token_delay = first_token_delay
+        self.token_text = token_text
+        self.fail_requests = fail_requests
+        self.fail_status = fail_status
+        self.usage_chunk = usage_chunk
+        self.drop_after = drop_after
+        self.events_after_done = events_after_done
+        self.requests = 0
+        self.connections = 0
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def handle_connection(self, reader, writer):
+        self.connections += 1
+        try:
+            while await self.handle_request(reader, writer):
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, reader, writer):
+        request_line = await reader.readline()
+        if not request_line:
+            return False
+
+        content_length = 0
+        while True:
+            header = await reader.readline()
+            if header in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = header.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                content_length = int(value.strip())
+        body = await reader.readexactly(content_length) if content_length else b"{}"
+        model = json.loads(body or b"{}").get("model", "stub")
+        self.requests += 1
+
+        if self.requests <= self.fail_requests:
+            writer.write(b"HTTP/1.1 %d Unavailable\r\nContent-Length: 0\r\nConnection: keep-alive\r\n\r\n"
+                         % self.fail_status)
+            await writer.drain()
+            return True
+
+        writer.write(RESPONSE_HEADERS)
+        await asyncio.sleep(self.first_token_delay)
+        for index in range(self.tokens):
+            if index:
+                await asyncio.sleep(1.0 / self.rate)
+            if index == self.drop_after:
+                await writer.drain()
+                return False
+            self.write_token(writer, model)
+            await writer.drain()
+
+        self.write_event(writer, model, [{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if self.usage_chunk:
+            self.write_event(writer, model, [], usage={"prompt_tokens": 1, "completion_tokens": self.tokens})
+        self.write_chunk(writer, b"data: [DONE]\n\n")
+        for _ in range(self.events_after_done):
+            self.write_token(writer, model)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return True
+
+    def write_token(self, writer, model):
+        self.write_event(writer, model, [{"index": 0, "delta": {"content": self.token_text}, "finish_reason": None}])
+
+    def write_event(self, writer, model, choices, **fields):
+        event = {
+            "id": f"chatcmpl-stub-{self.requests}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": choices,
+            **fields,
+        }
+        self.write_chunk(writer, b"data: " + json.dumps(event).encode() + b"\n\n")
+
+    @staticmethod
+    def write_chunk(writer, data):
+        writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+
+async def serve(args):
+    stub = StubLLMServer(args.tokens, args.rate, args.first_token_delay)
+    port = await stub.start(args.host, args.port)
+    print(f"[INFO] Stub LLM server streaming on http://{args.host}:{port}/v1")
+    async with stub.server:
+        await stub.server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1234)
+    parser.add_argument("--tokens", type=int, default=40, help="tokens streamed per response")
+    parser.add_argument("--rate", type=float, default=50.0, help="tokens per second")
+    parser.add_argument("--first-token-delay", type=float, default=0.1, help="seconds before the first token")
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
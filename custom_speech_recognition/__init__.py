@@ -6,7 +6,6 @@ import os
 import sys
 import wave
 import math
-import audioop
 import collections
 import threading
 import time
@@ -16,12 +15,21 @@ __version__ = "3.10.0"
 __license__ = "BSD"
 
 
+from . import dsp
 from .audio import AudioData
 
 from .exceptions import (
     WaitTimeoutError,
 )
 
+from .vad import (
+    VoiceActivityDetector,
+    EnergyVAD,
+    SpectralVAD,
+    WebRTCVAD,
+    create_vad,
+)
+
 
 class AudioSource(object):
     def __init__(self):
@@ -49,9 +57,14 @@ class Microphone(AudioSource):
     Higher ``sample_rate`` values result in better audio quality, but also more bandwidth (and therefore, slower recognition). Additionally, some CPUs, such as those in older Raspberry Pi models, can't keep up if this value is too high.
 
     Higher ``chunk_size`` values help avoid triggering on rapidly changing ambient noise, but also makes detection less sensitive. This value, generally, should be left at its default.
+
+    ``sample_format`` is the PyAudio sample format to record in (``pyaudio.paInt16`` if unspecified); only 16, 24 and 32-bit integer PCM formats are supported.
+
+    If ``callback_mode`` is truthy, PyAudio delivers audio from its own thread into a ring buffer holding ``buffer_seconds`` seconds of audio, and reads are served from that buffer instead of blocking on PortAudio.
     """
 
-    def __init__(self, device_index=None, sample_rate=None, chunk_size=1024, speaker=False, channels=1):
+    def __init__(self, device_index=None, sample_rate=None, chunk_size=1024, speaker=False, channels=1,
+                 sample_format=None, callback_mode=False, buffer_seconds=2):
         assert device_index is None or isinstance(
             device_index, int), "Device index must be None or an integer"
         assert sample_rate is None or (isinstance(
@@ -78,12 +91,16 @@ class Microphone(AudioSource):
             audio.terminate()
 
         self.device_index = device_index
-        self.format = self.pyaudio_module.paInt16  # 16-bit int sampling
+        self.format = self.pyaudio_module.paInt16 if sample_format is None else sample_format  # 16-bit int sampling by default
+        assert self.format in (self.pyaudio_module.paInt16, self.pyaudio_module.paInt24,
+                               self.pyaudio_module.paInt32), "Sample format must be a 16, 24 or 32-bit integer PCM format"
         self.SAMPLE_WIDTH = self.pyaudio_module.get_sample_size(
             self.format)  # size of each sample
         self.SAMPLE_RATE = sample_rate  # sampling rate in Hertz
         self.CHUNK = chunk_size  # number of frames stored in each buffer
         self.channels = channels
+        self.callback_mode = callback_mode
+        self.buffer_seconds = buffer_seconds
 
         self.audio = None
         self.stream = None
@@ -152,9 +169,9 @@ class Microphone(AudioSource):
                     continue
 
                 # compute RMS of debiased audio
-                energy = -audioop.rms(buffer, 2)
+                energy = -dsp.rms(buffer, 2)
                 energy_bytes = bytes([energy & 0xFF, (energy >> 8) & 0xFF])
-                debiased_energy = audioop.rms(audioop.add(
+                debiased_energy = dsp.rms(dsp.add(
                     buffer, energy_bytes * (len(buffer) // 2), 2), 2)
 
                 if debiased_energy > 30:  # probably actually audio
@@ -168,7 +185,21 @@ class Microphone(AudioSource):
         self.audio = self.pyaudio_module.PyAudio()
 
         try:
-            if self.speaker:
+            if self.callback_mode:
+                stream = Microphone.CallbackStream(
+                    self.SAMPLE_WIDTH * self.channels, int(self.SAMPLE_RATE * self.buffer_seconds),
+                    self.pyaudio_module.paContinue)
+                stream.pyaudio_stream = self.audio.open(
+                    input_device_index=self.device_index,
+                    channels=self.channels,
+                    format=self.format,
+                    rate=self.SAMPLE_RATE,
+                    frames_per_buffer=self.CHUNK,
+                    input=True,
+                    stream_callback=stream.callback
+                )
+                self.stream = stream
+            elif self.speaker:
                 p = self.audio
                 self.stream = Microphone.MicrophoneStream(
                     p.open(
@@ -213,6 +244,63 @@ class Microphone(AudioSource):
             finally:
                 self.pyaudio_stream.close()
 
+    class CallbackStream(object):
+        """
+        Single-producer, single-consumer ring buffer fed by the PyAudio callback thread. The producer only advances ``write_position`` and the consumer only advances ``read_position``, so neither side takes a lock. If the reader falls more than the buffer size behind, new audio is dropped and counted in ``dropped_frames``.
+        """
+
+        def __init__(self, frame_size, buffer_frames, continue_flag):
+            self.frame_size = frame_size  # bytes per frame, across all channels
+            self.capacity = frame_size * buffer_frames
+            self.buffer = bytearray(self.capacity)
+            self.write_position = 0  # total bytes written
+            self.read_position = 0  # total bytes read
+            self.dropped_frames = 0
+            self.continue_flag = continue_flag
+            self.data_available = threading.Event()
+            self.closed = False
+            self.pyaudio_stream = None
+
+        def callback(self, in_data, frame_count, time_info, status):
+            size = len(in_data)
+            if self.write_position + size - self.read_position > self.capacity:
+                self.dropped_frames += frame_count
+            else:
+                start = self.write_position % self.capacity
+                first = min(size, self.capacity - start)
+                self.buffer[start:start + first] = in_data[:first]
+                self.buffer[:size - first] = in_data[first:]
+                self.write_position += size
+            self.data_available.set()
+            return None, self.continue_flag
+
+        def read(self, size):
+            size = size * self.frame_size
+            while True:
+                # clear before checking so that a write between the check and the wait can't be missed
+                self.data_available.clear()
+                if self.write_position - self.read_position >= size:
+                    break
+                if self.closed:
+                    return b""
+                self.data_available.wait(0.5)
+
+            start = self.read_position % self.capacity
+            first = min(size, self.capacity - start)
+            data = bytes(self.buffer[start:start + first]) + bytes(self.buffer[:size - first])
+            self.read_position += size
+            return data
+
+        def close(self):
+            self.closed = True
+            self.data_available.set()
+            try:
+                # sometimes, if the stream isn't stopped, closing the stream throws an exception
+                if not self.pyaudio_stream.is_stopped():
+                    self.pyaudio_stream.stop_stream()
+            finally:
+                self.pyaudio_stream.close()
+
 
 class AudioFile(AudioSource):
     """
@@ -247,29 +335,17 @@ class AudioFile(AudioSource):
         # try:
         # attempt to read the file as WAV
         self.audio_reader = wave.open(self.filename_or_fileobject, "rb")
-        # RIFF WAV is a little-endian format (most ``audioop`` operations assume that the frames are stored in little-endian form)
+        # RIFF WAV is a little-endian format (the ``dsp`` operations assume that the frames are stored in little-endian form)
         self.little_endian = True
         assert 1 <= self.audio_reader.getnchannels() <= 2, "Audio must be mono or stereo"
         self.SAMPLE_WIDTH = self.audio_reader.getsampwidth()
 
-        # 24-bit audio needs some special handling for old Python versions (workaround for https://bugs.python.org/issue12866)
-        samples_24_bit_pretending_to_be_32_bit = False
-        if self.SAMPLE_WIDTH == 3:  # 24-bit audio
-            try:
-                # test whether this sample width is supported (for example, ``audioop`` in Python 3.3 and below don't support sample width 3, while Python 3.4+ do)
-                audioop.bias(b"", self.SAMPLE_WIDTH, 0)
-            # this version of audioop doesn't support 24-bit audio (probably Python 3.3 or less)
-            except audioop.error:
-                # while the ``AudioFile`` instance will outwardly appear to be 32-bit, it will actually internally be 24-bit
-                samples_24_bit_pretending_to_be_32_bit = True
-                self.SAMPLE_WIDTH = 4  # the ``AudioFile`` instance should present itself as a 32-bit stream now, since we'll be converting into 32-bit on the fly when reading
-
         self.SAMPLE_RATE = self.audio_reader.getframerate()
         self.CHUNK = 4096
         self.FRAME_COUNT = self.audio_reader.getnframes()
         self.DURATION = self.FRAME_COUNT / float(self.SAMPLE_RATE)
         self.stream = AudioFile.AudioFileStream(
-            self.audio_reader, self.little_endian, samples_24_bit_pretending_to_be_32_bit)
+            self.audio_reader, self.little_endian)
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
@@ -280,13 +356,11 @@ class AudioFile(AudioSource):
         self.DURATION = None
 
     class AudioFileStream(object):
-        def __init__(self, audio_reader, little_endian, samples_24_bit_pretending_to_be_32_bit):
+        def __init__(self, audio_reader, little_endian):
             # an audio file object (e.g., a `wave.Wave_read` instance)
             self.audio_reader = audio_reader
             # whether the audio data is little-endian (when working with big-endian things, we'll have to convert it to little-endian before we process it)
             self.little_endian = little_endian
-            # this is true if the audio is 24-bit audio, but 24-bit audio isn't supported, so we have to pretend that this is 32-bit audio and convert it on the fly
-            self.samples_24_bit_pretending_to_be_32_bit = samples_24_bit_pretending_to_be_32_bit
 
         def read(self, size=-1):
             buffer = self.audio_reader.readframes(
@@ -296,22 +370,11 @@ class AudioFile(AudioSource):
 
             sample_width = self.audio_reader.getsampwidth()
             if not self.little_endian:  # big endian format, convert to little endian on the fly
-                if hasattr(audioop, "byteswap"):  # ``audioop.byteswap`` was only added in Python 3.4 (incidentally, that also means that we don't need to worry about 24-bit audio being unsupported, since Python 3.4+ always has that functionality)
-                    buffer = audioop.byteswap(buffer, sample_width)
-                else:  # manually reverse the bytes of each sample, which is slower but works well enough as a fallback
-                    buffer = buffer[sample_width - 1::-1] + b"".join(
-                        buffer[i + sample_width:i:-1] for i in range(sample_width - 1, len(buffer), sample_width))
-
-            # workaround for https://bugs.python.org/issue12866
-            # we need to convert samples from 24-bit to 32-bit before we can process them with ``audioop`` functions
-            if self.samples_24_bit_pretending_to_be_32_bit:
-                # since we're in little endian, we prepend a zero byte to each 24-bit sample to get a 32-bit sample
-                buffer = b"".join(
-                    b"\x00" + buffer[i:i + sample_width] for i in range(0, len(buffer), sample_width))
-                sample_width = 4  # make sure we thread the buffer as 32-bit audio now, after converting it from 24-bit audio
+                buffer = dsp.byteswap(buffer, sample_width)
+
             if self.audio_reader.getnchannels() != 1:  # stereo audio
                 # convert stereo audio data to mono
-                buffer = audioop.tomono(buffer, sample_width, 1, 1)
+                buffer = dsp.tomono(buffer, sample_width, 1, 1)
             return buffer
 
 
@@ -333,6 +396,32 @@ class Recognizer(AudioSource):
         self.phrase_threshold = 0.3
         # seconds of non-speaking audio to keep on both sides of the recording
         self.non_speaking_duration = 0.5
+        # ``VoiceActivityDetector`` deciding where phrases start and end, or ``None`` to compare energy against ``energy_threshold``
+        self.vad = None
+
+    def is_speech(self, buffer, source, adjust_threshold=False):
+        """
+        Returns whether ``buffer``, read from ``source``, contains speech according to ``recognizer_instance.vad``, or according to ``recognizer_instance.energy_threshold`` if no detector is set.
+
+        If ``adjust_threshold`` is truthy and ``recognizer_instance.dynamic_energy_threshold`` is set, non-speech buffers move the energy threshold towards the ambient energy.
+        """
+        if self.vad is not None:
+            return self.vad.is_speech(buffer, source.SAMPLE_RATE, source.SAMPLE_WIDTH, getattr(source, "channels", 1))
+
+        # energy of the audio signal
+        energy = dsp.rms(buffer, source.SAMPLE_WIDTH)
+        if energy > self.energy_threshold:
+            return True
+
+        # dynamically adjust the energy threshold using asymmetric weighted average
+        if adjust_threshold and self.dynamic_energy_threshold:
+            # account for different chunk sizes and rates
+            seconds_per_buffer = float(source.CHUNK) / source.SAMPLE_RATE
+            damping = self.dynamic_energy_adjustment_damping ** seconds_per_buffer
+            target_energy = energy * self.dynamic_energy_ratio
+            self.energy_threshold = self.energy_threshold * \
+                damping + target_energy * (1 - damping)
+        return False
 
     def adjust_for_ambient_noise(self, source, duration=1):
         """
@@ -341,6 +430,8 @@ class Recognizer(AudioSource):
         Intended to calibrate the energy threshold with the ambient energy level. Should be used on periods of audio without speech - will stop early if any speech is detected.
 
         The ``duration`` parameter is the maximum number of seconds that it will dynamically adjust the threshold for before returning. This value should be at least 0.5 in order to get a representative sample of the ambient noise.
+
+        If ``recognizer_instance.vad`` is set, the audio calibrates that detector's noise estimate instead.
         """
         assert isinstance(
             source, AudioSource), "Source must be an audio source"
@@ -356,8 +447,11 @@ class Recognizer(AudioSource):
             if elapsed_time > duration:
                 break
             buffer = source.stream.read(source.CHUNK)
+            if self.vad is not None:
+                self.vad.adapt(buffer, source.SAMPLE_RATE, source.SAMPLE_WIDTH, getattr(source, "channels", 1))
+                continue
             # energy of the audio signal
-            energy = audioop.rms(buffer, source.SAMPLE_WIDTH)
+            energy = dsp.rms(buffer, source.SAMPLE_WIDTH)
 
             # dynamically adjust the energy threshold using asymmetric weighted average
             # account for different chunk sizes and rates
@@ -384,7 +478,6 @@ class Recognizer(AudioSource):
 
         elapsed_time = 0
         seconds_per_buffer = float(source.CHUNK) / source.SAMPLE_RATE
-        resampling_state = None
 
         # buffers capable of holding 5 seconds of original audio
         five_seconds_buffer_count = int(math.ceil(5 / seconds_per_buffer))
@@ -407,8 +500,8 @@ class Recognizer(AudioSource):
             frames.append(buffer)
 
             # resample audio to the required sample rate
-            resampled_buffer, resampling_state = audioop.ratecv(
-                buffer, source.SAMPLE_WIDTH, 1, source.SAMPLE_RATE, snowboy_sample_rate, resampling_state)
+            resampled_buffer = dsp.resample(
+                buffer, source.SAMPLE_WIDTH, 1, source.SAMPLE_RATE, snowboy_sample_rate)
             resampled_frames.append(resampled_buffer)
             if time.time() - last_check > check_interval:
                 # run Snowboy on the resampled audio
@@ -426,7 +519,7 @@ class Recognizer(AudioSource):
         """
         Records a single phrase from ``source`` (an ``AudioSource`` instance) into an ``AudioData`` instance, which it returns.
 
-        This is done by waiting until the audio has an energy above ``recognizer_instance.energy_threshold`` (the user has started speaking), and then recording until it encounters ``recognizer_instance.pause_threshold`` seconds of non-speaking or there is no more audio input. The ending silence is not included.
+        This is done by waiting until the audio has an energy above ``recognizer_instance.energy_threshold`` (the user has started speaking), and then recording until it encounters ``recognizer_instance.pause_threshold`` seconds of non-speaking or there is no more audio input. The ending silence is not included. If ``recognizer_instance.vad`` is set, that ``VoiceActivityDetector`` decides what counts as speaking instead of the energy threshold.
 
         The ``timeout`` parameter is the maximum number of seconds that this will wait for a phrase to start before giving up and throwing an ``speech_recognition.WaitTimeoutError`` exception. If ``timeout`` is ``None``, there will be no wait timeout.
 
@@ -482,18 +575,8 @@ class Recognizer(AudioSource):
                         frames.popleft()
 
                     # detect whether speaking has started on audio input
-                    # energy of the audio signal
-                    energy = audioop.rms(buffer, source.SAMPLE_WIDTH)
-                    if energy > self.energy_threshold:
+                    if self.is_speech(buffer, source, adjust_threshold=True):
                         break
-
-                    # dynamically adjust the energy threshold using asymmetric weighted average
-                    if self.dynamic_energy_threshold:
-                        # account for different chunk sizes and rates
-                        damping = self.dynamic_energy_adjustment_damping ** seconds_per_buffer
-                        target_energy = energy * self.dynamic_energy_ratio
-                        self.energy_threshold = self.energy_threshold * \
-                            damping + target_energy * (1 - damping)
             else:
                 # read audio input until the hotword is said
                 snowboy_location, snowboy_hot_word_files = snowboy_configuration
@@ -520,9 +603,7 @@ class Recognizer(AudioSource):
                 phrase_count += 1
 
                 # check if speaking has stopped for longer than the pause threshold on the audio input
-                # unit energy of the audio signal within the buffer
-                energy = audioop.rms(buffer, source.SAMPLE_WIDTH)
-                if energy > self.energy_threshold:
+                if self.is_speech(buffer, source):
                     pause_count = 0
                 else:
                     pause_count += 1
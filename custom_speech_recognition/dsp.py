@@ -0,0 +1,193 @@
+"""NumPy implementations of the ``audioop`` operations used by this package.
+
+``audioop`` was removed in Python 3.13. These functions take and return little-endian signed PCM ``bytes`` just like their ``audioop`` counterparts, and read their input through ``np.frombuffer`` views instead of copying it sample by sample.
+"""
+
+import math
+
+import numpy as np
+
+_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+
+
+def _check_width(width):
+    assert width in (1, 2, 3, 4), "Sample width must be between 1 and 4 inclusive"
+
+
+def to_array(fragment, width):
+    """
+    Returns the samples in ``fragment`` as a NumPy array. For 8, 16 and 32-bit audio this is a read-only view of ``fragment``; 24-bit samples are expanded into ``int32``.
+    """
+    _check_width(width)
+    if width == 3:
+        return expand_24_to_32(fragment)
+    return np.frombuffer(fragment, dtype=_DTYPES[width])
+
+
+def from_array(samples, width):
+    """
+    Returns ``samples`` (integers in the range of ``width``-byte audio) as a byte string of ``width``-byte samples.
+    """
+    _check_width(width)
+    if width == 3:
+        return np.asarray(samples, dtype="<i4").view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    return np.asarray(samples, dtype=_DTYPES[width]).tobytes()
+
+
+def expand_24_to_32(fragment):
+    """
+    Returns the 24-bit samples in ``fragment`` as sign-extended ``int32`` values.
+    """
+    data = np.frombuffer(fragment, dtype=np.uint8)
+    data = data[:len(data) - len(data) % 3].reshape(-1, 3)
+    # place the 3 bytes in the top of a 32-bit word, then shift back down to sign extend
+    samples = (data[:, 0].astype(np.uint32) << 8) | (data[:, 1].astype(np.uint32) << 16) | (data[:, 2].astype(np.uint32) << 24)
+    return samples.view(np.int32) >> 8
+
+
+def rms(fragment, width):
+    """
+    Returns the root-mean-square of the samples in ``fragment``, like ``audioop.rms``.
+    """
+    samples = to_array(fragment, width)
+    if len(samples) == 0:
+        return 0
+    samples = samples.astype(np.float64)
+    return int(math.sqrt(np.dot(samples, samples) / len(samples)))
+
+
+def _clip(samples, width):
+    limit = 1 << (8 * width - 1)
+    return np.clip(samples, -limit, limit - 1)
+
+
+def bias(fragment, width, bias):
+    """
+    Returns ``fragment`` with ``bias`` added to every sample, wrapping around on overflow like ``audioop.bias``.
+    """
+    samples = to_array(fragment, width)
+    # integer addition in the sample's own dtype wraps around exactly like audioop does
+    samples = samples + np.array(bias, dtype=np.int64).astype(samples.dtype)
+    if width == 3:
+        samples = (samples << 8) >> 8
+    return from_array(samples, width)
+
+
+def add(fragment1, fragment2, width):
+    """
+    Returns the sample-wise sum of two fragments, clipped to the range of ``width``-byte samples like ``audioop.add``.
+    """
+    samples = to_array(fragment1, width).astype(np.int64) + to_array(fragment2, width)
+    return from_array(_clip(samples, width), width)
+
+
+def lin2lin(fragment, width, new_width):
+    """
+    Converts samples between sample widths by keeping their most significant bytes, like ``audioop.lin2lin``.
+    """
+    if width == new_width:
+        return bytes(fragment)
+    samples = to_array(fragment, width).astype(np.int32)
+    shift = 8 * (new_width - width)
+    samples = samples << shift if shift > 0 else samples >> -shift
+    return from_array(samples, new_width)
+
+
+def byteswap(fragment, width):
+    """
+    Reverses the byte order of every sample in ``fragment``.
+    """
+    _check_width(width)
+    if width != 3:
+        return np.frombuffer(fragment, dtype=_DTYPES[width]).byteswap().tobytes()
+    data = np.frombuffer(fragment, dtype=np.uint8)
+    return data[:len(data) - len(data) % width].reshape(-1, width)[:, ::-1].tobytes()
+
+
+def tomono(fragment, width, lfactor, rfactor):
+    """
+    Converts stereo ``fragment`` to mono as ``left * lfactor + right * rfactor``, clipped like ``audioop.tomono``.
+    """
+    samples = to_array(fragment, width).reshape(-1, 2)
+    if isinstance(lfactor, int) and isinstance(rfactor, int):
+        mono = np.add(np.multiply(samples[:, 0], lfactor, dtype=np.int64),
+                      np.multiply(samples[:, 1], rfactor, dtype=np.int64))
+    else:
+        mono = np.floor(samples[:, 0] * float(lfactor) + samples[:, 1] * float(rfactor))
+    return from_array(_clip(mono, width), width)
+
+
+def downmix(samples, channels):
+    """
+    Averages the interleaved channels of the NumPy array ``samples`` into a ``float32`` mono array.
+    """
+    if channels == 1:
+        return np.asarray(samples, dtype=np.float32)
+    samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels)
+    return samples.mean(axis=1, dtype=np.float32)
+
+
+_filter_cache = {}
+
+
+def _polyphase_filter(up, down, taps_per_phase):
+    key = (up, down, taps_per_phase)
+    if key not in _filter_cache:
+        # windowed-sinc low-pass at the lower of the two Nyquist frequencies, designed at the upsampled rate
+        taps = int(math.ceil(taps_per_phase * max(1.0, down / up)))
+        length = taps * up
+        # an odd number of taps keeps the filter delay a whole number of samples, the last tap is zero otherwise
+        odd_length = length if length % 2 else length - 1
+        cutoff = 1.0 / max(up, down)
+        t = np.arange(length) - (odd_length - 1) / 2.0
+        window = np.zeros(length)
+        window[:odd_length] = np.kaiser(odd_length, 8.0)
+        h = up * cutoff * np.sinc(cutoff * t) * window
+        # phases[p, k] is the tap applied to input sample ``base - k`` for output phase ``p``, stored reversed to match ascending windows
+        phases = h.reshape(taps, up).T[:, ::-1].astype(np.float32)
+        _filter_cache[key] = (taps, phases, (odd_length - 1) // 2)
+    return _filter_cache[key]
+
+
+def resample_array(samples, in_rate, out_rate, taps_per_phase=16):
+    """
+    Resamples the mono NumPy array ``samples`` from ``in_rate`` to ``out_rate`` Hz with a polyphase FIR filter, returning ``float32`` samples.
+
+    Only the output samples are ever computed, so the cost is ``len(output) * taps`` multiply-adds whatever the ratio between the two rates.
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    if in_rate == out_rate or len(samples) == 0:
+        return samples
+    g = math.gcd(int(in_rate), int(out_rate))
+    up, down = int(out_rate) // g, int(in_rate) // g
+    taps, phases, delay = _polyphase_filter(up, down, taps_per_phase)
+
+    output_count = int(math.ceil(len(samples) * up / down))
+    padded = np.concatenate((np.zeros(taps - 1, dtype=np.float32), samples,
+                             np.zeros(delay // up + 2, dtype=np.float32)))
+    windows = np.lib.stride_tricks.sliding_window_view(padded, taps)
+    output = np.empty(output_count, dtype=np.float32)
+
+    # every ``up``-th output sample uses the same filter phase and starts ``down`` input samples later than the previous one,
+    # so each phase is a single matrix-vector product over a strided view of the input windows
+    for first in range(min(up, output_count)):
+        position = first * down + delay
+        count = len(range(first, output_count, up))
+        base = position // up
+        output[first::up] = windows[base:base + count * down:down] @ phases[position % up]
+    return output
+
+
+def resample(fragment, width, nchannels, in_rate, out_rate):
+    """
+    Resamples interleaved ``fragment`` from ``in_rate`` to ``out_rate`` Hz, returning bytes of the same sample width and channel count.
+
+    Unlike ``audioop.ratecv`` this keeps no state between calls, so every fragment is filtered independently.
+    """
+    if in_rate == out_rate:
+        return bytes(fragment)
+    samples = to_array(fragment, width)
+    samples = samples[:len(samples) - len(samples) % nchannels].reshape(-1, nchannels)
+    channels = [resample_array(samples[:, channel], in_rate, out_rate) for channel in range(nchannels)]
+    resampled = np.stack(channels, axis=1).reshape(-1)
+    return from_array(_clip(np.round(resampled).astype(np.int64), width), width)
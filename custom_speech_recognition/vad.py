@@ -0,0 +1,215 @@
+import numpy as np
+
+from . import dsp
+
+
+class VoiceActivityDetector(object):
+    """
+    Decides whether buffers of audio contain speech. Detectors are stateful and are meant to be fed consecutive buffers from one stream, so a single instance should not be shared between streams.
+    """
+
+    def is_speech(self, buffer, sample_rate, sample_width, channels=1):
+        """
+        Returns whether the raw PCM ``buffer`` contains speech.
+        """
+        raise NotImplementedError("this is an abstract class")
+
+    def adapt(self, buffer, sample_rate, sample_width, channels=1):
+        """
+        Learns the background noise level from ``buffer``, which is known not to contain speech.
+        """
+        pass
+
+    def reset(self):
+        pass
+
+
+class EnergyVAD(VoiceActivityDetector):
+    """
+    Treats any buffer whose RMS energy is above ``energy_threshold`` as speech, optionally raising or lowering the threshold to follow the ambient energy. This is the same test ``Recognizer.listen`` does without a detector.
+    """
+
+    def __init__(self, energy_threshold=300, dynamic_energy_threshold=True, damping=0.15, ratio=1.5):
+        self.energy_threshold = energy_threshold
+        self.dynamic_energy_threshold = dynamic_energy_threshold
+        self.damping = damping
+        self.ratio = ratio
+
+    def is_speech(self, buffer, sample_rate, sample_width, channels=1):
+        energy = dsp.rms(buffer, sample_width)
+        if energy > self.energy_threshold:
+            return True
+        if self.dynamic_energy_threshold:
+            self._update_threshold(energy, buffer, sample_rate, sample_width, channels)
+        return False
+
+    def adapt(self, buffer, sample_rate, sample_width, channels=1):
+        self._update_threshold(dsp.rms(buffer, sample_width), buffer, sample_rate, sample_width, channels)
+
+    def _update_threshold(self, energy, buffer, sample_rate, sample_width, channels):
+        # asymmetric weighted average, accounting for different buffer sizes and rates
+        seconds_per_buffer = len(buffer) / float(sample_width * channels * sample_rate)
+        damping = self.damping ** seconds_per_buffer
+        self.energy_threshold = self.energy_threshold * damping + energy * self.ratio * (1 - damping)
+
+
+class FrameVAD(VoiceActivityDetector):
+    """
+    Base class for detectors that classify fixed-length frames. Buffers are split into ``frame_ms`` frames (the remainder is carried over to the next call), and a buffer is speech if any of its frames is, or if a speech frame was seen within the last ``hangover_frames`` frames.
+    """
+
+    def __init__(self, frame_ms=20, hangover_frames=8):
+        self.frame_ms = frame_ms
+        self.hangover_frames = hangover_frames
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._hangover = 0
+
+    def to_mono(self, buffer, sample_rate, sample_width, channels):
+        """
+        Returns ``buffer`` as ``float32`` mono samples in [-1, 1], along with their sample rate.
+        """
+        samples = dsp.to_array(buffer, sample_width)
+        return dsp.downmix(samples, channels) / float(1 << (8 * sample_width - 1)), sample_rate
+
+    def frames(self, buffer, sample_rate, sample_width, channels):
+        samples, sample_rate = self.to_mono(buffer, sample_rate, sample_width, channels)
+        samples = np.concatenate((self._pending, samples))
+        frame_length = sample_rate * self.frame_ms // 1000
+        count = len(samples) // frame_length
+        self._pending = samples[count * frame_length:]
+        return samples[:count * frame_length].reshape(count, frame_length), sample_rate
+
+    def is_speech(self, buffer, sample_rate, sample_width, channels=1):
+        speech = False
+        frames, sample_rate = self.frames(buffer, sample_rate, sample_width, channels)
+        for frame in frames:
+            if self.classify(frame, sample_rate):
+                speech = True
+                self._hangover = self.hangover_frames
+            elif self._hangover > 0:
+                self._hangover -= 1
+                speech = True
+        return speech
+
+    def adapt(self, buffer, sample_rate, sample_width, channels=1):
+        frames, sample_rate = self.frames(buffer, sample_rate, sample_width, channels)
+        for frame in frames:
+            self.learn_noise(frame, sample_rate)
+
+    def classify(self, frame, sample_rate):
+        raise NotImplementedError("this is an abstract class")
+
+    def learn_noise(self, frame, sample_rate):
+        pass
+
+    def reset(self):
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._hangover = 0
+
+
+class SpectralVAD(FrameVAD):
+    """
+    Classifies frames using the energy in the speech band (``low_hz`` to ``high_hz``) relative to a tracked noise floor, together with the spectral flatness of that band. Broadband noise has a flat spectrum while voiced speech has harmonic peaks, so a frame is speech when it is more than ``snr_threshold`` dB above the noise floor and its flatness is below ``flatness_threshold``.
+
+    The noise floor follows quieter frames immediately and louder non-speech frames with smoothing ``noise_adaptation``.
+    """
+
+    def __init__(self, frame_ms=20, hangover_frames=8, snr_threshold=9.0, flatness_threshold=0.4,
+                 low_hz=300, high_hz=3400, noise_adaptation=0.05, min_energy=1e-7):
+        super().__init__(frame_ms, hangover_frames)
+        self.snr_threshold = snr_threshold
+        self.flatness_threshold = flatness_threshold
+        self.low_hz = low_hz
+        self.high_hz = high_hz
+        self.noise_adaptation = noise_adaptation
+        self.min_energy = min_energy
+        self.noise_energy = None
+        self._band = {}
+
+    def band_power(self, frame, sample_rate):
+        key = (len(frame), sample_rate)
+        if key not in self._band:
+            frequencies = np.fft.rfftfreq(len(frame), 1.0 / sample_rate)
+            self._band[key] = (np.hanning(len(frame)).astype(np.float32),
+                               (frequencies >= self.low_hz) & (frequencies <= self.high_hz))
+        window, band = self._band[key]
+        spectrum = np.fft.rfft(frame * window)
+        return (spectrum.real ** 2 + spectrum.imag ** 2)[band]
+
+    def classify(self, frame, sample_rate):
+        power = self.band_power(frame, sample_rate)
+        energy = float(power.mean()) + self.min_energy
+        if self.noise_energy is None:
+            self.noise_energy = energy
+            return False
+
+        snr = 10 * np.log10(energy / self.noise_energy)
+        flatness = float(np.exp(np.mean(np.log(power + self.min_energy)))) / energy
+        if snr > self.snr_threshold and flatness < self.flatness_threshold:
+            return True
+
+        self._track_noise(energy)
+        return False
+
+    def learn_noise(self, frame, sample_rate):
+        energy = float(self.band_power(frame, sample_rate).mean()) + self.min_energy
+        if self.noise_energy is None:
+            self.noise_energy = energy
+        else:
+            self._track_noise(energy)
+
+    def _track_noise(self, energy):
+        if energy < self.noise_energy:
+            self.noise_energy = energy
+        else:
+            self.noise_energy += self.noise_adaptation * (energy - self.noise_energy)
+
+
+class WebRTCVAD(FrameVAD):
+    """
+    Classifies frames with the WebRTC voice activity detector from the ``webrtcvad`` package. ``aggressiveness`` ranges from 0 (least likely to drop speech) to 3 (most likely to drop non-speech).
+
+    Audio is converted to 16-bit mono, and resampled to 16 kHz if its rate is not one WebRTC supports.
+
+    This will throw an ``AttributeError`` if ``webrtcvad`` isn't installed.
+    """
+
+    SAMPLE_RATES = (8000, 16000, 32000, 48000)
+
+    def __init__(self, aggressiveness=2, frame_ms=30, hangover_frames=8):
+        assert frame_ms in (10, 20, 30), "WebRTC frames must be 10, 20 or 30 ms long"
+        super().__init__(frame_ms, hangover_frames)
+        self.vad = self.get_webrtcvad().Vad(aggressiveness)
+
+    @staticmethod
+    def get_webrtcvad():
+        try:
+            import webrtcvad
+        except ImportError:
+            raise AttributeError("Could not find webrtcvad; check installation")
+        return webrtcvad
+
+    def to_mono(self, buffer, sample_rate, sample_width, channels):
+        samples, sample_rate = super().to_mono(buffer, sample_rate, sample_width, channels)
+        if sample_rate not in self.SAMPLE_RATES:
+            samples, sample_rate = dsp.resample_array(samples, sample_rate, 16000), 16000
+        return samples, sample_rate
+
+    def classify(self, frame, sample_rate):
+        pcm = np.clip(np.round(frame * 32768), -32768, 32767).astype(np.int16).tobytes()
+        return self.vad.is_speech(pcm, sample_rate)
+
+
+BACKENDS = {
+    "energy": EnergyVAD,
+    "spectral": SpectralVAD,
+    "webrtc": WebRTCVAD,
+}
+
+
+def create_vad(backend, **options):
+    """
+    Returns a new detector for the backend named ``backend`` (one of ``BACKENDS``), constructed with ``options``.
+    """
+    assert backend in BACKENDS, "Unknown voice activity detector backend {!r}".format(backend)
+    return BACKENDS[backend](**options)
@@ -0,0 +1,48 @@
+"""Starts several app.py worker processes that share sessions through a Redis (or Redis-compatible) server.
+
+Worker ``i`` listens on ``--port + i``. Put a load balancer with sticky routing (e.g. nginx ``ip_hash``) in front of
+them so each Socket.IO connection stays on one worker; sessions whose pipeline runs on another worker are reached
+through the message queue.
+
+Run from the repository root: ``python run_workers.py --workers 4 --message-queue redis://127.0.0.1:6379/0``
+"""
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000, help="port of the first worker")
+    parser.add_argument("--message-queue", default="redis://127.0.0.1:6379/0")
+    parser.add_argument("--max-sessions", type=int, default=16, help="sessions per worker before placement avoids it")
+    args = parser.parse_args()
+
+    processes = []
+    for i in range(args.workers):
+        port = args.port + i
+        env = dict(os.environ, MESSAGE_QUEUE=args.message_queue, SESSION_STORE=args.message_queue,
+                   WORKER_ID=f'{socket.gethostname()}-{port}', WORKER_URL=f'http://{args.host}:{port}',
+                   MAX_SESSIONS_PER_WORKER=str(args.max_sessions))
+        processes.append(subprocess.Popen(
+            [sys.executable, "app.py", "--host", args.host, "--port", str(port)],
+            cwd=os.path.dirname(os.path.abspath(__file__)), env=env))
+        print(f"[INFO] Worker {i} listening on http://{args.host}:{port}")
+
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.send_signal(signal.SIGINT)
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
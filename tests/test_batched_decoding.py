@@ -0,0 +1,103 @@
+"""Batched decoding in TranscriberModels: live lanes with different prompts must still share one decoder pass.
+
+Run from the repository root: ``python -m pytest tests``
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import TranscriberModels  # noqa: E402
+from InferenceScheduler import InferenceRequest  # noqa: E402
+
+
+def lane_request(prompt, word_timestamps=False):
+    return InferenceRequest(np.zeros(TranscriberModels.WHISPER_SAMPLE_RATE, dtype=np.float32), prompt, word_timestamps)
+
+
+def test_different_prompts_are_dropped_into_one_group():
+    requests = [lane_request("lane one"), lane_request("lane two"), lane_request(None)]
+    assert TranscriberModels.group_by_prompt(requests) == {None: [0, 1, 2]}
+
+
+def test_shared_prompt_is_kept():
+    requests = [lane_request("same"), lane_request("same")]
+    assert TranscriberModels.group_by_prompt(requests) == {"same": [0, 1]}
+
+
+def test_group_policy_keeps_every_prompt():
+    requests = [lane_request("lane one"), lane_request("lane two"), lane_request("lane one")]
+    assert TranscriberModels.group_by_prompt(requests, "group") == {"lane one": [0, 2], "lane two": [1]}
+
+
+class FakeWhisperModel:
+    """Counts encoder and decoder passes; calling it runs both, the way ``whisper.model.Whisper`` does."""
+
+    def __init__(self):
+        self.device = "cpu"
+        self.encoder_batches = []
+        self.decoder_calls = 0
+
+    def embed_audio(self, mel):
+        self.encoder_batches.append(len(mel))
+        return mel
+
+    def decoder(self, tokens, audio_features):
+        self.decoder_calls += 1
+        return audio_features
+
+    def __call__(self, mel, tokens):
+        return self.decoder(tokens, self.embed_audio(mel))
+
+
+def fake_transcriber(monkeypatch, decode_calls):
+    torch = pytest.importorskip("torch")
+
+    def decode(model, audio_features, options):
+        decode_calls.append((len(audio_features), options.prompt))
+        return [SimpleNamespace(text=" hello", tokens=[1, 2], no_speech_prob=0.0, avg_logprob=-0.1)
+                for _ in range(len(audio_features))]
+
+    def find_alignment(model, tokenizer, text_tokens, mel, num_frames):
+        # the real one runs ``model(mel, tokens)`` and reads the cross-attention weights off the decoder
+        model(mel.unsqueeze(0), torch.tensor([text_tokens]))
+        return [SimpleNamespace(word=" hello", start=0.1, end=0.5)]
+
+    # stands in for whisper, only the model passes are counted
+    fake_whisper = SimpleNamespace(
+        pad_or_trim=lambda audio: audio,
+        log_mel_spectrogram=lambda audio: torch.zeros(80, 3000),
+        DecodingOptions=lambda **options: SimpleNamespace(**options),
+        decode=decode,
+        audio=SimpleNamespace(HOP_LENGTH=160),
+        timing=SimpleNamespace(find_alignment=find_alignment))
+    monkeypatch.setattr(TranscriberModels, "torch", torch)
+    monkeypatch.setattr(TranscriberModels, "whisper", fake_whisper)
+    transcriber = TranscriberModels.WhisperTranscriber.__new__(TranscriberModels.WhisperTranscriber)
+    transcriber.audio_model = FakeWhisperModel()
+    transcriber.tokenizer = SimpleNamespace(eot=50256)
+    return transcriber
+
+
+def test_lanes_with_different_prompts_share_one_decode(monkeypatch):
+    decode_calls = []
+    transcriber = fake_transcriber(monkeypatch, decode_calls)
+
+    results = transcriber.transcribe_batch([lane_request("lane one"), lane_request("lane two")])
+
+    assert results == ["hello", "hello"]
+    assert decode_calls == [(2, None)]
+
+
+def test_word_timestamps_reuse_the_batch_encoder_pass(monkeypatch):
+    transcriber = fake_transcriber(monkeypatch, [])
+
+    results = transcriber.transcribe_batch([lane_request("lane one", True), lane_request("lane two", True)])
+
+    assert [[segment.words for segment in result] for result in results] == [[[(" hello", 0.1, 0.5)]]] * 2
+    # one batched encoder pass, the alignments only run the decoder
+    assert transcriber.audio_model.encoder_batches == [2]
+    assert transcriber.audio_model.decoder_calls == 2
@@ -0,0 +1,89 @@
+"""LLMClient.stream_chat_completion against the SSE stub server in benchmarks/stub_llm_server.py.
+
+Run from the repository root: ``python -m pytest tests``
+"""
+import os
+import sys
+
+import httpx
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+import LLMClient  # noqa: E402
+from stub_llm_server import StubLLMServer  # noqa: E402
+
+TIMEOUT = 10
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(LLMClient, "RETRY_BACKOFF_SECONDS", 0)
+    client = LLMClient.LLMClient(api_base=None, max_retries=2)
+    yield client
+    if client._http_client is not None:
+        client.run(client._http_client.aclose()).result(TIMEOUT)
+    client.loop.call_soon_threadsafe(client.loop.stop)
+
+
+def start_stub(client, **options):
+    # the stub serves from the client's own loop, next to the requests it answers
+    stub = StubLLMServer(rate=1000.0, first_token_delay=0, **options)
+    port = client.run(stub.start()).result(TIMEOUT)
+    client.api_base = f'http://127.0.0.1:{port}/v1'
+    return stub
+
+
+def stream(client, tokens=None):
+    # ``tokens`` keeps what was streamed even when the request then fails
+    tokens = [] if tokens is None else tokens
+
+    async def collect():
+        async for token in client.stream_chat_completion(MESSAGES, "stub"):
+            tokens.append(token)
+        return tokens
+
+    return client.run(collect()).result(TIMEOUT)
+
+
+def test_streams_every_token_and_skips_chunks_without_choices(client):
+    stub = start_stub(client, tokens=5, token_text=" hi", usage_chunk=True)
+    assert stream(client) == [" hi"] * 5
+    assert stub.requests == 1
+
+
+def test_stops_at_done(client):
+    start_stub(client, tokens=3, events_after_done=2)
+    assert stream(client) == [" token"] * 3
+
+
+def test_retries_unavailable_before_the_first_token(client):
+    stub = start_stub(client, tokens=3, fail_requests=1, fail_status=503)
+    assert stream(client) == [" token"] * 3
+    assert stub.requests == 2
+
+
+def test_gives_up_after_max_retries(client):
+    stub = start_stub(client, tokens=3, fail_requests=5, fail_status=503)
+    with pytest.raises(LLMClient.RetryableStatusError):
+        stream(client)
+    assert stub.requests == 3
+
+
+def test_does_not_retry_once_tokens_were_streamed(client):
+    stub = start_stub(client, tokens=5, drop_after=2)
+    tokens = []
+    with pytest.raises(httpx.TransportError):
+        stream(client, tokens)
+    assert tokens == [" token"] * 2
+    assert stub.requests == 1
+
+
+def test_reuses_the_connection_across_requests(client):
+    stub = start_stub(client, tokens=3)
+    for _ in range(3):
+        assert stream(client) == [" token"] * 3
+    assert stub.requests == 3
+    assert stub.connections == 1